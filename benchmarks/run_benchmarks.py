@@ -0,0 +1,251 @@
+"""
+Per-stage benchmarks of the conversion on the synthetic corpus of synthetic_pdf.
+
+    $ python benchmarks/run_benchmarks.py --output results.json
+    $ python benchmarks/run_benchmarks.py --baseline benchmarks/baseline.json
+
+Each stage is timed `repeat` times and the fastest is reported, then it is run once more under tracemalloc for the
+peak of the memory allocated by Python. The stages running poppler are skipped when it is not installed, and blank
+page images are drawn in place of the rasterized ones.
+With a baseline, a stage slower or larger than the baseline beyond the tolerance is reported as a regression and
+the exit status is 1.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from itertools import islice
+
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import paper2html  # noqa: E402
+from paper2html import commands  # noqa: E402
+from paper2html.html_paper import HtmlPaper  # noqa: E402
+from paper2html.paper_miner import PaperReader  # noqa: E402
+from synthetic_pdf import CORPUS, make_corpus  # noqa: E402
+
+RESULT_FORMAT = 1
+
+
+class StageSkipped(Exception):
+    pass
+
+
+class Document:
+    """
+    A pdf of the corpus in its own working directory, with the results of the stages used by the later ones.
+    """
+    def __init__(self, name, pdf_path, working_dir):
+        self.name = name
+        self.pdf_path = pdf_path
+        self.working_dir = working_dir
+        self.fixed_dir, self.image_dir, self.temp_dir = commands.init_working_dir(working_dir, pdf_path)
+        self.paper = None
+
+    def draw_blank_page_images(self):
+        for page_n, page in enumerate(PaperReader._pdf_pages(self.pdf_path)):
+            x0, y0, x1, y1 = page.mediabox
+            Image.new('RGB', (int(x1 - x0) * 200 // 72, int(y1 - y0) * 200 // 72), 'white') \
+                .save(os.path.join(self.image_dir, 'pdf-%02d.png' % (page_n + 1)))
+
+
+# each stage prepares a document untimed and returns the function to measure
+
+def clean_pdf_stage(document):
+    if not shutil.which('pdftocairo'):
+        raise StageSkipped('pdftocairo is not installed')
+    return lambda: commands.clean_pdf(document.pdf_path, document.fixed_dir)
+
+
+def rasterize_stage(document):
+    if not shutil.which('pdftoppm'):
+        raise StageSkipped('pdftoppm is not installed')
+    import pdf2image
+    shutil.rmtree(document.image_dir)
+    os.mkdir(document.image_dir)
+    return lambda: pdf2image.convert_from_path(document.pdf_path, output_folder=document.image_dir,
+                                               output_file='pdf', paths_only=True, fmt='png')
+
+
+def _reader_with_layout_params():
+    reader = PaperReader()
+    # set by PaperReader.iter_pages before the pages are read
+    reader.laparams.boxes_flow = 1.0
+    return reader
+
+
+def zap_stage(document):
+    reader = _reader_with_layout_params()
+    recorded_pages = list(islice(reader._recorded_pages(document.pdf_path), reader.zap_max + 1))
+    return lambda: reader._zap(recorded_pages)
+
+
+def read_stage(document):
+    def read():
+        document.paper = PaperReader().read(document.pdf_path)
+    return read
+
+
+def recognize_stage(document):
+    reader = _reader_with_layout_params()
+    recorded_pages = list(reader._recorded_pages(document.pdf_path))
+    reader._zap(recorded_pages[:reader.zap_max + 1])
+    pages = [reader._make_page(recorded_page, page_number) for page_number, recorded_page in enumerate(recorded_pages)]
+
+    def recognize():
+        for page in pages:
+            page.recognize(reader.line_height, reader.line_margin)
+    return recognize
+
+
+def export_stage(document):
+    if document.paper is None:
+        raise StageSkipped('the read stage did not run')
+    return HtmlPaper(document.paper, document.name).export
+
+
+STAGES = {
+    'clean_pdf': clean_pdf_stage,
+    'rasterize': rasterize_stage,
+    'zap': zap_stage,
+    'read': read_stage,
+    'recognize': recognize_stage,
+    'export': export_stage,
+}
+
+
+def measure(stage, document, repeat):
+    """
+    @return: dict of the fastest 'seconds' and the 'peak_bytes' of the stage, or of the reason it is 'skipped'.
+    """
+    try:
+        seconds = []
+        for _ in range(repeat):
+            run = stage(document)
+            start = time.perf_counter()
+            run()
+            seconds.append(time.perf_counter() - start)
+        run = stage(document)
+        tracemalloc.start()
+        try:
+            run()
+            _, peak_bytes = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    except StageSkipped as e:
+        return {'skipped': str(e)}
+    return {'seconds': min(seconds), 'peak_bytes': peak_bytes}
+
+
+def _describe(result):
+    if 'skipped' in result:
+        return f"skipped: {result['skipped']}"
+    return f"{result['seconds']:9.4f} s {result['peak_bytes'] / 2 ** 20:9.2f} MB"
+
+
+def run_benchmarks(work_dir, scale=1, repeat=3, documents=None, stages=None):
+    corpus_dir = os.path.join(work_dir, 'corpus')
+    output_dir = os.path.join(work_dir, 'outputs')
+    os.makedirs(corpus_dir, exist_ok=True)
+    os.makedirs(output_dir, exist_ok=True)
+    results = {}
+    for name, pdf_path in make_corpus(corpus_dir, scale, documents).items():
+        document = Document(name, pdf_path, output_dir)
+        document_results = {'pages': sum(1 for _ in PaperReader._pdf_pages(pdf_path)), 'stages': {}}
+        for stage_name, stage in STAGES.items():
+            if stages and stage_name not in stages:
+                continue
+            # the messages of the conversion are not a part of the results
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = measure(stage, document, repeat)
+            if stage_name == 'rasterize' and 'skipped' in result:
+                document.draw_blank_page_images()
+            document_results['stages'][stage_name] = result
+            print(f"{name:16} {stage_name:10} {_describe(result)}", file=sys.stderr)
+        results[name] = document_results
+    return {
+        'format': RESULT_FORMAT,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'paper2html': paper2html.__version__},
+        'settings': {'scale': scale, 'repeat': repeat},
+        'documents': results,
+    }
+
+
+def compare(results, baseline, time_tolerance=0.25, memory_tolerance=0.25, min_seconds=0.01):
+    """
+    @param time_tolerance, memory_tolerance:
+        Rates of increase from the baseline allowed.
+    @param min_seconds:
+        Increases of time shorter than this are not regressions, as they are in the noise of the measurement.
+    @return: list of the messages of the regressions.
+    """
+    if baseline.get('settings') != results.get('settings'):
+        return [f"the settings {results.get('settings')} differ from the baseline {baseline.get('settings')}"]
+    regressions = []
+    for name, document in results['documents'].items():
+        base_stages = baseline['documents'].get(name, {}).get('stages', {})
+        for stage_name, result in document['stages'].items():
+            base = base_stages.get(stage_name)
+            if not base or 'seconds' not in base or 'seconds' not in result:
+                continue
+            if result['seconds'] > base['seconds'] * (1 + time_tolerance) and \
+                    result['seconds'] - base['seconds'] > min_seconds:
+                regressions.append(f"{name}/{stage_name}: {result['seconds']:.4f} s "
+                                   f"(baseline {base['seconds']:.4f} s)")
+            if result['peak_bytes'] > base['peak_bytes'] * (1 + memory_tolerance):
+                regressions.append(f"{name}/{stage_name}: {result['peak_bytes']} bytes "
+                                   f"(baseline {base['peak_bytes']} bytes)")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", type=str, default=None, help="json file of the results. default is stdout.")
+    parser.add_argument("--baseline", type=str, default=None, help="json file of the results to compare with.")
+    parser.add_argument("--scale", type=int, default=1, help="multiplier of the number of pages of the corpus.")
+    parser.add_argument("--repeat", type=int, default=3, help="number of times each stage is timed.")
+    parser.add_argument("--documents", nargs='+', choices=list(CORPUS), default=None)
+    parser.add_argument("--stages", nargs='+', choices=list(STAGES), default=None)
+    parser.add_argument("--time-tolerance", type=float, default=0.25)
+    parser.add_argument("--memory-tolerance", type=float, default=0.25)
+    parser.add_argument("--work-dir", type=str, default=None, help="directory of the corpus and the outputs. "
+                                                                   "default is a temporary directory.")
+    args = parser.parse_args(argv)
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='paper2html-benchmarks-')
+    try:
+        results = run_benchmarks(work_dir, args.scale, args.repeat, args.documents, args.stages)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.time_tolerance, args.memory_tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
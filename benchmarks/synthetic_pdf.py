@@ -0,0 +1,251 @@
+"""
+Deterministic generator of synthetic papers for the benchmarks.
+The pdfs are written without any dependency, with the standard Helvetica fonts, so that the same arguments always
+make the same bytes.
+"""
+import random
+
+PAGE_WIDTH, PAGE_HEIGHT = 612, 792
+MARGIN = 54
+GUTTER = 18
+FONT_SIZE = 10
+LINE_HEIGHT = 12
+# wider than the average width of the Helvetica characters, so that the lines fit in the columns
+CHAR_WIDTH = 0.55 * FONT_SIZE
+
+WORDS = ('the', 'of', 'a', 'model', 'network', 'training', 'data', 'we', 'propose', 'method', 'results', 'show',
+         'that', 'is', 'to', 'in', 'learning', 'adversarial', 'generative', 'loss', 'function', 'layer', 'image',
+         'performance', 'baseline', 'experiments', 'dataset', 'accuracy', 'representation', 'optimization',
+         'gradient', 'distribution', 'sample', 'feature', 'attention', 'encoder', 'decoder', 'parameters')
+MATH = ('x', 'y', 'z', 'W', 'b', 'L', 'p', 'q', 'theta', 'sigma', 'log', 'exp')
+
+# documents of the benchmark corpus. pages are multiplied by the scale of the benchmark
+CORPUS = {
+    'one_column': dict(columns=1, pages=4),
+    'two_columns': dict(columns=2, pages=4),
+    'three_columns': dict(columns=3, pages=4),
+    'equation_dense': dict(columns=2, pages=4, equation_rate=0.5),
+    'vector_figures': dict(columns=2, pages=4, figures_per_page=3),
+    'long_paragraphs': dict(columns=1, pages=4, paragraph_lines=(60, 120)),
+}
+
+
+def _escape(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+class _PageWriter:
+    """
+    Content stream of a page, filled column by column from the top.
+    """
+    def __init__(self, columns):
+        self.columns = columns
+        self.column_width = (PAGE_WIDTH - 2 * MARGIN - (columns - 1) * GUTTER) / columns
+        self.column = 0
+        self.y = PAGE_HEIGHT - MARGIN
+        self.operations = []
+
+    @property
+    def left(self):
+        return MARGIN + self.column * (self.column_width + GUTTER)
+
+    @property
+    def max_chars(self):
+        return int(self.column_width / CHAR_WIDTH)
+
+    def has_room(self, height):
+        return self.y - height >= MARGIN
+
+    def next_column(self):
+        """
+        @return: False if the page is full.
+        """
+        if self.column + 1 >= self.columns:
+            return False
+        self.column += 1
+        self.y = PAGE_HEIGHT - MARGIN
+        return True
+
+    def text(self, text, x_offset=0, font='F1'):
+        self.y -= LINE_HEIGHT
+        self.operations.append(f'BT /{font} {FONT_SIZE} Tf {self.left + x_offset:.2f} {self.y:.2f} Td '
+                               f'({_escape(text)}) Tj ET')
+
+    def centered_text(self, text):
+        self.text(text, max(0., (self.column_width - len(text) * CHAR_WIDTH) / 2))
+
+    def skip(self, height):
+        self.y -= height
+
+    def figure(self, rnd, height):
+        """
+        A line plot drawn with paths: the frame, the ticks and a few bezier curves.
+        """
+        left, bottom = self.left + 4, self.y - height
+        width = self.column_width - 8
+        ops = [f'0.5 w {left:.2f} {bottom:.2f} {width:.2f} {height - 4:.2f} re S']
+        for k in range(1, 8):
+            x = left + width * k / 8
+            ops.append(f'{x:.2f} {bottom:.2f} m {x:.2f} {bottom + 4:.2f} l S')
+        for _ in range(3):
+            ops.append(f'{rnd.random():.2f} {rnd.random():.2f} {rnd.random():.2f} RG')
+            y = bottom + rnd.uniform(0.1, 0.9) * (height - 4)
+            ops.append(f'{left:.2f} {y:.2f} m')
+            for k in range(4):
+                x0, x1 = left + width * k / 4, left + width * (k + 1) / 4
+                y = bottom + rnd.uniform(0.1, 0.9) * (height - 4)
+                ops.append(f'{x0 + width / 12:.2f} {y + 20:.2f} {x1 - width / 12:.2f} {y - 20:.2f} '
+                           f'{x1:.2f} {y:.2f} c')
+            ops.append('S')
+        ops.append('0 0 0 RG')
+        self.operations.append('q ' + ' '.join(ops) + ' Q')
+        self.y = bottom
+
+
+def _words(rnd, max_chars):
+    words = []
+    length = 0
+    while True:
+        word = rnd.choice(WORDS)
+        if length + len(word) + 1 > max_chars:
+            return ' '.join(words)
+        words.append(word)
+        length += len(word) + 1
+
+
+def _equation(rnd, number):
+    terms = [f'{rnd.choice(MATH)}_{rnd.randint(1, 9)}' for _ in range(rnd.randint(2, 4))]
+    return f'{rnd.choice(MATH)} = ' + ' + '.join(terms) + f'   ({number})'
+
+
+def _page_contents(columns, pages, equation_rate, figures_per_page, paragraph_lines, seed):
+    """
+    @return: list of content streams of the pages.
+    """
+    rnd = random.Random(seed)
+    contents = []
+    page = _PageWriter(columns)
+    counters = {'section': 0, 'equation': 0, 'figure': 0}
+    # lines left of the paragraph being written, which may continue to the next column or page
+    remaining_lines = 0
+
+    def new_page():
+        nonlocal page, figures_left
+        contents.append('\n'.join(page.operations))
+        page = _PageWriter(columns)
+        figures_left = figures_per_page
+        return len(contents) < pages
+
+    def ensure_room(height):
+        """
+        @return: False if the document is complete.
+        """
+        while not page.has_room(height):
+            if not page.next_column() and not new_page():
+                return False
+        return True
+
+    figures_left = figures_per_page
+    first_line = False
+    while len(contents) < pages:
+        if remaining_lines == 0:
+            if figures_left > 0 and rnd.random() < 0.5:
+                figures_left -= 1
+                height = rnd.randint(8, 14) * LINE_HEIGHT
+                if not ensure_room(height + 3 * LINE_HEIGHT):
+                    break
+                page.figure(rnd, height)
+                counters['figure'] += 1
+                page.text(f'Figure {counters["figure"]}. ' + _words(rnd, page.max_chars - 12))
+                page.skip(LINE_HEIGHT)
+                continue
+            if rnd.random() < 0.15:
+                if not ensure_room(3 * LINE_HEIGHT):
+                    break
+                counters['section'] += 1
+                page.skip(LINE_HEIGHT / 2)
+                page.text(f'{counters["section"]}. ' + _words(rnd, page.max_chars // 2).title(), font='F2')
+                page.skip(LINE_HEIGHT / 2)
+                continue
+            if rnd.random() < equation_rate:
+                if not ensure_room(3 * LINE_HEIGHT):
+                    break
+                counters['equation'] += 1
+                page.skip(LINE_HEIGHT / 2)
+                page.centered_text(_equation(rnd, counters['equation']))
+                page.skip(LINE_HEIGHT / 2)
+                continue
+            remaining_lines = rnd.randint(*paragraph_lines)
+            first_line = True
+        if not ensure_room(LINE_HEIGHT):
+            break
+        remaining_lines -= 1
+        if first_line:
+            page.text(_words(rnd, page.max_chars - 3), 3 * CHAR_WIDTH)
+            first_line = False
+        elif remaining_lines == 0:
+            page.text(_words(rnd, page.max_chars // 2) + '.')
+            page.skip(LINE_HEIGHT / 2)
+        else:
+            page.text(_words(rnd, page.max_chars))
+    return contents
+
+
+def make_pdf(pdf_path, columns=2, pages=4, equation_rate=0.0, figures_per_page=0, paragraph_lines=(4, 12),
+             seed=0):
+    """
+    Write a synthetic paper.
+    @param columns:
+        Number of the columns of the body text.
+    @param equation_rate:
+        Probability of a centered equation instead of a paragraph.
+    @param figures_per_page:
+        Maximum number of vector figures with captions on a page.
+    @param paragraph_lines:
+        (min, max) of the number of lines of a paragraph. Paragraphs longer than a page continue on the next page.
+    @param seed:
+        The same seed makes the same pdf.
+    """
+    contents = _page_contents(columns, pages, equation_rate, figures_per_page, paragraph_lines, seed)
+    n_pages = len(contents)
+    # objects: catalog, pages, two fonts, then a page and its contents for each page
+    objects = [
+        '<< /Type /Catalog /Pages 2 0 R >>',
+        '<< /Type /Pages /Kids [{}] /Count {} >>'.format(' '.join(f'{5 + 2 * i} 0 R' for i in range(n_pages)),
+                                                           n_pages),
+        '<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>',
+        '<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>',
+    ]
+    for i, content in enumerate(contents):
+        objects.append(f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] '
+                       f'/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents {6 + 2 * i} 0 R >>')
+        stream = content.encode('latin-1')
+        objects.append(f'<< /Length {len(stream)} >>\nstream\n{content}\nendstream')
+    pdf = b'%PDF-1.4\n'
+    offsets = []
+    for i, obj in enumerate(objects):
+        offsets.append(len(pdf))
+        pdf += f'{i + 1} 0 obj\n{obj}\nendobj\n'.encode('latin-1')
+    xref = len(pdf)
+    pdf += f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode('latin-1')
+    pdf += ''.join(f'{offset:010d} 00000 n \n' for offset in offsets).encode('latin-1')
+    pdf += f'trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n'.encode('latin-1')
+    with open(pdf_path, 'wb') as f:
+        f.write(pdf)
+    return pdf_path
+
+
+def make_corpus(corpus_dir, scale=1, names=None):
+    """
+    Write the documents of CORPUS to the directory.
+    @param scale:
+        Multiplier of the number of pages.
+    @return: dict of the name and the path of the pdf.
+    """
+    paths = {}
+    for name, kwargs in CORPUS.items():
+        if names and name not in names:
+            continue
+        kwargs = dict(kwargs, pages=kwargs['pages'] * scale)
+        paths[name] = make_pdf(f'{corpus_dir}/{name}.pdf', **kwargs)
+    return paths
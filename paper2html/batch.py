@@ -0,0 +1,99 @@
+import json
+import os
+import shutil
+import time
+
+from paper2html.conversion_cache import file_sha256
+
+
+class BatchManifest:
+    """
+    Status of the pdfs converted in a batch, so that an interrupted batch can be resumed.
+    Each record is appended to a json lines file as soon as a pdf is finished, and a later record of a pdf
+    overrides the earlier ones. The file is compacted when it is loaded.
+    A record has the status ('done' or 'failed'), the SHA-256 of the pdf, the result key of the conversion,
+    the duration in seconds, the generated htmls and the error of a failure.
+    Paths are relative to the directory of the manifest.
+    """
+    filename = 'paper2html_manifest.jsonl'
+
+    def __init__(self, manifest_dir):
+        self.manifest_dir = manifest_dir
+        self.manifest_path = os.path.join(manifest_dir, self.filename)
+        self.records = self._load()
+        self._compact()
+
+    def _load(self):
+        records = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # the last line written when the batch was killed
+                        continue
+                    records[record['pdf']] = record
+        return records
+
+    def _compact(self):
+        temp_path = self.manifest_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            for record in self.records.values():
+                f.write(json.dumps(record, sort_keys=True) + '\n')
+        os.replace(temp_path, self.manifest_path)
+
+    def _relpath(self, path):
+        return os.path.relpath(path, self.manifest_dir)
+
+    def _abspath(self, relpath):
+        return os.path.join(self.manifest_dir, relpath)
+
+    def record(self, pdf_path, **fields):
+        record = dict(fields, pdf=self._relpath(pdf_path))
+        if 'outputs' in record:
+            record['outputs'] = [self._relpath(path) for path in record['outputs']]
+        self.records[record['pdf']] = record
+        with open(self.manifest_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, sort_keys=True) + '\n')
+
+    def get(self, pdf_path):
+        return self.records.get(self._relpath(pdf_path))
+
+    def pdf_sha256(self, pdf_path):
+        """
+        SHA-256 of the pdf. The recorded one is used while the size and the modification time of the file are the same.
+        """
+        stat = os.stat(pdf_path)
+        record = self.get(pdf_path)
+        if record and record.get('size') == stat.st_size and record.get('mtime_ns') == stat.st_mtime_ns:
+            return record['sha256']
+        return file_sha256(pdf_path)
+
+    def outputs(self, pdf_path):
+        record = self.get(pdf_path)
+        return [self._abspath(path) for path in record.get('outputs', [])] if record else []
+
+    def is_done(self, pdf_path, key):
+        """
+        Whether the pdf has been converted with the same result key, and the htmls are still there.
+        """
+        record = self.get(pdf_path)
+        return bool(record and record['status'] == 'done' and record['key'] == key and
+                    all(os.path.exists(path) for path in self.outputs(pdf_path)))
+
+    def output_dirs(self):
+        return {os.path.dirname(self._abspath(path)) for record in self.records.values()
+                for path in record.get('outputs', [])}
+
+    def discard_outputs(self, pdf_path):
+        """
+        Remove the output directory of the previous conversion, so that the pdf is converted into the same directory.
+        """
+        for output_dir in {os.path.dirname(path) for path in self.outputs(pdf_path)}:
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+    @staticmethod
+    def stat_fields(pdf_path, pdf_sha256):
+        stat = os.stat(pdf_path)
+        return {'sha256': pdf_sha256, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'finished': time.time()}
@@ -0,0 +1,91 @@
+import numpy as np
+
+
+class BBoxTable:
+    """
+    Bounding boxes of page items stored column-wise in numpy arrays (origin 'LB'),
+    with the item type and the page address of each row.
+    The vectorized operations compute the same float expressions as their BBox counterparts,
+    so their results agree exactly.
+    """
+    def __init__(self, capacity=64):
+        self._n = 0
+        self._coords = np.empty((4, max(capacity, 1)), dtype=np.float64)
+        self._types = np.empty(max(capacity, 1), dtype=np.int64)
+        self._addresses = np.empty(max(capacity, 1), dtype=np.int64)
+
+    @staticmethod
+    def from_items(items):
+        """
+        @param items: PaperItems whose bboxes have the origin 'LB'.
+        """
+        table = BBoxTable(len(items))
+        for item in items:
+            table.append(item.bbox, item.type, item.address)
+        return table
+
+    def __len__(self):
+        return self._n
+
+    def append(self, bbox, item_type=None, address=None):
+        """
+        @return: the row of the appended bbox.
+        """
+        if bbox.orig != 'LB':
+            raise ValueError(f"origin is not the same. {bbox.orig} vs LB")
+        if self._n == self._coords.shape[1]:
+            self._coords = np.concatenate([self._coords, np.empty_like(self._coords)], axis=1)
+            self._types = np.concatenate([self._types, np.empty_like(self._types)])
+            self._addresses = np.concatenate([self._addresses, np.empty_like(self._addresses)])
+        self._coords[:, self._n] = (bbox.left, bbox.bottom, bbox.right, bbox.top)
+        self._types[self._n] = -1 if item_type is None else item_type
+        self._addresses[self._n] = -1 if address is None else address
+        self._n += 1
+        return self._n - 1
+
+    @property
+    def left(self):
+        return self._coords[0, :self._n]
+
+    @property
+    def bottom(self):
+        return self._coords[1, :self._n]
+
+    @property
+    def right(self):
+        return self._coords[2, :self._n]
+
+    @property
+    def top(self):
+        return self._coords[3, :self._n]
+
+    @property
+    def types(self):
+        return self._types[:self._n]
+
+    @property
+    def addresses(self):
+        return self._addresses[:self._n]
+
+    def collided(self, bbox, rows=None):
+        """
+        Boolean mask of the rows touching or overlapping bbox. Same as BBox.collided.
+        @param rows:
+            Array of the rows to test. Default is all the rows.
+        """
+        if bbox.orig != 'LB':
+            raise ValueError(f"origin is not the same. LB vs {bbox.orig}")
+        left, bottom, right, top = self.left, self.bottom, self.right, self.top
+        if rows is not None:
+            left, bottom, right, top = left[rows], bottom[rows], right[rows], top[rows]
+        x_collided = np.abs((left + right) - (bbox.left + bbox.right)) <= (right - left) + (bbox.right - bbox.left)
+        y_collided = np.abs((bottom + top) - (bbox.bottom + bbox.top)) <= (top - bottom) + (bbox.top - bbox.bottom)
+        return x_collided & y_collided
+
+    def center_dist(self, bbox):
+        """
+        Distances between the centers of the rows and bbox. Same as BBox.center_dist.
+        """
+        dx = (self.left + self.right) - (bbox.left + bbox.right)
+        dy = (self.bottom + self.top) - (bbox.bottom + bbox.top)
+        return np.sqrt(dx * dx + dy * dy) / 2.
@@ -0,0 +1,161 @@
+import os
+import sqlite3
+import threading
+import time
+
+from pdfminer.pdfdocument import PDFDocument
+from pdfminer.pdfpage import PDFPage
+from pdfminer.pdfparser import PDFParser
+from pdfminer.pdftypes import resolve1
+from pdfminer.utils import decode_text
+
+
+def pdf_summary(pdf_path):
+    """
+    @return: (title in the document information or None, number of pages or None)
+    """
+    try:
+        with open(pdf_path, 'rb') as fp:
+            doc = PDFDocument(PDFParser(fp))
+            title = None
+            for info in doc.info:
+                value = resolve1(info.get('Title'))
+                if isinstance(value, bytes):
+                    value = decode_text(value)
+                if isinstance(value, str) and value.strip():
+                    title = value.strip()
+            n_pages = sum(1 for _ in PDFPage.create_pages(doc))
+    except Exception:
+        return None, None
+    return title, n_pages
+
+
+class PaperCatalog:
+    """
+    Converted papers in a SQLite database in the paper directory,
+    so that they are listed without scanning the directory.
+    A paper is identified by the result key of its conversion, and listed with the papers converted with the same
+    parameters (see ConversionCache.params_key).
+    The text of the paragraphs of the papers is indexed in a FTS5 table to search the papers,
+    and the database file is memory-mapped up to mmap_size bytes for the queries.
+    """
+    filename = 'catalog.sqlite3'
+    sort_columns = {
+        'converted': 'converted_at',
+        'title': 'COALESCE(title, filename) COLLATE NOCASE',
+        'filename': 'filename COLLATE NOCASE',
+        'pages': 'n_pages',
+        'size': 'size',
+    }
+    columns = ('key', 'params_key', 'pdf_sha256', 'filename', 'keyed_filename', 'title', 'n_pages', 'size', 'html',
+               'converted_at')
+    mmap_size = 256 * 1024 * 1024
+    # control characters marking the matched words in the snippets, not to be confused with the text of the papers
+    match_start, match_end = '\x02', '\x03'
+
+    def __init__(self, catalog_dir):
+        self.catalog_path = os.path.join(catalog_dir, self.filename)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.catalog_path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        with self._lock, self._connection:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute(f'PRAGMA mmap_size={int(self.mmap_size)}')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS papers ('
+                'key TEXT PRIMARY KEY, params_key TEXT NOT NULL, pdf_sha256 TEXT NOT NULL, filename TEXT NOT NULL, '
+                'keyed_filename TEXT NOT NULL, title TEXT, n_pages INTEGER, size INTEGER, html TEXT NOT NULL, '
+                'converted_at REAL NOT NULL)')
+            self._connection.execute(
+                'CREATE INDEX IF NOT EXISTS papers_by_time ON papers (params_key, converted_at)')
+            self._connection.execute(
+                'CREATE VIRTUAL TABLE IF NOT EXISTS paragraphs USING fts5('
+                'text, key UNINDEXED, paragraph UNINDEXED, page UNINDEXED, address UNINDEXED, '
+                "tokenize = 'porter unicode61 remove_diacritics 2')")
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM papers').fetchone()[0]
+
+    def add(self, key, params_key, pdf_sha256, filename, keyed_filename, pdf_path, html, converted_at=None):
+        """
+        @param filename:
+            Filename of the pdf shown in the index.
+        @param keyed_filename:
+            Filename of the pdf the result is browsed by.
+        @param pdf_path:
+            The converted pdf, to read its title, number of pages and size.
+        @param html:
+            Path of the converted html relative to the paper directory.
+        """
+        title, n_pages = pdf_summary(pdf_path)
+        size = os.path.getsize(pdf_path) if os.path.exists(pdf_path) else None
+        row = (key, params_key, pdf_sha256, filename, keyed_filename, title, n_pages, size, html,
+               time.time() if converted_at is None else converted_at)
+        with self._lock, self._connection:
+            self._connection.execute(
+                f"INSERT OR REPLACE INTO papers ({', '.join(self.columns)}) "
+                f"VALUES ({', '.join('?' * len(self.columns))})", row)
+
+    def add_paragraphs(self, key, paragraphs):
+        """
+        Index the text of the paragraphs of a paper, replacing the ones indexed before.
+        @param paragraphs:
+            Iterable of dict with 'id' (the number in the id of the paragraph in the html), 'page', 'address'
+            and 'text', as written by HtmlPaper.
+        """
+        rows = ((paragraph['text'], key, paragraph['id'], paragraph['page'], paragraph['address'])
+                for paragraph in paragraphs)
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM paragraphs WHERE key = ?', (key,))
+            self._connection.executemany(
+                'INSERT INTO paragraphs (text, key, paragraph, page, address) VALUES (?, ?, ?, ?, ?)', rows)
+
+    @staticmethod
+    def _match_expression(query):
+        # each word is quoted so that the query is not taken as the syntax of FTS5, and all the words must match
+        return ' '.join('"{}"'.format(word.replace('"', '""')) for word in query.split())
+
+    def search(self, params_key, query, offset=0, limit=20):
+        """
+        Paragraphs containing all the words of the query, in the papers converted with the parameters.
+        @return: list of dict of the paper with 'paragraph', 'page', 'snippet' and 'score', the best match first.
+            The matched words in the snippet are enclosed by match_start and match_end.
+        """
+        expression = self._match_expression(query)
+        if not expression:
+            return []
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT papers.*, paragraphs.paragraph, paragraphs.page, "
+                "snippet(paragraphs, 0, ?, ?, '…', 16) AS snippet, bm25(paragraphs) AS score "
+                "FROM paragraphs JOIN papers ON papers.key = paragraphs.key "
+                "WHERE paragraphs MATCH ? AND papers.params_key = ? "
+                "ORDER BY score, papers.key, paragraphs.paragraph LIMIT ? OFFSET ?",
+                (self.match_start, self.match_end, expression, params_key, limit, offset)).fetchall()
+        return [dict(row) for row in rows]
+
+    def count(self, params_key):
+        with self._lock:
+            return self._connection.execute(
+                'SELECT COUNT(*) FROM papers WHERE params_key = ?', (params_key,)).fetchone()[0]
+
+    def list(self, params_key, sort='converted', descending=True, offset=0, limit=100):
+        """
+        @param sort:
+            One of sort_columns.
+        @return: list of dict of the papers in the page.
+        """
+        if sort not in self.sort_columns:
+            raise ValueError(f"unknown sort: {sort}. choose from {', '.join(self.sort_columns)}")
+        order = 'DESC' if descending else 'ASC'
+        with self._lock:
+            rows = self._connection.execute(
+                f"SELECT * FROM papers WHERE params_key = ? "
+                f"ORDER BY {self.sort_columns[sort]} {order}, key LIMIT ? OFFSET ?",
+                (params_key, limit, offset)).fetchall()
+        return [dict(row) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
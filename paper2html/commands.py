@@ -1,5 +1,9 @@
 # -*- coding:utf-8 -*-
 import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
 from os.path import join as pjoin
 from shutil import rmtree
 from glob import glob
@@ -8,7 +12,10 @@ from urllib.parse import quote
 import fire
 import pdf2image
 from paper2html.paper import PaperPage, Paper
-from paper2html.paper_miner import read_by_extended_pdfminer
+from paper2html.paper_miner import read_by_extended_pdfminer, stream_by_extended_pdfminer, probe_pdf
+from paper2html.page_image_store import PageImageStore
+from paper2html.batch import BatchManifest
+from paper2html.conversion_cache import ConversionCache
 
 
 def _get_unique_dirname(dirname):
@@ -22,13 +29,25 @@ def _get_unique_dirname(dirname):
     return dirname
 
 
-def init_working_dir(working_dir, pdf_filename):
+def _reserve_output_dir(working_dir, pdf_filename):
+    """
+    Make a new output directory for the pdf, named after it in the working directory
+    (default is the same directory as the pdf).
+    """
     base_dir, pdf_name = os.path.split(pdf_filename)
     pdf_name, _ = os.path.splitext(pdf_name)
-    if not working_dir:
-        working_dir = base_dir
+    output_dir = _get_unique_dirname(pjoin(working_dir or base_dir, pdf_name))
+    os.mkdir(output_dir)
+    return output_dir
+
 
-    output_dir = _get_unique_dirname(pjoin(working_dir, pdf_name))
+def init_working_dir(working_dir, pdf_filename, output_dir=None):
+    """
+    @param output_dir:
+        The output directory made by _reserve_output_dir beforehand. Default is to make a new one.
+    """
+    if output_dir is None:
+        output_dir = _reserve_output_dir(working_dir, pdf_filename)
     resource_dir = pjoin(output_dir, 'resources')
     temp_dir = pjoin(output_dir, 'temp')
 
@@ -40,11 +59,10 @@ def init_working_dir(working_dir, pdf_filename):
 
     Paper.output_dir = output_dir
     Paper.layout_dir = layout_dir
-    PaperPage.image_dir = image_dir
+    PaperPage.image_store = PageImageStore(image_dir)
     PaperPage.crop_dir = crop_dir
 
-    for dir_name in (output_dir, resource_dir, temp_dir,
-                     crop_dir, fixed_dir, image_dir, layout_dir):
+    for dir_name in (resource_dir, temp_dir, crop_dir, fixed_dir, image_dir, layout_dir):
         os.mkdir(dir_name)
     return fixed_dir, image_dir, temp_dir
 
@@ -76,11 +94,101 @@ def clean_pdf(pdf_filename, working_dir):
     return new_pdf_filename
 
 
+def repair_pdf(pdf_filename, working_dir):
+    """
+    Fix the pdf by clean_pdf only if pdfminer cannot read it as it is.
+    Rewriting the whole pdf is skipped for well-formed pdfs.
+    @param pdf_filename:
+        The target pdf file.
+    @param working_dir:
+        The directory for the fixed pdf.
+    @return:
+        (the pdf file to read, 'original' if it is read as it is or 'pdftocairo' if it is fixed)
+    """
+    problem = probe_pdf(pdf_filename)
+    if problem is None:
+        print(f'read pdf as it is: {pdf_filename}')
+        return pdf_filename, 'original'
+    print(f'repair pdf by pdftocairo: {problem}')
+    return clean_pdf(pdf_filename, working_dir), 'pdftocairo'
+
+
+class BackgroundRasterizer(threading.Thread):
+    """
+    Rasterize pdf pages in the background, a few pages for each run of pdftoppm,
+    so that each page can be recognized soon after its image exists.
+    @param progress:
+        Optional hook called as progress('rasterize', pages rasterized, number of pages) on this thread.
+    """
+    # the first runs rasterize fewer pages, so that the recognition of the first pages starts early
+    max_pages_per_run = 8
+
+    def __init__(self, pdf_filename, image_dir, progress=None):
+        super().__init__(daemon=True)
+        self.pdf_filename = pdf_filename
+        self.image_dir = image_dir
+        self.progress = progress
+        self.n_rasterized = 0
+        self.finished = False
+        self.error = None
+        self._stopped = threading.Event()
+        self._condition = threading.Condition()
+
+    def run(self):
+        try:
+            n_pages = pdf2image.pdfinfo_from_path(self.pdf_filename)["Pages"]
+            pages_per_run = 1
+            while self.n_rasterized < n_pages and not self._stopped.is_set():
+                first_page = self.n_rasterized + 1
+                last_page = min(first_page + pages_per_run - 1, n_pages)
+                # files are named by the first page of the run and then by the page,
+                # so that PageImageStore indexes pages correctly
+                pdf2image.convert_from_path(self.pdf_filename, output_folder=self.image_dir,
+                                            output_file='pdf-%05d' % first_page,
+                                            first_page=first_page, last_page=last_page,
+                                            paths_only=True, fmt='png')
+                with self._condition:
+                    self.n_rasterized = last_page
+                    self._condition.notify_all()
+                if self.progress:
+                    self.progress('rasterize', last_page, n_pages)
+                pages_per_run = min(2 * pages_per_run, self.max_pages_per_run)
+        except Exception as e:
+            with self._condition:
+                self.error = e
+        finally:
+            with self._condition:
+                self.finished = True
+                self._condition.notify_all()
+
+    def stop(self):
+        """
+        Stop after the current run of pdftoppm and wait for the thread, when the pages are no longer needed.
+        """
+        self._stopped.set()
+        self.join()
+
+    def wait_for_page(self, page_n):
+        """
+        Block until the image of the page is written.
+        Raises the error of the rasterization if the page was not rasterized because of it.
+        @param page_n:
+            0-origin page number.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self.n_rasterized > page_n or self.finished)
+            if self.error and self.n_rasterized <= page_n:
+                raise self.error
+
+
 def message_for_automator(msg):
     webbrowser.open("https://www.google.com/search?q={}".format(quote(msg)))
 
 
-def paper2html(target_path: str, working_dir: str = None, line_margin_rate: float = None, verbose: bool = False) -> list:
+def paper2html(target_path: str, working_dir: str = None, line_margin_rate: float = None, verbose: bool = False,
+               workers: int = None, pipelined: bool = False, image_profile: str = 'png',
+               inline: bool = True, asset_url: str = None, lean: bool = False, progress=None, jobs: int = 1,
+               text_index_filename: str = None) -> list:
     """
     Generate paper htmls from a pdf file.
     @param target_path:
@@ -93,34 +201,279 @@ def paper2html(target_path: str, working_dir: str = None, line_margin_rate: floa
         This is optionally used for pdfminer.Lparams.line_margin. It affects paragraph detection.
     @param verbose:
         Whether to output files which indicate the visual recognition process.
+    @param workers:
+        Number of processes to recognize pages in parallel. Default is to recognize pages one by one.
+    @param pipelined:
+        Whether to rasterize pages in the background while the pdf is parsed.
+        Each page is recognized as soon as its image is ready.
+    @param image_profile:
+        How page images and crops are encoded: 'png' (lossless), 'palette', 'webp' or 'jpeg'.
+        See paper2html.image_profile.IMAGE_PROFILES.
+    @param inline:
+        Whether to embed the stylesheet and page images in the html.
+        If not, the viewer loads page images on demand.
+    @param asset_url:
+        Url prefix of the files referred from the html, e.g. "/paper2html/assets/{paper}/".
+        Default is the relative path from the html.
+    @param lean:
+        Whether to drop the pdfminer layout of each page as soon as the page is recognized.
+        This bounds the memory usage for long pdfs. Ignored when verbose is set.
+    @param progress:
+        Optional hook called as progress(stage, done, total) while the pdf is converted.
+        The stages are 'rasterize' (pages), 'recognize' (pages) and 'export' (html files).
+        For a directory, it is called as progress('batch', pdfs finished, number of pdfs to convert) instead.
+    @param jobs:
+        Number of processes to convert the pdfs of a directory in parallel.
+        The pdfs are recorded in paper2html_manifest.jsonl of the working directory (or the target directory),
+        and the pdfs converted with the same parameters are skipped in the next run.
+    @param text_index_filename:
+        Filename in the resources of the output directory to write the text of the paragraphs to,
+        to index it for a search. Default is not to write it.
     @return:
         List of url of generated htmls.
     """
     if os.path.isdir(target_path):
-        urls = []
-        for pdf_filename in glob(pjoin(target_path, "**", "*.pdf"), recursive=True):
-            if os.path.isfile(pdf_filename):
-                urls.extend(paper2html(pdf_filename, working_dir, verbose))
-        return urls
+        return _paper2html_batch(target_path, working_dir, jobs, progress,
+                                 line_margin_rate=line_margin_rate, verbose=verbose, workers=workers,
+                                 pipelined=pipelined, image_profile=image_profile, inline=inline,
+                                 asset_url=asset_url, lean=lean, text_index_filename=text_index_filename)
 
     pdf_filename = target_path
     _, ext = os.path.splitext(pdf_filename)
     if ext != '.pdf' or not os.path.isfile(pdf_filename):
         raise ValueError('Only pdf files are supported')
 
-    fixed_dir, image_dir, temp_dir = init_working_dir(working_dir, pdf_filename)
-    pdf_filename = clean_pdf(pdf_filename, fixed_dir)
-    pdf2image.convert_from_path(pdf_filename, output_folder=image_dir, output_file='pdf', paths_only=True, fmt='png')
-    urls = read_by_extended_pdfminer(pdf_filename, line_margin_rate, verbose)
+    urls, _ = paper2html_file(pdf_filename, working_dir, line_margin_rate, verbose, workers, pipelined,
+                              image_profile, inline, asset_url, lean, progress, text_index_filename)
+    return urls
+
+
+def paper2html_file(pdf_filename, working_dir, line_margin_rate=None, verbose=False, workers=None, pipelined=False,
+                    image_profile='png', inline=True, asset_url=None, lean=False, progress=None,
+                    text_index_filename=None, output_dir=None):
+    """
+    Generate paper htmls from a pdf file. The other arguments are the same as paper2html.
+    @param output_dir:
+        The output directory made beforehand. Default is a new directory named after the pdf in the working directory.
+    @return:
+        (list of url of generated htmls, how the pdf is repaired. see repair_pdf)
+    """
+    fixed_dir, image_dir, temp_dir = init_working_dir(working_dir, pdf_filename, output_dir)
+    pdf_filename, repair = repair_pdf(pdf_filename, fixed_dir)
+    if pipelined:
+        rasterizer = BackgroundRasterizer(pdf_filename, image_dir, progress)
+        rasterizer.start()
+        try:
+            urls = read_by_extended_pdfminer(pdf_filename, line_margin_rate, verbose, workers,
+                                             rasterizer.wait_for_page, image_profile, inline, asset_url, lean,
+                                             progress, text_index_filename)
+        finally:
+            rasterizer.stop()
+    else:
+        image_paths = pdf2image.convert_from_path(pdf_filename, output_folder=image_dir, output_file='pdf',
+                                                  paths_only=True, fmt='png')
+        if progress:
+            progress('rasterize', len(image_paths), len(image_paths))
+        urls = read_by_extended_pdfminer(pdf_filename, line_margin_rate, verbose, workers,
+                                         image_profile=image_profile, inline=inline, asset_url=asset_url, lean=lean,
+                                         progress=progress, text_index_filename=text_index_filename)
 
     if not verbose:
         rmtree(temp_dir)
 
-    return urls
+    return urls, repair
+
+
+def _convert_in_batch(pdf_filename, working_dir, output_dir, n_div_paragraph, kwargs):
+    """
+    Convert a pdf of a batch, in a worker process or in this process.
+    The output directory is removed if the conversion fails.
+    @return: (list of generated htmls, seconds taken, how the pdf is repaired)
+    """
+    start = time.perf_counter()
+    Paper.n_div_paragraph = n_div_paragraph
+    try:
+        urls, repair = paper2html_file(pdf_filename, working_dir, output_dir=output_dir, **kwargs)
+    except BaseException:
+        rmtree(output_dir, ignore_errors=True)
+        raise
+    return urls, time.perf_counter() - start, repair
+
+
+def _is_in_output_dir(pdf_filename, target_dir):
+    """
+    Whether the pdf is in an output directory of a conversion, e.g. a fixed pdf left in its temp directory.
+    """
+    directory = os.path.dirname(pdf_filename)
+    while os.path.commonpath([target_dir, directory]) == target_dir and directory != target_dir:
+        parent = os.path.dirname(directory)
+        if os.path.basename(directory) == 'temp' and os.path.isdir(pjoin(parent, 'resources')):
+            return True
+        directory = parent
+    return False
+
+
+def _paper2html_batch(target_dir, working_dir, jobs, progress, **kwargs):
+    manifest = BatchManifest(working_dir or target_dir)
+    params = {name: kwargs[name] for name in ('line_margin_rate', 'image_profile', 'inline', 'asset_url')}
+    params['n_div_paragraph'] = Paper.n_div_paragraph
+    # fixed pdfs are left in the output directories when verbose or when the batch was killed
+    output_dirs = manifest.output_dirs()
+    pending = []
+    for pdf_filename in sorted(glob(pjoin(target_dir, "**", "*.pdf"), recursive=True)):
+        if not os.path.isfile(pdf_filename) or _is_in_output_dir(pdf_filename, target_dir) or \
+                any(os.path.commonpath([output_dir, pdf_filename]) == output_dir for output_dir in output_dirs):
+            continue
+        pdf_sha256 = manifest.pdf_sha256(pdf_filename)
+        key = ConversionCache.result_key(pdf_sha256, params)
+        if manifest.is_done(pdf_filename, key):
+            continue
+        manifest.discard_outputs(pdf_filename)
+        pending.append((pdf_filename, pdf_sha256, key))
+
+    def record(pdf_filename, pdf_sha256, key, urls=None, duration=None, repair=None, error=None):
+        fields = BatchManifest.stat_fields(pdf_filename, pdf_sha256)
+        if error is None:
+            manifest.record(pdf_filename, status='done', key=key, duration=duration, repair=repair, outputs=urls,
+                            **fields)
+        else:
+            print(f'failed to convert {pdf_filename}: {error}')
+            manifest.record(pdf_filename, status='failed', key=key, error=error, **fields)
+        if progress:
+            progress('batch', n_finished + 1, len(pending))
+
+    n_finished = 0
+    if jobs and jobs > 1:
+        # the processes of the batch use the cores instead of the processes of each pdf
+        kwargs['workers'] = None
+        for task, outcome in _run_batch_in_parallel(pending, working_dir, kwargs, jobs):
+            record(*task, **outcome)
+            n_finished += 1
+    else:
+        for task in pending:
+            try:
+                urls, duration, repair = _convert_in_batch(task[0], working_dir,
+                                                           _reserve_output_dir(working_dir, task[0]),
+                                                           Paper.n_div_paragraph, kwargs)
+            except Exception as e:
+                record(*task, error=f"{type(e).__name__}: {e}")
+            else:
+                record(*task, urls=urls, duration=duration, repair=repair)
+            n_finished += 1
+
+    return [url for pdf_filename in sorted(glob(pjoin(target_dir, "**", "*.pdf"), recursive=True))
+            if (manifest.get(pdf_filename) or {}).get('status') == 'done'
+            for url in manifest.outputs(pdf_filename)]
+
+
+def _run_batch_in_parallel(tasks, working_dir, kwargs, jobs):
+    """
+    A worker process dying breaks the pool and fails every task in it. The tasks of a broken pool are retried one at
+    a time in a new pool, so that a task is failed only when it breaks the pool again by itself.
+    The output directories of the broken conversions are removed, and a retry converts into a new one.
+    @return: iterator of (task, outcome) in the order the pdfs are finished,
+        where outcome is {'urls': ..., 'duration': ..., 'repair': ...} or {'error': ...}.
+    """
+    tasks = list(reversed(tasks))
+    retries = []
+    retried = set()
+    executor = ProcessPoolExecutor(jobs)
+    # future: (task, output directory)
+    running = {}
+
+    def submit(task):
+        # the output directories are made here, so that the pdfs with the same name get different directories
+        output_dir = _reserve_output_dir(working_dir, task[0])
+        future = executor.submit(_convert_in_batch, task[0], working_dir, output_dir, Paper.n_div_paragraph, kwargs)
+        running[future] = task, output_dir
+
+    try:
+        while tasks or retries or running:
+            if retries:
+                if not running:
+                    submit(retries.pop())
+            else:
+                # submit a few more than the processes, so that the processes do not wait for the next tasks
+                while tasks and len(running) < 2 * jobs:
+                    submit(tasks.pop())
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            if any(isinstance(future.exception(), BrokenProcessPool) for future in done):
+                # the pool is unusable, and the tasks still running in it are finished as broken
+                executor.shutdown(wait=True)
+                executor = ProcessPoolExecutor(jobs)
+                done = list(running)
+            for future in done:
+                task, output_dir = running.pop(future)
+                try:
+                    urls, duration, repair = future.result()
+                except BrokenProcessPool:
+                    rmtree(output_dir, ignore_errors=True)
+                    if task in retried:
+                        yield task, {'error': 'the worker process died'}
+                    else:
+                        retried.add(task)
+                        retries.append(task)
+                except Exception as e:
+                    yield task, {'error': f"{type(e).__name__}: {e}"}
+                else:
+                    yield task, {'urls': urls, 'duration': duration, 'repair': repair}
+    finally:
+        # cancel_futures of shutdown needs python 3.9
+        for future, (_, output_dir) in running.items():
+            if future.cancel():
+                rmtree(output_dir, ignore_errors=True)
+        executor.shutdown(wait=False)
+
+
+def paper2html_stream(pdf_filename: str, working_dir: str = None, line_margin_rate: float = None,
+                      workers: int = None, image_profile: str = 'png', inline: bool = True, asset_url: str = None,
+                      text_index_filename: str = None):
+    """
+    Generate a paper html from a pdf file, yielding the html text while it is written.
+    Pages are rasterized in the background and the paragraphs of each page are yielded as soon as it is recognized.
+    The html is named <pdf name>_0.html in the output directory once it is complete.
+    @param pdf_filename:
+        The target pdf file.
+    @param working_dir:
+        The working directory contains output directory and html files.
+        Default is the same directory as pdf_filename.
+    @param line_margin_rate:
+        line margin rate = (line margin) / (line hight).
+    @param workers:
+        Number of processes to recognize pages in parallel.
+    @param image_profile:
+        How page images and crops are encoded: 'png' (lossless), 'palette', 'webp' or 'jpeg'.
+    @param inline:
+        Whether to embed the stylesheet and page images in the html.
+    @param asset_url:
+        Url prefix of the files referred from the html.
+    @param text_index_filename:
+        Filename in the resources of the output directory to write the text of the paragraphs to,
+        to index it for a search. Default is not to write it.
+    @return:
+        Generator of html fragments, returning how the pdf is repaired (see repair_pdf) as the value of yield from.
+    """
+    _, ext = os.path.splitext(pdf_filename)
+    if ext != '.pdf' or not os.path.isfile(pdf_filename):
+        raise ValueError('Only pdf files are supported')
+
+    fixed_dir, image_dir, temp_dir = init_working_dir(working_dir, pdf_filename)
+    pdf_filename, repair = repair_pdf(pdf_filename, fixed_dir)
+    rasterizer = BackgroundRasterizer(pdf_filename, image_dir)
+    rasterizer.start()
+    try:
+        yield from stream_by_extended_pdfminer(pdf_filename, line_margin_rate, workers, rasterizer.wait_for_page,
+                                               image_profile, inline, asset_url,
+                                               text_index_filename=text_index_filename)
+    finally:
+        rasterizer.stop()
+    rmtree(temp_dir)
+    return repair
 
 
 def open_paper_htmls(pdf_filename: str, working_dir: str = None, browser_path: str = None,
-                     n_div_paragraph: int = 800, line_margin_rate: float = None, verbose: bool = False):
+                     n_div_paragraph: int = 800, line_margin_rate: float = None, verbose: bool = False,
+                     workers: int = None, pipelined: bool = False, image_profile: str = 'png', jobs: int = 1):
     """
     Open generated paper htmls from a pdf file with a browser.
     @param pdf_filename:
@@ -137,10 +490,19 @@ def open_paper_htmls(pdf_filename: str, working_dir: str = None, browser_path: s
         This is optionally used for pdfminer.Lparams.line_margin. It affects paragraph detection.
     @param verbose:
         Whether to output files which indicate the visual recognition process.
+    @param workers:
+        Number of processes to recognize pages in parallel.
+    @param pipelined:
+        Whether to rasterize pages in the background while the pdf is parsed.
+    @param image_profile:
+        How page images and crops are encoded: 'png' (lossless), 'palette', 'webp' or 'jpeg'.
+    @param jobs:
+        Number of processes to convert the pdfs of a directory in parallel.
     """
     try:
         Paper.n_div_paragraph = n_div_paragraph
-        for url in paper2html(pdf_filename, working_dir, line_margin_rate, verbose):
+        for url in paper2html(pdf_filename, working_dir, line_margin_rate, verbose, workers, pipelined,
+                              image_profile, jobs=jobs):
             open_by_browser(url, browser_path)
     except Exception as e:
         message_for_automator(str(e))
@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+
+def file_sha256(path, block_size=1024 * 1024):
+    """
+    @return: hex digest of SHA-256 of the file contents.
+    """
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def _package_version():
+    # imported here because the package imports this module while it is initialized
+    from paper2html import __version__
+    return __version__
+
+
+class ConversionCache:
+    """
+    Conversion results keyed by the SHA-256 of the pdf and the conversion parameters,
+    with an alias table from urls and filenames to the SHA-256 of the pdf,
+    and the validators (ETag and Last-Modified) the servers sent with the pdfs of the urls.
+    The tables are kept in a SQLite database in the cache directory, so that a change writes only its row,
+    and html paths are relative to the directory.
+    """
+    filename = 'conversion_cache.sqlite3'
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.db_path = os.path.join(cache_dir, self.filename)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.db_path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS aliases (alias TEXT PRIMARY KEY, pdf_sha256 TEXT NOT NULL)')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS validators (url TEXT PRIMARY KEY, validators TEXT NOT NULL)')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, pdf_sha256 TEXT NOT NULL, '
+                'params TEXT NOT NULL, version TEXT NOT NULL, html TEXT NOT NULL, filename TEXT NOT NULL, '
+                'repair TEXT)')
+
+    @staticmethod
+    def result_key(pdf_sha256, params):
+        """
+        @param params:
+            Dict of the conversion parameters. The package version is added to them.
+        @return: hex digest identifying the result of converting the pdf with the parameters.
+        """
+        source = json.dumps({'pdf': pdf_sha256, 'params': params, 'version': _package_version()}, sort_keys=True)
+        return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def params_key(params, version=None):
+        """
+        @param version:
+            Package version the parameters are used with. Default is the current version.
+        @return: hex digest identifying the conversion parameters with the package version.
+        """
+        source = json.dumps({'params': params, 'version': version or _package_version()}, sort_keys=True)
+        return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+    def add_alias(self, alias, pdf_sha256):
+        with self._lock, self._connection:
+            self._connection.execute('INSERT OR REPLACE INTO aliases VALUES (?, ?)', (alias, pdf_sha256))
+
+    def pdf_sha256(self, alias):
+        """
+        @return: SHA-256 of the pdf last seen as the url or filename, or None if it is unknown.
+        """
+        with self._lock:
+            row = self._connection.execute('SELECT pdf_sha256 FROM aliases WHERE alias = ?', (alias,)).fetchone()
+        return row[0] if row else None
+
+    def set_validators(self, url, validators):
+        with self._lock, self._connection:
+            self._connection.execute('INSERT OR REPLACE INTO validators VALUES (?, ?)',
+                                     (url, json.dumps(validators, sort_keys=True)))
+
+    def validators(self, url):
+        """
+        @return: validators of the pdf last downloaded from the url, which may be empty.
+        """
+        with self._lock:
+            row = self._connection.execute('SELECT validators FROM validators WHERE url = ?', (url,)).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def add_result(self, key, pdf_sha256, params, html_path, filename, repair=None):
+        """
+        @param html_path:
+            The converted html.
+        @param filename:
+            Filename of the pdf shown in the index.
+        @param repair:
+            How the pdf is repaired for the conversion. see paper2html.commands.repair_pdf
+        """
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (key, pdf_sha256, json.dumps(params, sort_keys=True), _package_version(),
+                 os.path.relpath(html_path, self.cache_dir), filename, repair))
+
+    def result_html(self, key):
+        """
+        @return: the converted html, or None if it is not converted or has been removed.
+        """
+        with self._lock:
+            row = self._connection.execute('SELECT html FROM results WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        html_path = os.path.join(self.cache_dir, row[0])
+        return html_path if os.path.exists(html_path) else None
+
+    def results(self):
+        """
+        @return: list of (key, result) of the converted pdfs.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT key, pdf_sha256, params, version, html, filename, repair FROM results').fetchall()
+        return [(key, {'pdf_sha256': pdf_sha256, 'params': json.loads(params), 'version': version, 'html': html,
+                       'filename': filename, 'repair': repair})
+                for key, pdf_sha256, params, version, html, filename, repair in rows]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
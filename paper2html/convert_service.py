@@ -1,14 +1,49 @@
+import html
+import json
 import logging
 import os
 
-from flask import Flask, request, send_file
+from flask import Flask, Response, request, send_file, abort, jsonify, url_for, stream_with_context
+from paper2html.catalog import PaperCatalog
+from paper2html.jobs import JobManager
 from paper2html.local_paper_directory import LocalPaperDirectory
+from paper2html import templates
 
 
-def convert_service_run(host, port, paper_dirpath=None, watch=False, debug=False):
-    paper_dir = LocalPaperDirectory(paper_dirpath, watch, debug)
+try:
+    import importlib.resources as pkg_resources
+except ImportError:
+    import importlib_resources as pkg_resources
 
+
+ASSET_MAX_AGE = 7 * 24 * 60 * 60
+# comment lines sent while a job makes no progress, so that proxies keep the event stream open
+EVENT_KEEPALIVE_SECONDS = 15
+
+
+def create_app(paper_dir):
     app = Flask(__name__)
+    jobs = JobManager(paper_dir.prepare_html)
+
+    def describe_job(job):
+        status = job.to_dict()
+        status['status_url'] = url_for('job_status', job_id=job.id)
+        status['events_url'] = url_for('job_events', job_id=job.id)
+        if status['state'] == 'done':
+            status['result_url'] = url_for('render', url=job.url)
+        return status
+
+    def submit_job():
+        download_url = request.values.get('url') or (request.get_json(silent=True) or {}).get('url')
+        if not download_url or os.path.splitext(download_url)[1] != ".pdf":
+            abort(400, f"{download_url} is not url to pdf.")
+        return jobs.submit(download_url)
+
+    def get_job(job_id):
+        job = jobs.get(job_id)
+        if job is None:
+            abort(404)
+        return job
 
     @app.route('/paper2html/convert')
     def render():
@@ -18,22 +53,85 @@ def convert_service_run(host, port, paper_dirpath=None, watch=False, debug=False
         if ext != ".pdf":
             return f"{download_url} is not url to pdf."
 
-        result_html = paper_dir.prepare_html(download_url)
-        return send_file(os.path.abspath(result_html), mimetype='text/html')
+        result_html = paper_dir.revalidate(download_url)
+        if result_html:
+            return send_file(os.path.abspath(result_html), mimetype='text/html')
+        # send the html while it is converted, so that the first pages can be read early
+        return Response(paper_dir.stream_html(download_url), mimetype='text/html')
+
+    @app.route('/paper2html/jobs', methods=['POST'])
+    def create_job():
+        job = submit_job()
+        response = jsonify(describe_job(job))
+        response.status_code = 202
+        response.headers['Location'] = url_for('job_status', job_id=job.id)
+        return response
+
+    @app.route('/paper2html/jobs/<job_id>')
+    def job_status(job_id):
+        return jsonify(describe_job(get_job(job_id)))
+
+    @app.route('/paper2html/jobs/<job_id>/events')
+    def job_events(job_id):
+        job = get_job(job_id)
+
+        def events():
+            version = None
+            while True:
+                new_version = job.wait(version, EVENT_KEEPALIVE_SECONDS)
+                if new_version == version:
+                    yield ": keep-alive\n\n"
+                    continue
+                version = new_version
+                status = describe_job(job)
+                yield f"data: {json.dumps(status)}\n\n"
+                if status['state'] in ('done', 'failed'):
+                    return
+
+        return Response(stream_with_context(events()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    @app.route('/paper2html/progress')
+    def progress():
+        # the bookmarklet can open this page instead of waiting for /paper2html/convert
+        job = submit_job()
+        progress_html_template = pkg_resources.read_text(templates, "progress.html")
+        return progress_html_template.format(url=html.escape(job.url),
+                                             events_url=url_for('job_events', job_id=job.id))
+
+    def browse_url(filename):
+        return f"http://localhost:5000/paper2html/browse/{filename}"
 
     @app.route('/paper2html/index.html')
     def browse_top():
-        def url_factory(filename):
-            print(app.root_path)
-            return f"http://localhost:5000/paper2html/browse/{filename}"
-        index_html = paper_dir.update_index_html(url_factory)
-        return send_file(os.path.abspath(index_html), mimetype='text/html')
+        sort = request.args.get('sort', 'converted')
+        if sort not in PaperCatalog.sort_columns:
+            abort(400, f"unknown sort: {sort}")
+        return paper_dir.render_index_html(browse_url, request.args.get('page', 1, type=int), sort,
+                                           request.args.get('order', 'desc') != 'asc')
+
+    @app.route('/paper2html/search')
+    def search():
+        return paper_dir.render_search_html(browse_url, request.args.get('q', ''),
+                                            request.args.get('page', 1, type=int))
 
     @app.route('/paper2html/browse/<filename>')
     def browse(filename):
         result_html = paper_dir.prepare_html(filename)
         return send_file(os.path.abspath(result_html), mimetype='text/html')
 
+    @app.route('/paper2html/assets/<paper>/<path:filename>')
+    def assets(paper, filename):
+        asset_path = paper_dir.get_asset_path(paper, filename)
+        if not asset_path or not os.path.isfile(asset_path):
+            abort(404)
+        # files of a converted paper never change
+        response = send_file(asset_path, conditional=True)
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = ASSET_MAX_AGE
+        return response
+
     @app.errorhandler(500)
     def server_error(e):
         logging.exception('An error occurred during a request.')
@@ -42,4 +140,17 @@ def convert_service_run(host, port, paper_dirpath=None, watch=False, debug=False
         See logs for full stacktrace.
         """.format(e), 500
 
-    app.run(debug=debug, host=host, port=port)
+    return app
+
+
+def convert_service_run(host, port, paper_dirpath=None, watch=False, debug=False, workers=2):
+    """
+    @param workers:
+        Number of processes converting pdfs. Requests beyond it wait for a free process.
+    """
+    paper_dir = LocalPaperDirectory(paper_dirpath, watch, debug, workers=workers)
+    app = create_app(paper_dir)
+    try:
+        app.run(debug=debug, host=host, port=port)
+    finally:
+        paper_dir.shutdown()
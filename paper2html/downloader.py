@@ -0,0 +1,179 @@
+import http.client
+import os
+import ssl
+import threading
+import urllib.parse
+import urllib.request
+
+
+class DownloadError(Exception):
+    pass
+
+
+class PdfDownloader:
+    """
+    Downloads pdfs to files in chunks, without holding the whole pdf in memory.
+    Keep-alive connections of http and https are pooled per host. Other schemes such as file are opened by urllib.
+    @param timeout:
+        Seconds to wait for the server on each connection, send and receive.
+    @param max_bytes:
+        Pdfs larger than this fail with DownloadError.
+    """
+    chunk_size = 64 * 1024
+    max_redirects = 5
+    # idle connections kept per host
+    max_idle_connections = 4
+    redirect_statuses = (301, 302, 303, 307, 308)
+
+    def __init__(self, timeout=30, max_bytes=200 * 1024 * 1024):
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self._idle_connections = {}
+        self._lock = threading.Lock()
+        self._ssl_context = None
+
+    @staticmethod
+    def _is_http(url):
+        return urllib.parse.urlsplit(url).scheme in ('http', 'https')
+
+    def download(self, url, file_path):
+        """
+        @return: validators of the downloaded pdf, a dict with 'etag' and 'last_modified' if the server sent them.
+        """
+        partial_path = file_path + '.part'
+        try:
+            if self._is_http(url):
+                host, connection, response = self._open(url, {})
+                try:
+                    if response.status != 200:
+                        raise DownloadError(f"{url}: {response.status} {response.reason}")
+                    self._save(url, response, partial_path)
+                except BaseException:
+                    connection.close()
+                    raise
+                self._release(host, connection, response)
+                validators = self._validators(response)
+            else:
+                with urllib.request.urlopen(url, timeout=self.timeout) as response:
+                    self._save(url, response, partial_path)
+                validators = {}
+            os.replace(partial_path, file_path)
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+        return validators
+
+    def is_modified(self, url, validators):
+        """
+        Ask the server whether the pdf has changed since it was downloaded, by a conditional GET.
+        @param validators:
+            Returned by download.
+        @return: False if the server answers 304 Not Modified.
+        """
+        if not self._is_http(url) or not validators:
+            return True
+        headers = {}
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+        host, connection, response = self._open(url, headers)
+        if response.status == 304:
+            response.read()
+            self._release(host, connection, response)
+            return False
+        # the body is not needed, so the connection is closed instead of reading it
+        connection.close()
+        if response.status != 200:
+            raise DownloadError(f"{url}: {response.status} {response.reason}")
+        return True
+
+    @staticmethod
+    def _validators(response):
+        validators = {'etag': response.getheader('ETag'), 'last_modified': response.getheader('Last-Modified')}
+        return {name: value for name, value in validators.items() if value}
+
+    def _save(self, url, response, file_path):
+        length = response.headers.get('Content-Length')
+        if length and length.isdigit() and int(length) > self.max_bytes:
+            raise DownloadError(f"{url} is larger than {self.max_bytes} bytes.")
+        n_bytes = 0
+        with open(file_path, 'wb') as f:
+            for chunk in iter(lambda: response.read(self.chunk_size), b''):
+                n_bytes += len(chunk)
+                if n_bytes > self.max_bytes:
+                    raise DownloadError(f"{url} is larger than {self.max_bytes} bytes.")
+                f.write(chunk)
+
+    def _open(self, url, headers):
+        """
+        Send a GET request following redirects.
+        @return: (host, connection, response). The connection is to be released or closed by the caller.
+        """
+        for _ in range(self.max_redirects + 1):
+            parts = urllib.parse.urlsplit(url)
+            host = (parts.scheme, parts.hostname, parts.port)
+            path = urllib.parse.urlunsplit(('', '', parts.path or '/', parts.query, ''))
+            connection, response = self._send(host, path, headers)
+            location = response.getheader('Location')
+            if response.status not in self.redirect_statuses or not location:
+                return host, connection, response
+            response.read()
+            self._release(host, connection, response)
+            url = urllib.parse.urljoin(url, location)
+        raise DownloadError(f"too many redirects: {url}")
+
+    def _send(self, host, path, headers):
+        headers = dict(headers, **{'Accept-Encoding': 'identity'})
+        connection = self._acquire(host)
+        if connection is not None:
+            try:
+                connection.request('GET', path, headers=headers)
+                return connection, connection.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # the server has closed the idle connection
+                connection.close()
+        connection = self._connect(host)
+        try:
+            connection.request('GET', path, headers=headers)
+            return connection, connection.getresponse()
+        except BaseException:
+            connection.close()
+            raise
+
+    def _connect(self, host):
+        scheme, hostname, port = host
+        if scheme == 'https':
+            if self._ssl_context is None:
+                self._ssl_context = ssl.create_default_context()
+            return http.client.HTTPSConnection(hostname, port, timeout=self.timeout, context=self._ssl_context)
+        return http.client.HTTPConnection(hostname, port, timeout=self.timeout)
+
+    def _acquire(self, host):
+        with self._lock:
+            connections = self._idle_connections.get(host)
+            return connections.pop() if connections else None
+
+    def _release(self, host, connection, response):
+        """
+        Keep the connection for the next request to the host. The response must have been read to the end.
+        """
+        if response.will_close:
+            connection.close()
+            return
+        with self._lock:
+            connections = self._idle_connections.setdefault(host, [])
+            if len(connections) < self.max_idle_connections:
+                connections.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        """
+        Close the idle connections.
+        """
+        with self._lock:
+            connections = [connection for pooled in self._idle_connections.values() for connection in pooled]
+            self._idle_connections = {}
+        for connection in connections:
+            connection.close()
@@ -1,12 +1,14 @@
 import re
 import os
+import json
 import math
 import base64
-from io import BytesIO
+import functools
+import mimetypes
+from urllib.parse import quote
 from os.path import join as pjoin
-from glob import glob
-from PIL import Image
 from paper2html.paper import PaperItemType, BBox
+from paper2html.image_profile import ImageProfile
 from paper2html import templates
 
 
@@ -16,10 +18,18 @@ except ImportError:
     import importlib_resources as pkg_resources
 
 
+@functools.lru_cache(maxsize=None)
+def _read_template(name):
+    return pkg_resources.read_text(templates, name)
+
+
 class HtmlPaper:
     def __init__(self, paper, pdf_name):
         self.paper = paper
         self.pdf_name = pdf_name
+        self.image_profile = ImageProfile.get(None)
+        self.asset_url = None
+        self._img_elems_cache = {}
 
     def _get_zoomed_pixel(self, paper_item):
         column_bbox = self.paper.pages[paper_item.page_n].address_bbox(paper_item.address)
@@ -30,7 +40,7 @@ class HtmlPaper:
 
     def _paragraph2elem(self, paragraph, i):
         txt_template = '<p data-address="{}" id="txt{}">{}</p>\n'
-        img_template = '<p data-address="{}" id="txt{}"><img alt="Figure" src="./{}" /></p>\n'
+        img_template = '<p data-address="{}" id="txt{}"><img alt="Figure" src="{}" /></p>\n'
         if len(paragraph) == 0:
             return ""
         address_2d = [(paper_item.page_n, *self._get_zoomed_pixel(paper_item)) for paper_item in paragraph]
@@ -38,10 +48,39 @@ class HtmlPaper:
         if paragraph[0].type == PaperItemType.SectionHeader:
             return '<h2 data-address="{}" id="txt{}">{}</h2>\n'.format(address_str, i, paragraph.content)
         elif paragraph[0].type == PaperItemType.Figure:
-            return img_template.format(address_str, i, os.path.relpath(paragraph[0].url, self.paper.output_dir))
+            return img_template.format(address_str, i,
+                                       self._asset_url(os.path.relpath(paragraph[0].url, self.paper.output_dir)))
         else:
             return txt_template.format(address_str, i, paragraph.content)
 
+    @staticmethod
+    def _text_record(paragraph, html_filename, i):
+        """
+        段落のテキストを索引に載せるための辞書．図とテキストのない段落はNone．
+        """
+        if len(paragraph) == 0 or paragraph[0].type == PaperItemType.Figure:
+            return None
+        text = paragraph.content
+        if not text.strip():
+            return None
+        return {'html': html_filename, 'id': i, 'page': paragraph[0].page_n, 'address': int(paragraph[0].address),
+                'text': text}
+
+    def _open_text_index(self, text_index_filename):
+        if text_index_filename is None:
+            return None
+        return open(pjoin(self.paper.output_dir, 'resources', text_index_filename), 'w', encoding='utf-8')
+
+    def _asset_url(self, relpath):
+        """
+        htmlから参照するファイルのurl．asset_urlが指定されていれば，それを前に付ける．
+        """
+        relpath = relpath.replace(os.sep, '/')
+        if not self.asset_url:
+            return relpath
+        paper_dirname = os.path.basename(os.path.normpath(self.paper.output_dir))
+        return self.asset_url.format(paper=quote(paper_dirname)) + quote(relpath)
+
     @staticmethod
     def _chunks(list, n):
         if n == math.inf:
@@ -50,52 +89,119 @@ class HtmlPaper:
         for i in range(0, len(list), n):
             yield list[i:i + n]
 
-    def _export_zoomed_htmls(self, css_rel_path, inline):
-        html_pages = []
-        for paragraphs in self._chunks(self.paper.paragraphs, self.paper.n_div_paragraph):
-            content = "".join(
-                [self._paragraph2elem(paragraph, i) for i, paragraph in enumerate(paragraphs)])
-            html_pages.append(content)
+    def _page_img_elems(self, inline):
+        """
+        原稿のページ画像のimg要素．画像の変換はページごとに一度だけ行い，全てのhtmlで使い回す．
+        """
+        if self._img_elems_cache.get(inline) is None:
+            image_store = self.paper.pages[0].image_store
+            img_elems = []
+            for page in self.paper.pages:
+                abspath = image_store.path(page.page_n)
+                relpath = os.path.relpath(abspath, self.paper.output_dir)
+                # 座標はページ画像のpixelで表すので，縮小してもwidthとheightは元の大きさのままにする
+                width, height = image_store.size(page.page_n)
+                if self.image_profile.keeps_original:
+                    src = self._page_image_src(abspath, relpath, inline)
+                else:
+                    src = self._encoded_page_image_src(page, inline)
+                # 埋め込まない場合は，表示位置が近づいてからスクリプトが読み込む
+                src_attr = "src" if inline else "data-src"
+                img_elems.append(f'<img {src_attr}="{src}" width="{width}" height="{height}" class="display_non" id="{relpath}">')
+            self._img_elems_cache[inline] = img_elems
+        return self._img_elems_cache[inline]
+
+    def _page_image_src(self, abspath, relpath, inline):
+        if not inline:
+            return self._asset_url(relpath)
+        # 画像を展開・再圧縮せずにファイルの中身をそのまま埋め込む
+        with open(abspath, 'rb') as f:
+            img_str = base64.b64encode(f.read())
+        return "data:{};base64,".format(self._mime_type(abspath)) + img_str.decode()
 
-        image_dir = self.paper.pages[0].image_dir
-        original_image_paths = sorted([os.path.relpath(abspath, self.paper.output_dir) for abspath in glob(pjoin(image_dir, "*.png"))])
+    @staticmethod
+    def _mime_type(path):
+        _, ext = os.path.splitext(path)
+        return mimetypes.types_map.get(ext.lower(), "image/png")
+
+    def _encoded_page_image_src(self, page, inline):
+        image = self.paper.pages[0].image_store.get(page.page_n)
+        encoded = self.image_profile.encode(image, text_only=not page.has_figure)
+        if inline:
+            return "data:{};base64,".format(self.image_profile.mime_type) + base64.b64encode(encoded).decode()
+        relpath = pjoin('resources', 'pages', 'page_%d%s' % (page.page_n, self.image_profile.extension))
+        abspath = pjoin(self.paper.output_dir, relpath)
+        os.makedirs(os.path.dirname(abspath), exist_ok=True)
+        with open(abspath, 'wb') as f:
+            f.write(encoded)
+        return self._asset_url(relpath)
+
+    def _css_part(self, css_rel_path, inline):
+        if inline:
+            css_content = _read_template("stylesheet.css")
+            return f'<style type="text/css">\n<!--\n{css_content}\n-->\n</style>'
+        return f'<link href="{self._asset_url(css_rel_path)}" rel="stylesheet" type="text/css" />'
+
+    def _javascript(self):
+        image_store = self.paper.pages[0].image_store
+        original_image_paths = [os.path.relpath(image_store.path(page.page_n), self.paper.output_dir)
+                                for page in self.paper.pages]
+        # slot: paper_img_paths
+        return _read_template("two_panes_with_zoom.js").replace("####", str(original_image_paths))
+
+    def _html_parts(self, paragraphs, css_part, inline, html_filename=None, text_index=None):
+        """
+        1つのhtmlを先頭から順に断片で返す．
+        paragraphsは段落を順に返すイテレータでもよい．ページ画像とスクリプトは全ての段落を返した後に作る．
+        text_indexが与えられれば，段落のテキストをhtml_filenameの段落として1行ずつ書き出す．
+        """
+        # TODO: ダウンロードリンクを設定するか，変換前ページを出力する
+        original_link = self.paper.output_dir + '.pdf'
+        # ページ切り替えをどうするか→上下の矩形に含まれるページを両方ズームで表示して並べる，矩形外はマスクせず重ねない
+        # slot: css_rel_path, title, original url, right pane, non_display_imgs, script
+        top_html_parts = _read_template("two_panes_with_zoom.html").split("{}")
+        yield top_html_parts[0]
+        yield css_part
+        yield top_html_parts[1]
+        yield self.pdf_name
+        yield top_html_parts[2]
+        yield original_link
+        yield top_html_parts[3]
+        for j, paragraph in enumerate(paragraphs):
+            yield self._paragraph2elem(paragraph, j)
+            if text_index is not None:
+                record = self._text_record(paragraph, html_filename, j)
+                if record is not None:
+                    text_index.write(json.dumps(record, ensure_ascii=False) + '\n')
+        yield top_html_parts[4]
+        for k, img_elem in enumerate(self._page_img_elems(inline)):
+            if k != 0:
+                yield '\n'
+            yield img_elem
+        yield top_html_parts[5]
+        # コンテナにcanvasを載せてスクロールを実現する，コンテナにブラウザ上のサイズをもたせる．canvasのサイズは表示する論文のサイズからステップごとに変更される．
+        yield self._javascript()
+        yield top_html_parts[6]
+
+    def _export_zoomed_htmls(self, css_rel_path, inline, progress=None, text_index_filename=None):
+        css_part = self._css_part(css_rel_path, inline)
         html_files = []
-        for i, page in enumerate(html_pages):
-            output_filename = self.pdf_name + '_%d.html' % i
-            output_path = pjoin(self.paper.output_dir, output_filename)
-            with open(output_path, 'w', encoding="utf-8_sig") as f:
-                # TODO: ダウンロードリンクを設定するか，変換前ページを出力する
-                original_link = self.paper.output_dir + '.pdf'
-                # ページ切り替えをどうするか→上下の矩形に含まれるページを両方ズームで表示して並べる，矩形外はマスクせず重ねない
-                # slot: css_rel_path, title, original url, right pane, non_display_imgs, script
-                top_html_template = pkg_resources.read_text(templates, "two_panes_with_zoom.html")
-                # コンテナにcanvasを載せてスクロールを実現する，コンテナにブラウザ上のサイズをもたせる．canvasのサイズは表示する論文のサイズからステップごとに変更される．
-                # slot: paper_img_paths
-                javascript = pkg_resources.read_text(templates, "two_panes_with_zoom.js")
-                if inline:
-                    css_content = pkg_resources.read_text(templates, "stylesheet.css")
-                    css_part = f'<style type="text/css">\n<!--\n{css_content}\n-->\n</style>'
-                else:
-                    css_part = f'<link href="{css_rel_path}" rel="stylesheet" type="text/css" />'
-                imgs = []
-                for abspath in sorted(glob(pjoin(image_dir, "*.png"))):
-                    relpath = os.path.relpath(abspath, self.paper.output_dir)
-                    img = Image.open(abspath)
-                    width, height = img.size
-                    if inline:
-                        buffered = BytesIO()
-                        img.save(buffered, format="PNG")
-                        img_str = base64.b64encode(buffered.getvalue())
-                        src = "data:image/png;base64," + img_str.decode()
-                    else:
-                        src = relpath
-                    img_elm = f'<img src="{src}" width="{width}" height="{height}" class="display_non" id="{relpath}">'
-                    imgs.append(img_elm)
-                imgs = '\n'.join(imgs)
-                f.write(top_html_template.format(css_part, self.pdf_name, original_link, page,
-                                                 imgs,
-                                                 javascript.replace("####", str(original_image_paths))))
-            html_files.append(output_path)
+        chunks = list(self._chunks(self.paper.paragraphs, self.paper.n_div_paragraph))
+        text_index = self._open_text_index(text_index_filename)
+        try:
+            for i, paragraphs in enumerate(chunks):
+                output_filename = self.pdf_name + '_%d.html' % i
+                output_path = pjoin(self.paper.output_dir, output_filename)
+                # html全体を文字列として組み立てずに，先頭から順にファイルへ書き出す
+                with open(output_path, 'w', encoding="utf-8_sig") as f:
+                    for part in self._html_parts(paragraphs, css_part, inline, output_filename, text_index):
+                        f.write(part)
+                html_files.append(output_path)
+                if progress:
+                    progress('export', i + 1, len(chunks))
+        finally:
+            if text_index is not None:
+                text_index.close()
         return html_files
 
     def _bbox2pixel(self, bbox, page_n):
@@ -103,10 +209,57 @@ class HtmlPaper:
         assert bbox.orig == 'LB'
         return (*page._pt2pixel(bbox.left, bbox.top), *page._pt2pixel(bbox.right, bbox.bottom))
 
-    def export(self, inline=True):
+    def _prepare_export(self, image_profile, asset_url):
+        self.image_profile = ImageProfile.get(image_profile)
+        self.asset_url = asset_url
+        self._img_elems_cache = {}
         css_rel_path = pjoin('resources', 'stylesheet.css')
         css_filename = pjoin(self.paper.output_dir, css_rel_path)
         with open(css_filename, 'w', encoding="utf-8_sig") as f:
-            f.write(pkg_resources.read_text(templates, 'stylesheet.css'))
+            f.write(_read_template('stylesheet.css'))
+        return css_rel_path
+
+    def export(self, inline=True, image_profile=None, asset_url=None, progress=None, text_index_filename=None):
+        """
+        @param inline:
+            Whether to embed the stylesheet and page images in the html.
+            If not, page images are loaded by the viewer when the text near them is shown.
+        @param image_profile:
+            ImageProfile or its name to encode page images. Default is to use the rasterized png files as they are.
+        @param asset_url:
+            Url prefix of the files referred from the html, e.g. "/paper2html/assets/{paper}/".
+            {paper} is replaced with the name of the output directory. Default is the relative path.
+        @param progress:
+            Optional hook called as progress('export', html files written, number of html files).
+        @param text_index_filename:
+            Filename in the resources to write the text of the paragraphs to as json lines, for a search index.
+            Each line has the html filename, the number in the id of the paragraph, the page, the address and the text.
+            Default is not to write it.
+        """
+        css_rel_path = self._prepare_export(image_profile, asset_url)
+        return self._export_zoomed_htmls(css_rel_path, inline, progress, text_index_filename)
 
-        return self._export_zoomed_htmls(css_rel_path, inline)
+    def export_stream(self, pages, inline=True, image_profile=None, asset_url=None, text_index_filename=None):
+        """
+        認識済みのページを順に受け取りながら1つのhtmlを書き出し，書き出した断片を順に返すジェネレータ．
+        paperにはまだページを追加していないこと．n_div_paragraphによる分割は行わない．
+        htmlは書き終えてから<pdf_name>_0.htmlという名前になる．引数はexportと同じ．
+        """
+        css_rel_path = self._prepare_export(image_profile, asset_url)
+        css_part = self._css_part(css_rel_path, inline)
+        output_filename = self.pdf_name + '_0.html'
+        output_path = pjoin(self.paper.output_dir, output_filename)
+        partial_path = output_path + '.part'
+        text_index = self._open_text_index(text_index_filename)
+        try:
+            with open(partial_path, 'w', encoding="utf-8_sig") as f:
+                for part in self._html_parts(self.paper.iter_paragraphs(pages), css_part, inline, output_filename,
+                                             text_index):
+                    f.write(part)
+                    yield part
+            os.replace(partial_path, output_path)
+        finally:
+            if text_index is not None:
+                text_index.close()
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
@@ -0,0 +1,98 @@
+from io import BytesIO
+from PIL import Image
+
+
+class ImageProfile:
+    """
+    How page images and crops are encoded for the output html.
+    @param fmt:
+        'png', 'webp' or 'jpeg'.
+    @param quality:
+        Quality of lossy formats (1-100).
+    @param max_width:
+        Images wider than this are downscaled keeping the aspect ratio.
+    @param text_page_colors:
+        Number of gray levels used for pages without figures. Colors are kept if None.
+    """
+    extensions = {'png': '.png', 'webp': '.webp', 'jpeg': '.jpg'}
+    mime_types = {'png': 'image/png', 'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+
+    def __init__(self, fmt='png', quality=None, max_width=None, text_page_colors=None):
+        if fmt not in self.extensions:
+            raise ValueError(f"unsupported image format: {fmt}")
+        self.fmt = fmt
+        self.quality = quality
+        self.max_width = max_width
+        self.text_page_colors = text_page_colors
+
+    @property
+    def extension(self):
+        return self.extensions[self.fmt]
+
+    @property
+    def mime_type(self):
+        return self.mime_types[self.fmt]
+
+    @property
+    def keeps_original(self):
+        """
+        Whether rasterized png files can be used as they are.
+        """
+        return self.fmt == 'png' and self.max_width is None and self.text_page_colors is None
+
+    @staticmethod
+    def get(profile):
+        """
+        @param profile:
+            ImageProfile, name of a profile in IMAGE_PROFILES, or None for the lossless default.
+        """
+        if profile is None:
+            return IMAGE_PROFILES['png']
+        if isinstance(profile, ImageProfile):
+            return profile
+        if profile not in IMAGE_PROFILES:
+            raise ValueError(f"unknown image profile: {profile}. choose from {', '.join(IMAGE_PROFILES)}")
+        return IMAGE_PROFILES[profile]
+
+    def _is_quantized(self, text_only):
+        return text_only and bool(self.text_page_colors)
+
+    def convert(self, image, text_only=False):
+        if self.max_width and image.width > self.max_width:
+            height = max(1, round(image.height * self.max_width / image.width))
+            image = image.resize((self.max_width, height), Image.LANCZOS)
+        if self._is_quantized(text_only):
+            # dithering spoils the compression
+            image = image.convert('L').quantize(self.text_page_colors, dither=Image.NONE)
+            if self.fmt != 'png':
+                image = image.convert('L')
+        if self.fmt == 'jpeg' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        return image
+
+    def save(self, image, fp, text_only=False):
+        image = self.convert(image, text_only)
+        options = {}
+        if not self.keeps_original:
+            options = {'optimize': True} if self.fmt != 'webp' else {'method': 4}
+        if self.fmt == 'webp' and self._is_quantized(text_only):
+            # text pages reduced to a few gray levels are smaller and sharper when lossless
+            options['lossless'] = True
+        elif self.quality is not None:
+            options['quality'] = self.quality
+        image.save(fp, format=self.fmt.upper(), **options)
+
+    def encode(self, image, text_only=False):
+        buffered = BytesIO()
+        self.save(image, buffered, text_only)
+        return buffered.getvalue()
+
+
+IMAGE_PROFILES = {
+    # lossless, same as the rasterized pages
+    'png': ImageProfile('png'),
+    # gray palette png for text pages, pages with figures are kept as they are
+    'palette': ImageProfile('png', text_page_colors=16),
+    'webp': ImageProfile('webp', quality=60, max_width=1400, text_page_colors=16),
+    'jpeg': ImageProfile('jpeg', quality=60, max_width=1400, text_page_colors=16),
+}
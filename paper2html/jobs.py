@@ -0,0 +1,125 @@
+import logging
+import threading
+import time
+import uuid
+
+
+class Job:
+    """
+    A conversion requested through the job api.
+    The state is 'queued' until the conversion reports progress, then 'running', and finally 'done' or 'failed'.
+    Progress is kept per stage as {'done': ..., 'total': ...}.
+    """
+    def __init__(self, url):
+        self.id = uuid.uuid4().hex
+        self.url = url
+        self.state = 'queued'
+        self.progress = {}
+        self.result_html = None
+        self.error = None
+        self.updated = time.time()
+        self.version = 0
+        self._condition = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.state in ('done', 'failed')
+
+    def _update(self, **attrs):
+        with self._condition:
+            for name, value in attrs.items():
+                setattr(self, name, value)
+            self.updated = time.time()
+            self.version += 1
+            self._condition.notify_all()
+
+    def report(self, stage, done, total):
+        """
+        Progress hook of the conversion.
+        """
+        with self._condition:
+            progress = dict(self.progress)
+            progress[stage] = {'done': done, 'total': total}
+            self._update(state='running', progress=progress)
+
+    def finish(self, result_html):
+        self._update(state='done', result_html=result_html)
+
+    def fail(self, error):
+        self._update(state='failed', error=error)
+
+    def wait(self, version, timeout=None):
+        """
+        Block until the job is updated from the version, or the timeout.
+        @return: the current version.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+    def to_dict(self):
+        with self._condition:
+            return {
+                'id': self.id,
+                'url': self.url,
+                'state': self.state,
+                'progress': {stage: dict(counts) for stage, counts in self.progress.items()},
+                'error': self.error,
+            }
+
+
+class JobManager:
+    """
+    Runs conversions in the background and keeps their jobs.
+    A job for a url being converted is shared instead of starting another one.
+    Finished jobs are forgotten after keep_seconds.
+    @param convert:
+        Function called as convert(url, progress) on a background thread, returning the converted html.
+    """
+    keep_seconds = 60 * 60
+
+    def __init__(self, convert):
+        self._convert = convert
+        self._jobs = {}
+        self._active = {}
+        self._lock = threading.Lock()
+
+    def submit(self, url):
+        """
+        @return: the job converting the url.
+        """
+        with self._lock:
+            self._forget_old_jobs()
+            job = self._active.get(url)
+            if job is None:
+                job = Job(url)
+                self._jobs[job.id] = job
+                self._active[url] = job
+                threading.Thread(target=self._run, args=(job,), daemon=True).start()
+            return job
+
+    def get(self, job_id):
+        """
+        @return: the job, or None if it is unknown.
+        """
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job):
+        try:
+            result_html = self._convert(job.url, job.report)
+        except Exception as e:
+            logging.exception('conversion of %s failed.', job.url)
+            job.fail(str(e))
+        else:
+            job.finish(result_html)
+        finally:
+            with self._lock:
+                if self._active.get(job.url) is job:
+                    del self._active[job.url]
+
+    def _forget_old_jobs(self):
+        expired = time.time() - self.keep_seconds
+        for job_id, job in list(self._jobs.items()):
+            if job.finished and job.updated < expired:
+                del self._jobs[job_id]
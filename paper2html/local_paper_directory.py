@@ -1,13 +1,23 @@
+import html
+import http.client
+import json
 import math
 import os
 import shutil
-import urllib.request
+import tempfile
+import time
+import urllib.parse
 
 from watchdog.events import PatternMatchingEventHandler, FileSystemEvent
 from watchdog.observers import Observer
 
-from paper2html import paper2html
+from paper2html.catalog import PaperCatalog
+from paper2html.commands import paper2html_file, paper2html_stream
+from paper2html.conversion_cache import ConversionCache, file_sha256
+from paper2html.downloader import DownloadError, PdfDownloader
 from paper2html.paper import Paper
+from paper2html.scheduler import ConversionScheduler
+from paper2html.watch_queue import DebouncedQueue
 from paper2html import templates
 
 
@@ -17,37 +27,54 @@ except ImportError:
     import importlib_resources as pkg_resources
 
 
-def paper2one_html(src_path, cache_dir, debug):
-    line_margin_rate = None
+ASSET_URL = "/paper2html/assets/{paper}/"
+# written in the resources of a converted paper to be indexed for the search
+TEXT_INDEX_FILENAME = "paragraphs.jsonl"
+
+
+def paper2one_html(src_path, cache_dir, debug, line_margin_rate=None, image_profile='png', progress=None):
+    """
+    @return: (the converted html, how the pdf is repaired. see paper2html.commands.repair_pdf)
+    """
     verbose = debug
     Paper.n_div_paragraph = math.inf
-    results = list(paper2html(src_path, cache_dir, line_margin_rate, verbose))
+    # page images are served by the asset route and loaded by the viewer on demand
+    results, repair = paper2html_file(src_path, cache_dir, line_margin_rate, verbose, image_profile=image_profile,
+                                      inline=False, asset_url=ASSET_URL, lean=True, progress=progress,
+                                      text_index_filename=TEXT_INDEX_FILENAME)
     assert len(results) == 1
-    return results[0]
+    return results[0], repair
 
 
-def download(url, dir_path):
-    _, filename = os.path.split(url)
-    file_path = os.path.join(dir_path, filename)
-    with urllib.request.urlopen(url) as uf:
-        with open(file_path, 'bw') as of:
-            of.write(uf.read())
-        print('download pdf.')
-        if not os.path.exists(file_path):
-            print('download failed.')
-    return file_path
+def stream_one_html(src_path, cache_dir, line_margin_rate=None, image_profile='png'):
+    """
+    Same as paper2one_html, yielding the html text while it is converted.
+    @return: how the pdf is repaired, as the value of yield from.
+    """
+    Paper.n_div_paragraph = math.inf
+    return (yield from paper2html_stream(src_path, cache_dir, line_margin_rate, image_profile=image_profile,
+                                 inline=False, asset_url=ASSET_URL, text_index_filename=TEXT_INDEX_FILENAME))
 
 
 class TemporaryDownloader:
-    def __init__(self, url, temp_dir):
+    def __init__(self, url, temp_dir, downloader):
         self.url = url
         self.temp_dir = temp_dir
+        self.downloader = downloader
         self.downloaded_path = None
+        self.validators = None
 
     def __enter__(self):
         if not os.path.exists(self.temp_dir):
             os.mkdir(self.temp_dir)
-        self.downloaded_path = download(self.url, self.temp_dir)
+        _, filename = os.path.split(self.url)
+        self.downloaded_path = os.path.join(self.temp_dir, filename)
+        try:
+            self.validators = self.downloader.download(self.url, self.downloaded_path)
+        except BaseException:
+            shutil.rmtree(self.temp_dir)
+            raise
+        print('download pdf.')
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
@@ -56,30 +83,68 @@ class TemporaryDownloader:
 
 class PdfFilePlacedEventHandler(PatternMatchingEventHandler):
     def __init__(self, handler, case_sensitive=False, debug=False, server_mode=False):
-        super().__init__(("*.pdf",), ignore_patterns=None, ignore_directories=True, case_sensitive=case_sensitive)
+        super().__init__(patterns=("*.pdf",), ignore_patterns=None, ignore_directories=True,
+                         case_sensitive=case_sensitive)
         self.handler = handler
         self.debug = debug
         self.server_mode = server_mode
 
+    @staticmethod
+    def _placed_path(event):
+        # e.g. rsync writes to a temporary file and renames it to the pdf
+        if str(event.event_type) == 'moved':
+            return event.dest_path
+        return event.src_path
+
     def _is_placed(self, event):
         # file server may write pdf file without locking.
-        if self.server_mode and str(event.event_type) != 'closed':
+        if self.server_mode and str(event.event_type) not in ('closed', 'moved'):
+            return False
+
+        # reading the file (e.g. to hash it) must not place it again
+        if str(event.event_type) not in ('created', 'modified', 'closed', 'moved'):
             return False
 
-        if not os.path.exists(event.src_path):
+        if not self._placed_path(event).lower().endswith('.pdf'):
             return False
 
         return True
 
     def on_any_event(self, event: FileSystemEvent):
         if self._is_placed(event):
-            self.handler(event)
+            self.handler(self._placed_path(event))
 
 
 class LocalPaperDirectory:
-    def __init__(self, dir_path, watch, debug=False):
+    """
+    Directory of converted papers.
+    Results are keyed by the contents of the pdf and the conversion parameters,
+    so the same pdf from different urls is converted once and different pdfs with the same filename do not collide.
+    Conversions run in a pool of worker processes, and concurrent requests for the same url or pdf share one of them.
+    Pdfs downloaded from a url are revalidated by a conditional GET with the ETag or Last-Modified sent by the server.
+    In the watch mode, pdfs placed in the directory are queued and converted once their events settle for
+    watch_delay seconds. Pdfs placed while the directory was not watched are queued when the watching starts.
+    @param workers:
+        Number of worker processes converting pdfs. If 0, pdfs are converted on the requesting thread.
+        The same number of threads take the placed pdfs from the queue.
+    @param downloader:
+        PdfDownloader with the timeout and the size limit of downloads. Default is PdfDownloader().
+    """
+    watch_delay = 2.0
+    index_page_size = 100
+
+    def __init__(self, dir_path, watch, debug=False, line_margin_rate=None, image_profile='png', workers=2,
+                 downloader=None):
         self._init_paper_dir(dir_path)
+        self.cache = ConversionCache(self.paper_dir)
+        self.catalog = PaperCatalog(self.paper_dir)
+        if len(self.catalog) == 0:
+            self._catalog_results()
+        self.scheduler = ConversionScheduler(workers)
+        self.downloader = downloader or PdfDownloader()
+        self.conversion_params = {'line_margin_rate': line_margin_rate, 'image_profile': image_profile}
         self.obs = None
+        self.watch_queue = DebouncedQueue(self._ingest_pdf, max(workers, 1), self.watch_delay)
         self.debug = debug
         if watch:
             self.start_watching()
@@ -97,91 +162,348 @@ class LocalPaperDirectory:
             os.mkdir(paper_dir)
         self.paper_dir = paper_dir
 
-    def _get_working_dir(self, filename):
-        basename, _ = os.path.splitext(filename)
-        working_dir = os.path.join(self.paper_dir, basename)
-        return working_dir
-
-    def _init_working_dir(self, filename):
-        working_dir = self._get_working_dir(filename)
-        if not os.path.exists(working_dir):
-            print('creating working dir.')
-            os.mkdir(working_dir)
-        return working_dir
-
-    def _download2working_dir(self, url):
-        _, filename = os.path.split(url)
-        working_dir = self._init_working_dir(filename)
-        return download(url, working_dir)
-
-    def _store_pdf(self, pdf_path):
-        _, filename = os.path.split(pdf_path)
-        stored_pdf_path = os.path.join(self._init_working_dir(filename), filename)
-        shutil.move(pdf_path, stored_pdf_path)
+    @staticmethod
+    def _alias(url_or_path):
+        """
+        Urls are told apart as they are, local paths and filenames by the filename.
+        """
+        if urllib.parse.urlparse(url_or_path).scheme in ('http', 'https', 'ftp', 'file'):
+            return url_or_path
+        return os.path.basename(url_or_path)
+
+    def _result_key(self, pdf_sha256):
+        return ConversionCache.result_key(pdf_sha256, self.conversion_params)
+
+    def _add_aliases(self, pdf_path, aliases):
+        """
+        @return: SHA-256 of the pdf.
+        """
+        pdf_sha256 = file_sha256(pdf_path)
+        for alias in aliases:
+            self.cache.add_alias(alias, pdf_sha256)
+        return pdf_sha256
 
     def get_result_html_path(self, url_or_path):
-        _, filename = os.path.split(url_or_path)
-        working_dir = self._get_working_dir(filename)
-        basename, _ = os.path.splitext(filename)
-        # paper_dir/basename/basename_0.html
-        result_html = os.path.join(working_dir, f"{basename}_0.html")
-        return result_html
+        """
+        @return: the html converted with the current parameters from the pdf last seen as the url or filename,
+            or None if it is not converted yet.
+        """
+        pdf_sha256 = self.cache.pdf_sha256(self._alias(url_or_path))
+        if pdf_sha256 is None:
+            return None
+        return self.cache.result_html(self._result_key(pdf_sha256))
 
     def is_converted(self, url_or_path):
-        return os.path.exists(self.get_result_html_path(url_or_path))
+        return self.get_result_html_path(url_or_path) is not None
+
+    def revalidate(self, download_url):
+        """
+        @return: the converted html if the pdf at the url has not changed since it was downloaded,
+            or None if it must be downloaded again.
+            The html is also returned if the server cannot tell, e.g. it sent no validators or is unreachable.
+        """
+        result_html = self.get_result_html_path(download_url)
+        if result_html is None:
+            return None
+        validators = self.cache.validators(download_url)
+        if not validators:
+            return result_html
+        try:
+            modified = self.downloader.is_modified(download_url, validators)
+        except (OSError, http.client.HTTPException, DownloadError):
+            return result_html
+        return None if modified else result_html
 
-    def _is_time_to_convert(self, event):
-        base_dir, filename = os.path.split(event.src_path)
+    def _is_time_to_convert(self, pdf_path):
+        if not os.path.isfile(pdf_path):
+            return False
+        base_dir, filename = os.path.split(pdf_path)
 
         # to ignore intermediate pdf files on some OS (recursive option does not work... ?)
         if not os.path.samefile(base_dir, self.paper_dir):
             return False
 
-        # already converted
-        if self.is_converted(filename):
+        # already converted, possibly under another name
+        pdf_sha256 = self._add_aliases(pdf_path, [filename])
+        if self.cache.result_html(self._result_key(pdf_sha256)):
             return False
 
         return True
 
-    def prepare_html(self, download_url):
-        if self.is_converted(download_url):
-            # paper_dir/basename/basename_0.html
-            return self.get_result_html_path(download_url)
+    def _prepare_conversion(self, pdf_path, pdf_sha256):
+        """
+        Copy the pdf into a new directory, named after the output directory of the result.
+        @return: (result key, the copied pdf)
+        """
+        key = self._result_key(pdf_sha256)
+        stem, _ = os.path.splitext(os.path.basename(pdf_path))
+        name = f"{stem}-{key[:12]}"
+        output_dir = os.path.join(self.paper_dir, name)
+        if os.path.exists(output_dir):
+            # left by an interrupted conversion
+            shutil.rmtree(output_dir)
+        source_dir = tempfile.mkdtemp(prefix='.converting-', dir=self.paper_dir)
+        keyed_pdf = os.path.join(source_dir, name + '.pdf')
+        shutil.copyfile(pdf_path, keyed_pdf)
+        return key, keyed_pdf
+
+    def _finish_conversion(self, key, pdf_sha256, keyed_pdf, result_html, filename, repair):
+        _, keyed_filename = os.path.split(keyed_pdf)
+        pdf_path = os.path.join(os.path.dirname(result_html), keyed_filename)
+        shutil.move(keyed_pdf, pdf_path)
+        # the index links to the result by this name
+        self.cache.add_alias(keyed_filename, pdf_sha256)
+        self.cache.add_result(key, pdf_sha256, self.conversion_params, result_html, filename, repair)
+        self.catalog.add(key, ConversionCache.params_key(self.conversion_params), pdf_sha256, filename,
+                         keyed_filename, pdf_path, os.path.relpath(result_html, self.paper_dir))
+        self._index_text(key, result_html)
+
+    def _index_text(self, key, result_html):
+        """
+        Add the text of the paragraphs written with the html to the search index of the catalog.
+        """
+        text_index_path = os.path.join(os.path.dirname(result_html), 'resources', TEXT_INDEX_FILENAME)
+        if not os.path.exists(text_index_path):
+            return
+        with open(text_index_path, encoding='utf-8') as f:
+            self.catalog.add_paragraphs(key, (json.loads(line) for line in f))
+
+    def _catalog_results(self):
+        """
+        Add the results converted before the catalog existed.
+        """
+        for key, result in self.cache.results():
+            result_html = self.cache.result_html(key)
+            if result_html is None:
+                continue
+            output_dir = os.path.dirname(result_html)
+            keyed_filename = os.path.basename(output_dir) + '.pdf'
+            params_key = ConversionCache.params_key(result['params'], result['version'])
+            self.catalog.add(key, params_key, result['pdf_sha256'], result['filename'], keyed_filename,
+                             os.path.join(output_dir, keyed_filename), result['html'],
+                             os.path.getmtime(result_html))
+            self._index_text(key, result_html)
+
+    @staticmethod
+    def _discard_source(keyed_pdf):
+        shutil.rmtree(os.path.dirname(keyed_pdf), ignore_errors=True)
+
+    def _download(self, download_url):
+        # concurrent downloads of pdfs with the same filename must not share a directory
+        temp_dir = tempfile.mkdtemp(prefix='.download-', dir=self.paper_dir)
+        return TemporaryDownloader(download_url, temp_dir, self.downloader)
+
+    @staticmethod
+    def _read_html(result_html):
+        with open(result_html, encoding="utf-8_sig") as f:
+            yield f.read()
+
+    def _convert_pdf(self, pdf_path, pdf_sha256, progress=None):
+        """
+        Convert the pdf in the worker pool. Concurrent conversions of the same pdf are done once.
+        @param progress:
+            Optional hook called as progress(stage, done, total). See paper2html.commands.paper2html.
+            It is not called if the conversion has been started by another request.
+        @return: the converted html.
+        """
+        key = self._result_key(pdf_sha256)
+        return self.scheduler.run_once(('result', key), self._run_conversion, pdf_path, pdf_sha256, progress)
+
+    def _run_conversion(self, pdf_path, pdf_sha256, progress=None):
+        # converted by the previous flight while this one was starting
+        result_html = self.cache.result_html(self._result_key(pdf_sha256))
+        if result_html:
+            return result_html
+        key, keyed_pdf = self._prepare_conversion(pdf_path, pdf_sha256)
+        try:
+            result_html, repair = self.scheduler.run(paper2one_html, keyed_pdf, self.paper_dir, self.debug,
+                                                     progress=progress, **self.conversion_params)
+            self._finish_conversion(key, pdf_sha256, keyed_pdf, result_html, os.path.basename(pdf_path), repair)
+        finally:
+            self._discard_source(keyed_pdf)
+        return result_html
 
-        _, filename = os.path.split(download_url)
-        temp_dir = os.path.join(self.paper_dir, filename)
+    def _stream_conversion(self, pdf_path, pdf_sha256):
+        """
+        Same as _run_conversion, yielding the html text while it is converted.
+        """
+        result_html = self.cache.result_html(self._result_key(pdf_sha256))
+        if result_html:
+            yield from self._read_html(result_html)
+            return result_html
+        key, keyed_pdf = self._prepare_conversion(pdf_path, pdf_sha256)
+        try:
+            repair = yield from self.scheduler.stream(stream_one_html, keyed_pdf, self.paper_dir,
+                                                      **self.conversion_params)
+            name, _ = os.path.splitext(os.path.basename(keyed_pdf))
+            result_html = os.path.join(self.paper_dir, name, f"{name}_0.html")
+            self._finish_conversion(key, pdf_sha256, keyed_pdf, result_html, os.path.basename(pdf_path), repair)
+        finally:
+            self._discard_source(keyed_pdf)
+        return result_html
+
+    def prepare_html(self, download_url, progress=None):
+        """
+        Download and convert the pdf unless it is converted.
+        @param progress:
+            Optional hook called as progress(stage, done, total) while the pdf is converted.
+        @return: the converted html.
+        """
+        result_html = self.revalidate(download_url)
+        if result_html:
+            return result_html
+        # concurrent requests for the url share one download
+        return self.scheduler.run_once(('url', download_url), self._download_and_convert, download_url, progress)
 
-        # the code below makes an extra working directory because paper2html makes new one.
-        # pdf_filename = self._download2working_dir(download_url)
-        with TemporaryDownloader(download_url, temp_dir) as dl:
-            result_html = paper2one_html(dl.downloaded_path, self.paper_dir, self.debug)
-            self._store_pdf(dl.downloaded_path)
+    def _download_and_convert(self, download_url, progress=None):
+        _, filename = os.path.split(download_url)
+        with self._download(download_url) as dl:
+            pdf_sha256 = self._add_aliases(dl.downloaded_path, [download_url, filename])
+            self.cache.set_validators(download_url, dl.validators)
+            # the same pdf may be converted from another url
+            result_html = self._convert_pdf(dl.downloaded_path, pdf_sha256, progress)
             print('output html file')
             return result_html
 
-    def on_pdf_placed(self, event: FileSystemEvent):
-        if self._is_time_to_convert(event):
-            paper2one_html(event.src_path, self.paper_dir, self.debug)
-            self._store_pdf(event.src_path)
+    def stream_html(self, download_url):
+        """
+        Download and convert the pdf, yielding the html text while it is converted.
+        If the same pdf is already converted or being converted for another request, its html is yielded at once.
+        """
+        result_html, streamed = yield from self.scheduler.stream_once(
+            ('url', download_url), self._download_and_stream, download_url)
+        if not streamed:
+            yield from self._read_html(result_html)
+
+    def _download_and_stream(self, download_url):
+        _, filename = os.path.split(download_url)
+        with self._download(download_url) as dl:
+            pdf_sha256 = self._add_aliases(dl.downloaded_path, [download_url, filename])
+            self.cache.set_validators(download_url, dl.validators)
+            result_html, streamed = yield from self.scheduler.stream_once(
+                ('result', self._result_key(pdf_sha256)), self._stream_conversion, dl.downloaded_path, pdf_sha256)
+            if not streamed:
+                yield from self._read_html(result_html)
+            print('output html file')
+            return result_html
 
-    def update_index_html(self, url_factory):
-        dirs = os.listdir(self.paper_dir)
-        converted_filenames = [dirname + '.pdf' for dirname in dirs if self.is_converted(dirname)]
+    def on_pdf_placed(self, pdf_path):
+        # events of the same file are coalesced by the queue
+        self.watch_queue.put(pdf_path)
+
+    def _ingest_pdf(self, pdf_path):
+        if self._is_time_to_convert(pdf_path):
+            self._convert_pdf(pdf_path, self.cache.pdf_sha256(os.path.basename(pdf_path)))
+            os.remove(pdf_path)
+
+    def get_asset_path(self, paper_name, filename):
+        """
+        @return: the path of a file referred from the html of the paper, or None if it is out of the paper directory.
+        """
+        working_dir = os.path.abspath(os.path.join(self.paper_dir, paper_name))
+        asset_path = os.path.abspath(os.path.join(working_dir, filename))
+        if os.path.dirname(working_dir) != os.path.abspath(self.paper_dir) or \
+                os.path.commonpath([working_dir, asset_path]) != working_dir:
+            return None
+        return asset_path
+
+    def render_index_html(self, url_factory, page=1, sort='converted', descending=True):
+        """
+        The index of the papers converted with the current parameters, index_page_size papers per page.
+        @param url_factory:
+            Function to make the url browsing a paper from the filename of its pdf.
+        @param sort:
+            One of PaperCatalog.sort_columns.
+        @return: the html text.
+        """
+        params_key = ConversionCache.params_key(self.conversion_params)
+        count = self.catalog.count(params_key)
+        n_pages = max(1, math.ceil(count / self.index_page_size))
+        page = min(max(page, 1), n_pages)
+        papers = self.catalog.list(params_key, sort, descending, (page - 1) * self.index_page_size,
+                                   self.index_page_size)
+
+        def index_url(page, sort, descending):
+            order = 'desc' if descending else 'asc'
+            return f"?{urllib.parse.urlencode({'page': page, 'sort': sort, 'order': order})}"
+
+        items = []
+        for paper in papers:
+            details = [html.escape(paper['filename'])]
+            if paper['n_pages']:
+                details.append(f"{paper['n_pages']} pages")
+            if paper['size']:
+                details.append(f"{paper['size'] / (1024 * 1024):.1f} MB")
+            details.append(time.strftime('%Y-%m-%d %H:%M', time.localtime(paper['converted_at'])))
+            items.append(f'<li><a href="{html.escape(url_factory(paper["keyed_filename"]))}">'
+                         f'{html.escape(paper["title"] or paper["filename"])}</a> ({", ".join(details)})</li>')
+        sort_links = ' | '.join(
+            f'<a href="{index_url(1, name, not descending if name == sort else name in ("converted", "size"))}">'
+            f'{name}</a>' for name in self.catalog.sort_columns)
+        navigation = []
+        if page > 1:
+            navigation.append(f'<a href="{index_url(page - 1, sort, descending)}">previous</a>')
+        navigation.append(f'page {page} / {n_pages}')
+        if page < n_pages:
+            navigation.append(f'<a href="{index_url(page + 1, sort, descending)}">next</a>')
         index_html_template = pkg_resources.read_text(templates, "index.html")
-        index_html_contents = index_html_template.format("\n".join(
-            [f'<li><a href="{url_factory(filename)}">{filename}</a></li>' for filename in converted_filenames]))
-        index_file_path = os.path.join(self.paper_dir, "index.html")
-        with open(index_file_path, "w") as f:
-            f.write(index_html_contents)
-        return index_file_path
+        return index_html_template.format(count=count, sort_links=sort_links, items="\n    ".join(items),
+                                          navigation=" ".join(navigation))
+
+    def render_search_html(self, url_factory, query, page=1):
+        """
+        The paragraphs matching the query in the papers converted with the current parameters,
+        index_page_size paragraphs per page.
+        @param url_factory:
+            Function to make the url browsing a paper from the filename of its pdf.
+        @return: the html text.
+        """
+        params_key = ConversionCache.params_key(self.conversion_params)
+        page = max(page, 1)
+        # one more hit tells whether there is the next page
+        hits = self.catalog.search(params_key, query, (page - 1) * self.index_page_size, self.index_page_size + 1)
+        has_next = len(hits) > self.index_page_size
+        hits = hits[:self.index_page_size]
+
+        def search_url(page):
+            return f"?{urllib.parse.urlencode({'q': query, 'page': page})}"
+
+        items = []
+        for hit in hits:
+            snippet = html.escape(hit['snippet']).replace(PaperCatalog.match_start, '<mark>') \
+                .replace(PaperCatalog.match_end, '</mark>')
+            url = f"{url_factory(hit['keyed_filename'])}#txt{hit['paragraph']}"
+            items.append(f'<li><a href="{html.escape(url)}">{html.escape(hit["title"] or hit["filename"])}</a> '
+                         f'(page {hit["page"] + 1})<br>{snippet}</li>')
+        navigation = []
+        if page > 1:
+            navigation.append(f'<a href="{html.escape(search_url(page - 1))}">previous</a>')
+        navigation.append(f'page {page}')
+        if has_next:
+            navigation.append(f'<a href="{html.escape(search_url(page + 1))}">next</a>')
+        search_html_template = pkg_resources.read_text(templates, "search.html")
+        return search_html_template.format(query=html.escape(query), items="\n    ".join(items),
+                                           navigation=" ".join(navigation))
 
     def start_watching(self):
         obs = Observer()
         event_handler = PdfFilePlacedEventHandler(
             self.on_pdf_placed, server_mode=(str(type(obs)) == "<class 'watchdog.observers.inotify.InotifyObserver'>"))
         obs.schedule(event_handler, os.path.abspath(self.paper_dir), recursive=False)
+        self.watch_queue.start()
         obs.start()
         self.obs = obs
+        # pdfs placed while the directory was not watched
+        for entry in os.scandir(self.paper_dir):
+            if entry.is_file() and entry.name.lower().endswith('.pdf'):
+                self.watch_queue.put(entry.path, delay=0)
+
+    def shutdown(self):
+        self.stop_watching()
+        self.scheduler.shutdown()
+        self.downloader.close()
+        self.catalog.close()
+        self.cache.close()
 
     def stop_watching(self):
         if self.obs:
@@ -189,3 +511,5 @@ class LocalPaperDirectory:
             obs.unschedule_all()
             obs.stop()
             obs.join()
+            self.obs = None
+            self.watch_queue.stop()
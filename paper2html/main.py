@@ -9,6 +9,7 @@ if __name__ == '__main__':
     parser.add_argument("--watch", type=bool, default=False,
                         help="automatically convert local PDFs on the paper_cache directory.")
     parser.add_argument("--debug", type=bool, default=False)
+    parser.add_argument("--workers", type=int, default=2, help="number of processes converting pdfs.")
     args = parser.parse_args()
 
-    convert_service_run(args.host, args.port, args.dir, args.watch, args.debug)
+    convert_service_run(args.host, args.port, args.dir, args.watch, args.debug, args.workers)
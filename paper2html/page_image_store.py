@@ -0,0 +1,86 @@
+import os
+import threading
+from collections import OrderedDict
+from os.path import join as pjoin
+from PIL import Image
+
+
+class PageImageStore:
+    """
+    Page images of a paper, indexed by page number.
+    The index is built from the image directory once and rebuilt only when a page is not found yet
+    (e.g. while pages are still being rasterized).
+    Decoded images are kept in an LRU cache bounded by their total size in bytes.
+    """
+    def __init__(self, image_dir, max_cache_bytes=128 * 1024 * 1024):
+        self.image_dir = image_dir
+        self.max_cache_bytes = max_cache_bytes
+        self._paths = None
+        self._sizes = {}
+        self._cache = OrderedDict()
+        self._cache_bytes = 0
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # decoded images are not sent to other processes
+        return {'image_dir': self.image_dir, 'max_cache_bytes': self.max_cache_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(state['image_dir'], state['max_cache_bytes'])
+
+    def _build_index(self):
+        self._paths = [pjoin(self.image_dir, filename) for filename in sorted(os.listdir(self.image_dir))]
+
+    def __len__(self):
+        return len(self.paths())
+
+    def paths(self):
+        """
+        @return: list of the page image paths in page order.
+        """
+        with self._lock:
+            if self._paths is None:
+                self._build_index()
+            return list(self._paths)
+
+    def path(self, page_n):
+        with self._lock:
+            if self._paths is None or page_n >= len(self._paths):
+                self._build_index()
+            return self._paths[page_n]
+
+    def size(self, page_n):
+        """
+        The size of the page image in pixels. Only the image header is read.
+        """
+        if page_n not in self._sizes:
+            with Image.open(self.path(page_n)) as image:
+                self._sizes[page_n] = image.size
+        return self._sizes[page_n]
+
+    def get(self, page_n):
+        """
+        The decoded page image. Do not modify or close the returned image, it is shared through the cache.
+        """
+        with self._lock:
+            if page_n in self._cache:
+                self._cache.move_to_end(page_n)
+                return self._cache[page_n]
+        image = Image.open(self.path(page_n))
+        image.load()
+        n_bytes = self._image_bytes(image)
+        with self._lock:
+            if page_n in self._cache:
+                # decoded by another thread in the meantime
+                return self._cache[page_n]
+            self._cache[page_n] = image
+            self._cache_bytes += n_bytes
+            # keep at least the latest image even if it exceeds the limit by itself
+            while self._cache_bytes > self.max_cache_bytes and len(self._cache) > 1:
+                _, old_image = self._cache.popitem(last=False)
+                self._cache_bytes -= self._image_bytes(old_image)
+        return image
+
+    @staticmethod
+    def _image_bytes(image):
+        return image.width * image.height * len(image.getbands())
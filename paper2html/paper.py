@@ -1,11 +1,16 @@
 import re
-import os
 import math
+from bisect import bisect_left, bisect_right
 from enum import IntEnum
+from itertools import groupby
 import inspect
 from os.path import join as pjoin
+import numpy as np
 from PIL import Image
 from pdfminer.layout import LTTextBoxHorizontal, LTCurve, LTChar
+from paper2html.bbox_table import BBoxTable
+from paper2html.image_profile import ImageProfile
+from paper2html.text_normalizer import TextNormalizer
 
 
 def has_global_id(target_cls, name='idx'):
@@ -21,6 +26,8 @@ def has_global_id(target_cls, name='idx'):
 
 
 class BBox:
+    __slots__ = ('orig', 'left', 'bottom', 'right', 'top')
+
     def __init__(self, raw_bbox, orig='LT'):
         self.orig = orig
         # x-> yv
@@ -70,10 +77,17 @@ class BBox:
     @staticmethod
     def unify_bboxes(bboxes):
         assert len(bboxes) > 0
-        bbox = BBox([math.inf, math.inf, -math.inf, -math.inf], orig=bboxes[0].orig)
-        for item in bboxes:
-            bbox = bbox.unify(item)
-        return bbox
+        orig = bboxes[0].orig
+        for bbox in bboxes:
+            if bbox.orig != orig:
+                raise ValueError(f"origin is not the same. {orig} vs {bbox.orig}")
+        left = min(bbox.left for bbox in bboxes)
+        right = max(bbox.right for bbox in bboxes)
+        if orig == 'LT':
+            return BBox([left, min(bbox.top for bbox in bboxes), right, max(bbox.bottom for bbox in bboxes)], orig='LT')
+        if orig == 'LB':
+            return BBox([left, min(bbox.bottom for bbox in bboxes), right, max(bbox.top for bbox in bboxes)], orig='LB')
+        raise NotImplementedError
 
     def inflate(self, d):
         if self.orig == 'LB':
@@ -88,7 +102,8 @@ class BBox:
         y1 = bbox1.bottom + bbox1.top
         x2 = bbox2.left + bbox2.right
         y2 = bbox2.bottom + bbox2.top
-        return math.sqrt((x1 - x2) ** 2 + (y1 - y2) ** 2)/2.
+        # BBoxTable.center_distと同じ値になるように，2乗はpowではなく積で計算する
+        return math.sqrt((x1 - x2) * (x1 - x2) + (y1 - y2) * (y1 - y2))/2.
 
     @staticmethod
     def collided(bbox0, bbox1):
@@ -118,8 +133,18 @@ class PageAddress(IntEnum):
     Head = 0
     Left = 1
     Right = 2
-    Foot = 3
-    Etc = 4
+    # 3段組み以上のときの3段目以降
+    Column3 = 3
+    Column4 = 4
+    Foot = 5
+    Etc = 6
+
+    @staticmethod
+    def columns(n_columns):
+        """
+        左から順にn_columns段分のアドレスを返す．2段目はRightとする
+        """
+        return tuple(PageAddress(PageAddress.Left + k) for k in range(n_columns))
 
 
 class PaperItemType(IntEnum):
@@ -138,6 +163,8 @@ class PaperItemType(IntEnum):
 
 @has_global_id
 class PaperItem:
+    __slots__ = ('idx', 'lt_items', 'bbox', 'page_n', 'text', 'type', 'separated', 'crop', 'address')
+
     def __init__(self, lt_items, page_n, bbox, text, item_type, separated=False):
         bbox_ = bbox
         if bbox.right - bbox.left < 0 or bbox.top - bbox.bottom < 0:
@@ -150,9 +177,18 @@ class PaperItem:
         self.type = item_type
         # 後続のitemから分離されたものかどうか？場所によって意味が異なりバグの原因になっている
         self.separated = separated
-        self.url = None
+        self.crop = None
         self.address = None
 
+    @property
+    def url(self):
+        """
+        itemの切り抜き画像のファイル名．参照されたときに初めて書き出す．
+        """
+        if self.crop is None:
+            return None
+        return self.crop.save()
+
     def check_separated(self):
         text_box = self.lt_items[0]
         tb_bbox = BBox(text_box.bbox, 'LB')
@@ -232,20 +268,47 @@ class PaperItem:
         return results
 
 
+class CropImage:
+    """
+    ページ画像からの切り抜きを表す．画像の書き出しはファイル名が要求されるまで遅延し，一度だけ行う．
+    """
+    def __init__(self, page_n, cropbox, filename, image_profile):
+        self.page_n = page_n
+        self.cropbox = cropbox
+        self.filename = filename
+        self.image_profile = image_profile
+        self.saved = False
+
+    def save(self):
+        if not self.saved:
+            cropped = PaperPage.image_store.get(self.page_n).crop(self.cropbox)
+            if cropped.width == 0 or cropped.height == 0:
+                cropped = Image.new('RGB', (1, 1), (0xdd, 0xdd, 0xdd))
+            self.image_profile.save(cropped, self.filename)
+            self.saved = True
+        return self.filename
+
+
 @has_global_id
 class Paragraph:
     """
     １つの段落単位を表す．（PaperItemの段落は1ページに収まる段落の一部）
     段落だけでなく，図やセクションヘッダも１つの段落単位とする．
     """
+    # 段落内の行を連結する．差し替えれば別の規則で整形できる
+    text_normalizer = TextNormalizer()
+
     def __init__(self, paper_items):
         self.paper_items = paper_items
+        self._content = None
 
     def append(self, paper_item):
         self.paper_items.append(paper_item)
+        self._content = None
 
     def extend(self, paragraph):
         self.paper_items.extend(paragraph.paper_items)
+        self._content = None
 
     def __getitem__(self, item):
         return self.paper_items[item]
@@ -256,19 +319,168 @@ class Paragraph:
     @property
     def content(self):
         """
-        段落内の改行を取り除く．pdfからのコピペの整形に使用していたころの名残．
+        段落内の改行と行末のハイフネーションを取り除く．pdfからのコピペの整形に使用していたころの名残．
+        結果は段落にitemを追加するまで使い回す．
+        """
+        if self._content is None:
+            self._content = self.text_normalizer.normalize([item.text for item in self])
+        return self._content
+
+
+class ItemQueue:
+    """
+    同じアドレスのitemを上端の高い順に並べた作業キュー．
+    取り除いたitemには印を付けるだけにして，先頭の位置を進めていく．
+    """
+    def __init__(self, items):
+        self.items = items
+        self.neg_tops = [-item.bbox.top for item in items]
+        self.alive = [True] * len(items)
+        self.head = 0
+        self.n_alive = len(items)
+
+    def __bool__(self):
+        return self.n_alive > 0
+
+    def remove(self, i):
+        self.alive[i] = False
+        self.n_alive -= 1
+
+    def pop_first(self):
+        while not self.alive[self.head]:
+            self.head += 1
+        self.remove(self.head)
+        return self.items[self.head]
+
+    def forward(self):
+        """
+        残っているitemの添字を上から順に返す．
+        """
+        for i in range(self.head, len(self.items)):
+            if self.alive[i]:
+                yield i
+
+    def backward(self, min_top=-math.inf):
+        """
+        上端がmin_top以上の残っているitemの添字を下から順に返す．
+        """
+        end = bisect_right(self.neg_tops, -min_top)
+        for i in range(end - 1, self.head - 1, -1):
+            if self.alive[i]:
+                yield i
+
+
+class ItemIndex:
+    """
+    itemをy方向の帯に登録して，bboxと衝突しうるitemだけを取り出す索引．
+    衝突しうるitemのbboxだけをBBoxTableでまとめて判定し，取り出したitemは登録時の順位の順に並べる．
+    """
+    # 帯の高さ(pt)
+    band_height = 16.
+
+    def __init__(self):
+        self.table = BBoxTable()
+        self.items = []
+        self.ranks = []
+        self.item_ranks = {}
+        self.bands = {}
+
+    def _bands(self, bbox):
+        # 帯の境界で丸め誤差により接触を見落とさないよう，前後の帯も含める
+        return range(math.floor(bbox.bottom / self.band_height) - 1, math.floor(bbox.top / self.band_height) + 2)
+
+    def add(self, item, rank):
+        row = self.table.append(item.bbox, item.type, item.address)
+        self.items.append(item)
+        self.ranks.append(rank)
+        self.item_ranks[item] = rank
+        for band in self._bands(item.bbox):
+            self.bands.setdefault(band, []).append(row)
+
+    def rank(self, item):
+        return self.item_ranks[item]
+
+    def candidate_rows(self, bbox):
+        """
+        bboxと同じ帯に登録された行．衝突するitemの行はすべて含まれる．
         """
-        result = "".join([item.text for item in self])
-        patt = '([^(.|\n)])- ([^\n])'
-        result = re.sub(patt, r'\1\2', result)
-        patt = '([^(.|\n)])-\n([^\n])'
-        result = re.sub(patt, r'\1\2', result)
-        # patt = '\.\n'
-        # result = re.sub(patt, r'.\n\n', result)
-        patt = '([^(.|\n)])\n([^\n])'
-        result = re.sub(patt, r'\1 \2', result)
-        result = re.sub("([^\\.])\n", r"\1 ", result)
-        return result + "\n"
+        rows = set()
+        for band in self._bands(bbox):
+            rows.update(self.bands.get(band, ()))
+        return np.fromiter(sorted(rows), dtype=np.int64, count=len(rows))
+
+    def collided(self, bbox):
+        rows = self.candidate_rows(bbox)
+        rows = rows[self.table.collided(bbox, rows)].tolist()
+        return [self.items[row] for row in sorted(rows, key=self.ranks.__getitem__)]
+
+
+class CoverageProfile:
+    """
+    itemの面積をx方向に射影したプロファイル．
+    itemの左端と右端を並べた累積和から，x=mを含むitemの面積の和を二分探索で求める．
+    面積は2のべきを分母とする整数に直して足し合わせるので，和の比較に丸め誤差が入らない．
+    """
+    def __init__(self, table):
+        areas = np.abs(table.right - table.left) * np.abs(table.top - table.bottom)
+        self.denominator = max((area.as_integer_ratio()[1] for area in areas.tolist()), default=1)
+        by_left = np.argsort(table.left, kind='stable')
+        by_right = np.argsort(table.right, kind='stable')
+        self.lefts = table.left[by_left].tolist()
+        self.rights = table.right[by_right].tolist()
+        self.left_sums = self._prefix_sums(self._scaled(area) for area in areas[by_left].tolist())
+        self.right_sums = self._prefix_sums(self._scaled(area) for area in areas[by_right].tolist())
+        self.edges = sorted(self.lefts + self.rights)
+        self.centers = np.sort((table.left + table.right) / 2.).tolist()
+
+    def _scaled(self, area):
+        numerator, denominator = area.as_integer_ratio()
+        return numerator * (self.denominator // denominator)
+
+    @staticmethod
+    def _prefix_sums(values):
+        sums = [0]
+        for value in values:
+            sums.append(sums[-1] + value)
+        return sums
+
+    def hit_area(self, x):
+        """
+        left <= x <= right となるitemの面積の和（を定数倍した整数）
+        """
+        return self.left_sums[bisect_right(self.lefts, x)] - self.right_sums[bisect_left(self.rights, x)]
+
+    def edges_between(self, x_min, x_max):
+        """
+        x_min < x < x_max にあるitemの端の座標を昇順に返す
+        """
+        return self.edges[bisect_right(self.edges, x_min):bisect_left(self.edges, x_max)]
+
+    def n_centers_between(self, x_min, x_max):
+        return bisect_left(self.centers, x_max) - bisect_right(self.centers, x_min)
+
+
+class ItemFeatures:
+    """
+    ページの認識に使うitemの特徴量．テキストから一度だけ計算して，同じitemの判定で使い回す．
+    段との位置関係による中央揃えの判定結果は，段のアドレスごとにcenteredに記録する．
+    """
+    __slots__ = ('empty', 'n_lines', 'has_short_line', 'n_long_lines', 'contain_math_char', 'is_section_header',
+                 'is_caption', 'centered')
+
+    # この文字数に満たない行を短い行とする
+    short_line_length = 16
+
+    def __init__(self, text, is_section_header, is_caption, contain_math_char):
+        lines = text.split('\n')
+        self.empty = not text
+        self.n_lines = len(lines)
+        self.has_short_line = any(len(line) < self.short_line_length for line in lines[:-1])
+        self.n_long_lines = sum(1 for line in lines if len(line) >= self.short_line_length)
+        self.contain_math_char = contain_math_char
+        self.is_section_header = is_section_header
+        self.is_caption = is_caption
+        self.centered = {}
 
 
 @has_global_id
@@ -277,8 +489,11 @@ class PaperPage:
     Paperのページ要素を表すクラス．
     """
     # TODO: 変数管理を改善する
-    image_dir = None
+    image_store = None
+    image_profile = ImageProfile.get(None)
     crop_dir = None
+    # 認識する段組みの最大数（PageAddressの段の数まで）
+    max_columns = 3
 
     def __init__(self, bbox, page_n):
         self.bbox = bbox
@@ -286,17 +501,28 @@ class PaperPage:
         self.page_n = page_n
 
         self.header_bbox = None
-        self.left_bbox = None
-        self.right_bbox = None
+        self.column_bboxes = []
         self.footer_bbox = None
         self.sorted_items = []
+        self._item_index = None
+        self._feature_table = None
 
         self.headers = []
         self.footers = []
         self.body_paragraphs = []
         self.captions = []
 
-        self.image = None
+        self.image_size = None
+        self.crops = {}
+        self.has_figure = False
+
+    @property
+    def left_bbox(self):
+        return self.column_bboxes[0]
+
+    @property
+    def right_bbox(self):
+        return self.column_bboxes[1]
 
     def add_item(self, item: PaperItem):
         self.items.append(item)
@@ -305,6 +531,8 @@ class PaperPage:
         """
         pdfminerから読み取られた描画オブジェクトを論文形式の文書として認識する
         """
+        # 図のないページの画像は出力時に階調を減らせる
+        self.has_figure = any(item.type == PaperItemType.Figure for item in self.items)
         # TODO: 移植の都合上の順序立てられていない前処理
         self._from_reader_preprocess(line_height)
         self._address_items()
@@ -315,6 +543,25 @@ class PaperPage:
         self._sort_items()
         self._arrange_paragraphs()
 
+    def drop_layout_tree(self):
+        """
+        認識後には不要となるpdfminerのレイアウトツリーへの参照を破棄する．
+        """
+        for item in self.items:
+            item.lt_items = []
+        for _, _, _, item in self.sorted_items:
+            item.lt_items = []
+
+    def make_lean(self):
+        """
+        認識後のページから，段落の整列とhtmlの出力に使わないものを破棄する．
+        段落などに含まれるitemのtext, bbox, type, address, separatedと切り抜きだけが残る．
+        """
+        self.drop_layout_tree()
+        self.items = []
+        self.sorted_items = []
+        self.crops = {}
+
     def _lt_item_is_invisible(self, lt_item: LTCurve):
         # 背景色が白だと仮定している
         fill = lt_item.fill and lt_item.non_stroking_color != (1, 1, 1)
@@ -345,81 +592,95 @@ class PaperPage:
         # entry: (address, -top, left, paper_item)
         self.sorted_items = sorted(self.sorted_items, key=lambda entry: entry[:-1])
 
-    def _detect_center_line(self):
+    def _find_gutter(self, profile, j, n_columns):
+        """
+        n_columns段組みのj本目の段間を，その付近で横切るitemの面積が最小となるx座標として探す
+        """
         page_bbox = self.bbox
-        default_center_x = 0.52 * page_bbox.left + 0.48 * page_bbox.right
-
-        x_values = []
-        for item in self.items:
-            x_values.append(item.bbox.left)
-            x_values.append(item.bbox.right)
-        x_min = 0.75 * page_bbox.left + 0.25 * page_bbox.right
-        x_max = 0.25 * page_bbox.left + 0.75 * page_bbox.right
-        x_values = sorted([x for x in x_values if x_min < x < x_max])
-
-        center_x = default_center_x
+        rate = j / n_columns
+        default_x = (1 - (rate - 0.02)) * page_bbox.left + (rate - 0.02) * page_bbox.right
+        window = 1 / (2 * n_columns)
+        x_min = (1 - (rate - window)) * page_bbox.left + (rate - window) * page_bbox.right
+        x_max = (1 - (rate + window)) * page_bbox.left + (rate + window) * page_bbox.right
+        x_values = profile.edges_between(x_min, x_max)
+
+        gutter_x = default_x
         min_hit_area = math.inf
         for left, right in zip(x_values[:-1], x_values[1:]):
             middle = (left + right) / 2.
-            hit_area = 0
-
-            for item in self.items:
-                if item.bbox.left <= middle <= item.bbox.right:
-                    hit_area += item.bbox.area
-
+            hit_area = profile.hit_area(middle)
             if hit_area < min_hit_area:
-                center_x = middle
+                gutter_x = middle
                 min_hit_area = hit_area
+        return gutter_x, min_hit_area
 
-        return center_x
+    def _detect_gutters(self, profile):
+        """
+        段間のx座標を左から順に返す．
+        3段組み以上は，どの段間も2段組みとみなしたときの段間より横切るitemが多くなく，
+        各段にitemがある場合にだけ採用する．
+        """
+        gutters = [self._find_gutter(profile, 1, 2)]
+        two_columns_hit_area = gutters[0][1]
+        page_bbox = self.bbox
+        for n_columns in range(3, min(self.max_columns, PageAddress.Column4 - PageAddress.Head) + 1):
+            candidate = [self._find_gutter(profile, j, n_columns) for j in range(1, n_columns)]
+            if any(hit_area > two_columns_hit_area or hit_area == math.inf for _, hit_area in candidate):
+                continue
+            edges = [page_bbox.left] + [x for x, _ in candidate] + [page_bbox.right]
+            min_width = page_bbox.width / (2 * n_columns)
+            if all(right - left >= min_width and profile.n_centers_between(left, right) > 0
+                   for left, right in zip(edges[:-1], edges[1:])):
+                gutters = candidate
+        return [x for x, _ in gutters]
 
     def _address_items(self):
-        # 2段組みだと仮定する
         page_bbox = self.bbox
-        center_x = self._detect_center_line()
-        left_side, right_side = (center_x, center_x)
+        table = BBoxTable.from_items(self.items)
+        gutters = self._detect_gutters(CoverageProfile(table))
+        left_side, right_side = (gutters[0], gutters[-1])
         bottom_side, top_side = (page_bbox.bottom, page_bbox.top)
-        # 上と下から順に(目を閉じるような順で)itemを見て，centerlineを超える上下のitemでheader,footer領域を決定する
-        eye_closing_ordered = sorted(
-            self.items, key=lambda item: min(item.bbox.bottom - page_bbox.bottom,
-                                             page_bbox.top - item.bbox.top))
-        for item in eye_closing_ordered:
+        # 上と下から順に(目を閉じるような順で)itemを見て，段間を超える上下のitemでheader,footer領域を決定する
+        eye_closing_order = np.argsort(np.minimum(table.bottom - page_bbox.bottom, page_bbox.top - table.top),
+                                       kind='stable')
+        for k in eye_closing_order.tolist():
+            item = self.items[k]
             if item.type == PaperItemType.VTextBox:
                 continue
             bbox = item.bbox
             left_side = min(left_side, bbox.left)
             right_side = max(right_side, bbox.right)
-            if bbox.left < center_x < bbox.right:
+            if any(bbox.left < gutter_x < bbox.right for gutter_x in gutters):
                 if abs(bbox.bottom - bottom_side) > abs(top_side - bbox.top):
                     top_side = min(top_side, bbox.bottom)
                 else:
                     bottom_side = max(bottom_side, bbox.top)
 
         self.header_bbox = BBox((left_side, top_side, right_side, page_bbox.top), orig='LB')
-        self.left_bbox = BBox((left_side, bottom_side + 1, center_x, top_side - 1), orig='LB')
-        self.right_bbox = BBox((center_x, bottom_side + 1, right_side, top_side - 1), orig='LB')
+        edges = [left_side] + gutters + [right_side]
+        self.column_bboxes = [BBox((left, bottom_side + 1, right, top_side - 1), orig='LB')
+                              for left, right in zip(edges[:-1], edges[1:])]
         self.footer_bbox = BBox((left_side, page_bbox.bottom, right_side, bottom_side), orig='LB')
 
-        for item in self.items:
-            bbox = item.bbox
-            if BBox.collided(bbox, self.header_bbox):
-                page_address = PageAddress.Head
-            elif BBox.collided(bbox, self.left_bbox):
-                page_address = PageAddress.Left
-            elif BBox.collided(bbox, self.right_bbox):
-                page_address = PageAddress.Right
-            elif BBox.collided(bbox, self.footer_bbox):
-                page_address = PageAddress.Foot
-            else:
-                page_address = PageAddress.Etc
-            item.address = page_address
-            self.sorted_items.append((page_address, -bbox.top, bbox.left, item))
+        column_addresses = PageAddress.columns(len(self.column_bboxes))
+        # 先に衝突した領域のアドレスを割り当てる
+        addresses = np.full(len(table), PageAddress.Etc.value)
+        unassigned = np.ones(len(table), dtype=bool)
+        regions = [(PageAddress.Head, self.header_bbox), *zip(column_addresses, self.column_bboxes),
+                   (PageAddress.Foot, self.footer_bbox)]
+        for address, region_bbox in regions:
+            hit = unassigned & table.collided(region_bbox)
+            addresses[hit] = address
+            unassigned &= ~hit
+        for item, address in zip(self.items, addresses.tolist()):
+            item.address = PageAddress(address)
+            self.sorted_items.append((item.address, -item.bbox.top, item.bbox.left, item))
         # 1段組みの場合
-        if len([item for addr, _, _, item in self.sorted_items
-                if addr == PageAddress.Left or addr == PageAddress.Right]) == 0:
+        if len([item for addr, _, _, item in self.sorted_items if addr in column_addresses]) == 0:
             self.header_bbox = BBox((left_side, page_bbox.top, right_side, page_bbox.top), orig='LB')
-            self.left_bbox = BBox((left_side, page_bbox.bottom + 1, right_side - 1, page_bbox.top - 1), orig='LB')
-            self.right_bbox = BBox((right_side, page_bbox.bottom + 1, right_side, page_bbox.top - 1), orig='LB')
+            self.column_bboxes = [
+                BBox((left_side, page_bbox.bottom + 1, right_side - 1, page_bbox.top - 1), orig='LB'),
+                BBox((right_side, page_bbox.bottom + 1, right_side, page_bbox.top - 1), orig='LB')]
             self.footer_bbox = BBox((left_side, page_bbox.bottom, right_side, page_bbox.bottom), orig='LB')
             for i in range(len(self.sorted_items)):
                 self.sorted_items[i][-1].address = PageAddress.Left
@@ -430,10 +691,8 @@ class PaperPage:
     def address_bbox(self, address):
         if address == PageAddress.Head:
             return self.header_bbox
-        if address == PageAddress.Left:
-            return self.left_bbox
-        if address == PageAddress.Right:
-            return self.right_bbox
+        if PageAddress.Left <= address < PageAddress.Left + len(self.column_bboxes):
+            return self.column_bboxes[address - PageAddress.Left]
         if address == PageAddress.Foot:
             return self.footer_bbox
         else:
@@ -441,42 +700,48 @@ class PaperPage:
 
     def _unify_items(self, line_margin):
         unified_items = []
-        while len(self.sorted_items) != 0:
-            addr, mb3, b0, item = self.sorted_items.pop(0)
-            overlaps = self._pop_overlaps(item, addr, line_margin)
-            unified = self._make_unified(overlaps)
-            unified.address = addr
-            unified_items.append((addr, -unified.bbox.top, unified.bbox.left, unified))
-            # for used_item in overlaps:
-            #     self.sorted_items.remove((addr, -used_item.bbox.top, used_item.bbox.left, used_item))
+        for addr, entries in groupby(self.sorted_items, key=lambda entry: entry[0]):
+            queue = ItemQueue([item for _, _, _, item in entries])
+            while queue:
+                item = queue.pop_first()
+                overlaps = self._pop_overlaps(queue, item, line_margin)
+                unified = self._make_unified(overlaps)
+                unified.address = addr
+                unified_items.append((addr, -unified.bbox.top, unified.bbox.left, unified))
         self.sorted_items = unified_items
 
-    def _pop_overlaps(self, item, address, line_margin):
+    # 上端の比較で丸め誤差を拾わないための余裕
+    _top_tolerance = 1e-6
+
+    def _pop_overlaps(self, queue, item, line_margin):
+        """
+        itemと重なる同じアドレスのitemをキューから取り除いて返す．
+        キューは上端の高い順に並んでおり，統合した矩形の下端は下がる一方なので，
+        line_marginが負でなければ，上端が統合した矩形の下端に届かないitemより後ろは調べなくてよい．
+        """
         unified_bbox = item.bbox
         overlaps = [item]
-        remove_ids = []
-        for i in range(len(self.sorted_items)):
-            other_addr, _, _, other = self.sorted_items[i]
-            if other_addr != address:
-                continue
-            if self._overlaps_collided(overlaps, unified_bbox, other, line_margin):
+        overlap_table = BBoxTable()
+        overlap_table.append(item.bbox, item.type)
+        scan_all = line_margin < 0
+        for i in queue.forward():
+            other = queue.items[i]
+            if not scan_all and other.bbox.top + line_margin < unified_bbox.bottom - self._top_tolerance:
+                break
+            if self._overlaps_collided(overlap_table, unified_bbox, other, line_margin):
                 overlaps.append(other)
+                overlap_table.append(other.bbox, other.type)
                 unified_bbox = unified_bbox.unify(other.bbox)
-                remove_ids.insert(0, i)
-        for i in remove_ids:
-            self.sorted_items.pop(i)
-
-        remove_ids = []
-        for i in range(len(self.sorted_items) - 1, -1, -1):
-            other_addr, _, _, other = self.sorted_items[i]
-            if other_addr != address or other in overlaps:
-                continue
-            if self._overlaps_collided(overlaps, unified_bbox, other, line_margin):
+                queue.remove(i)
+
+        min_top = -math.inf if scan_all else unified_bbox.bottom - line_margin - self._top_tolerance
+        for i in queue.backward(min_top):
+            other = queue.items[i]
+            if self._overlaps_collided(overlap_table, unified_bbox, other, line_margin):
                 overlaps.append(other)
+                overlap_table.append(other.bbox, other.type)
                 unified_bbox = unified_bbox.unify(other.bbox)
-                remove_ids.append(i)
-        for i in remove_ids:
-            self.sorted_items.pop(i)
+                queue.remove(i)
         return overlaps
 
     def _make_unified(self, overlaps):
@@ -511,7 +776,7 @@ class PaperPage:
         result.right = frame_bbox.right
         return result
 
-    def _overlaps_collided(self, overlaps, bbox, item, line_margin):
+    def _overlaps_collided(self, overlap_table, bbox, item, line_margin):
         # TODO: カラム外の縦書きテキストを構成から分離する
         if item.type == PaperItemType.VTextBox:
             return False
@@ -520,8 +785,8 @@ class PaperPage:
         if self._range_collided(bbox.bottom, bbox.top, item.bbox.bottom, item.bbox.top):
             return True
         # LTLineなどに対してはline_marginを使用しない．textbox間でのみ使用する
-        nearest_item = sorted(overlaps, key=lambda i: BBox.center_dist(i.bbox, item.bbox))[0]
-        return not self._is_split_type(nearest_item.type) and self._is_split_type(item.type)
+        nearest_type = PaperItemType(overlap_table.types[np.argmin(overlap_table.center_dist(item.bbox))])
+        return not self._is_split_type(nearest_type) and self._is_split_type(item.type)
 
     @staticmethod
     def _range_collided(a, b, c, d):
@@ -534,24 +799,27 @@ class PaperPage:
         return item_type in split_type
 
     def _recognize_items(self):
-        self.image = Image.open(pjoin(self.image_dir, sorted(os.listdir(self.image_dir))[self.page_n]))
+        self.image_size = self.image_store.size(self.page_n)
+        self._item_index = ItemIndex()
+        for rank, (_, _, _, item) in enumerate(self.sorted_items):
+            self._item_index.add(item, rank)
+        self._feature_table = {}
         items_count = len(self.sorted_items)
         i = 0
         while i < items_count:
             address, _, _, item = self.sorted_items[i]
-            filename = self._crop_image(item.bbox)
-            item.url = filename
+            item.crop = self._crop_image(item.bbox)
             if item.type == PaperItemType.TextBox:
-                if self._is_section_header(item.text):
+                features = self._features(item)
+                if features.is_section_header:
                     item.type = PaperItemType.SectionHeader
-                elif self._is_caption(item.text):
+                elif features.is_caption:
                     item.type = PaperItemType.Caption
                 elif self._is_separated_paragraph(item, address):
                     item.type = PaperItemType.SeparatedParagraph
                 # TODO: 数式のような中央揃えの行を検出して，すべての領域を_get_composed_bboxで発見しているが，もはや不要
-                elif self._is_centered(item.bbox, self.address_bbox(address), item.text):
-                    if any(not self._is_centered(item_.bbox, self.address_bbox(address), item_.text)
-                           for item_ in self._collided_items(item.bbox)):
+                elif self._is_centered_in(item, address):
+                    if any(not self._is_centered_in(item_, address) for item_ in self._collided_items(item.bbox)):
                         item.type = PaperItemType.Part_of_Object
                     else:
                         composed_bbox = self._get_composed_bbox(i, address, self.address_bbox(address))
@@ -560,8 +828,7 @@ class PaperPage:
                             i += 1
                             continue
                         new_item = PaperItem([], self.page_n, composed_bbox, " ", PaperItemType.Paragraph)
-                        filename = self._crop_image(new_item.bbox)
-                        new_item.url = filename
+                        new_item.crop = self._crop_image(new_item.bbox)
                         collapsed_texts = []
                         for item_ in self._collided_items(new_item.bbox):
                             item_.type = PaperItemType.Part_of_Object
@@ -569,34 +836,63 @@ class PaperPage:
                             new_item.lt_items.extend(item_.lt_items)
                         new_item.text = re.sub(r"\n", "", "".join(collapsed_texts)) + "\n"
                         new_item.address = address
+                        # 索引上でもsorted_itemsに挿入した位置に並ぶようにする
+                        rank = self._item_index.rank(item)
+                        prev_rank = self._item_index.rank(self.sorted_items[i - 1][-1]) if i > 0 else rank - 1
+                        self._item_index.add(new_item, (prev_rank + rank) / 2.)
                         self.sorted_items.insert(i, (address, -composed_bbox.top, composed_bbox.left, new_item))
                         items_count += 1
                 else:
                     item.type = PaperItemType.Paragraph
             i += 1
+        self._item_index = None
+        self._feature_table = None
 
     def _collided_items(self, bbox):
-        return (item for _, _, _, item in self.sorted_items if BBox.collided(item.bbox, bbox))
+        return self._item_index.collided(bbox)
+
+    def _features(self, item):
+        """
+        itemの特徴量．認識中は特徴表に記録して，同じitemについて再計算しない．
+        """
+        features = self._feature_table.get(item.idx)
+        if features is None:
+            text = item.text
+            features = ItemFeatures(text, self._is_section_header(text), self._is_caption(text),
+                                    bool(self._contain_math_char(text)))
+            self._feature_table[item.idx] = features
+        return features
+
+    def _is_centered_in(self, item, address):
+        """
+        addressの段に対してitemが中央に寄っているか．段ごとの判定も特徴表に記録する．
+        """
+        centered = self._features(item).centered
+        if address not in centered:
+            centered[address] = self._is_centered(item.bbox, self.address_bbox(address), self._features(item))
+        return centered[address]
 
     def _pt2pixel(self, x, y):
         """
         x, yの原点はpdfと同じLBであることを仮定
         """
         assert self.bbox.orig == 'LB'
-        xsize, ysize = self.image.size
+        xsize, ysize = self.image_size
         xrate = (x - self.bbox.left) / self.bbox.width
         yrate = (self.bbox.top - y) / self.bbox.height
         return int(xsize * xrate), int(ysize * yrate)
 
     def _crop_image(self, bbox):
+        """
+        bboxの領域の切り抜きを返す．同じ領域の切り抜きは共有される．
+        """
         assert bbox.orig == 'LB'
         cropbox = (*self._pt2pixel(bbox.left, bbox.top), *self._pt2pixel(bbox.right, bbox.bottom))
-        cropped = self.image.crop(cropbox)
-        filename = pjoin(self.crop_dir, "item_%d_%d_%d_%d_%d.png" % (self.page_n, bbox.left, bbox.bottom, bbox.right, bbox.top))
-        if cropped.width == 0 or cropped.height == 0:
-            cropped = Image.new('RGB', (1, 1), (0xdd, 0xdd, 0xdd))
-        cropped.save(filename)
-        return filename
+        filename = pjoin(self.crop_dir, "item_%d_%d_%d_%d_%d%s" % (self.page_n, bbox.left, bbox.bottom, bbox.right, bbox.top,
+                                                                   self.image_profile.extension))
+        if filename not in self.crops:
+            self.crops[filename] = CropImage(self.page_n, cropbox, filename, self.image_profile)
+        return self.crops[filename]
 
     def _is_one_line(self, text):
         return len(text.split('\n')) == 1
@@ -657,11 +953,12 @@ class PaperPage:
     def _contain_math_char(self, text):
         return re.search(r"[\(|\)|=|-|+]", text)
 
-    def _is_centered(self, bbox, address_bbox, text):
+    def _is_centered(self, bbox, address_bbox, features):
         """
         数式の文字断片を見つけるヒューリスティック判定
+        @param features: ItemFeatures itemのテキストの特徴量
         """
-        if not text:
+        if features.empty:
             return True
         width = address_bbox.right - address_bbox.left
         CENTER_RATE = 0.1
@@ -670,12 +967,11 @@ class PaperPage:
         CENTER_RATE = 0.35
         left_centered2 = (bbox.left - address_bbox.left > CENTER_RATE * width)
         right_centered2 = (address_bbox.right - bbox.right > CENTER_RATE * width)
-        has_short_line = any(len(line) < 16 for line in text.split('\n')[:-1])
         # 16文字以上の行が3行以上ある
-        has_long_lines = (sum(1 for line in text.split('\n') if len(line) >= 16) >= 3)
-        has_short_line = has_short_line and not has_long_lines
-        single_line = (len(text.split('\n')) <= 3)
-        contain_math_char = self._contain_math_char(text)
+        has_long_lines = features.n_long_lines >= 3
+        has_short_line = features.has_short_line and not has_long_lines
+        single_line = features.n_lines <= 3
+        contain_math_char = features.contain_math_char
         # word_rate = len(re.findall(r"[a-z|A-Z]", text)) / len(text)
         # if word_rate > 0.5:
         #     return False
@@ -697,10 +993,11 @@ class PaperPage:
             for item_addr, _, _, item in searching_items:
                 if item_addr != address:
                     break
-                is_other_type = any((self._is_section_header(item.text),
-                                     self._is_caption(item.text),
+                features = self._features(item)
+                is_other_type = any((features.is_section_header,
+                                     features.is_caption,
                                      self._is_separated_paragraph(item, item_addr)))
-                if is_other_type or not self._is_centered(item.bbox, address_bbox, item.text):
+                if is_other_type or not self._is_centered_in(item, item_addr):
                     if reverse:
                         bound = item.bbox.bottom - 1
                     else:
@@ -751,10 +1048,50 @@ class PaperPage:
 
     def _arrange_paragraphs(self):
         self._reap_paragraphs((PageAddress.Head,), self.headers)
-        self._reap_paragraphs((PageAddress.Left, PageAddress.Right), self.body_paragraphs)
+        self._reap_paragraphs(PageAddress.columns(len(self.column_bboxes)), self.body_paragraphs)
         self._reap_paragraphs((PageAddress.Foot,), self.footers)
 
 
+class ParagraphAssembler:
+    """
+    認識済みのページを順に受け取り，読む順に並べた段落のうち確定したものを返す．
+    前のページから本文が続いている場合は，直前に並べた段落にページ最初の本文の段落を結合する．
+    そのため，本文の続くページの最後の段落は，次のページを受け取るまで返さない．
+    """
+    def __init__(self):
+        self.body_separated = False
+        self.last_paragraph = None
+
+    def add_page(self, page):
+        """
+        @return: list of Paragraph 確定した段落のリスト
+        """
+        paragraphs = [] if self.last_paragraph is None else [self.last_paragraph]
+        # TODO: 小文字から始まる段落を前の段落に結合するべき？（現状は前段落のピリオドを手がかりにしている）
+        if self.body_separated and page.body_paragraphs:
+            paragraphs[-1].extend(page.body_paragraphs[0])
+
+        paragraphs.extend(page.headers)
+        paragraphs.extend(page.captions)
+
+        offset = 0 if not self.body_separated else 1
+        paragraphs.extend(page.body_paragraphs[offset:])
+        if page.body_paragraphs:
+            self.body_separated = page.body_paragraphs[-1][-1].separated
+
+        paragraphs.extend(page.footers)
+        self.last_paragraph = paragraphs.pop() if self.body_separated and paragraphs else None
+        return paragraphs
+
+    def finish(self):
+        """
+        @return: list of Paragraph 保留していた段落
+        """
+        paragraphs = [] if self.last_paragraph is None else [self.last_paragraph]
+        self.last_paragraph = None
+        return paragraphs
+
+
 class Paper:
     """
     PaperReaderの解析結果を表すクラス．
@@ -772,6 +1109,12 @@ class Paper:
 
     def add_page(self, page):
         page.recognize(self.line_height, self.line_margin)
+        self.add_recognized_page(page)
+
+    def add_recognized_page(self, page):
+        """
+        別プロセスなどで認識済みのページを追加する．ページは読む順に追加すること．
+        """
         self.pages.append(page)
         self._paragraphs = None
 
@@ -785,23 +1128,30 @@ class Paper:
             self._arrange_paragraphs()
         return self._paragraphs
 
+    def iter_paragraphs(self, pages):
+        """
+        認識済みのページを追加しながら，確定した段落を読む順に返す．
+        すべてのページを追加し終えると，paragraphsも同じ段落のリストになる．
+        """
+        assert not self.pages, "pages are already added"
+        assembler = ParagraphAssembler()
+        paragraphs = []
+        for page in pages:
+            self.add_recognized_page(page)
+            for paragraph in assembler.add_page(page):
+                paragraphs.append(paragraph)
+                yield paragraph
+        for paragraph in assembler.finish():
+            paragraphs.append(paragraph)
+            yield paragraph
+        self._paragraphs = paragraphs
+
     def _arrange_paragraphs(self):
+        assembler = ParagraphAssembler()
         self._paragraphs = []
-        body_separated = False
         for page in self.pages:
-            # TODO: 小文字から始まる段落を前の段落に結合するべき？（現状は前段落のピリオドを手がかりにしている）
-            if body_separated and page.body_paragraphs:
-                self._paragraphs[-1].extend(page.body_paragraphs[0])
-
-            self._paragraphs.extend(page.headers)
-            self._paragraphs.extend(page.captions)
-
-            offset = 0 if not body_separated else 1
-            self._paragraphs.extend(page.body_paragraphs[offset:])
-            if page.body_paragraphs:
-                body_separated = page.body_paragraphs[-1][-1].separated
-
-            self._paragraphs.extend(page.footers)
+            self._paragraphs.extend(assembler.add_page(page))
+        self._paragraphs.extend(assembler.finish())
 
     def _draw_rect(self, bbox, ax, ec_str="#000000"):
         import matplotlib.patches as patches
@@ -819,6 +1169,9 @@ class Paper:
         plt.figure()
         for page_n, page in enumerate(self.pages):
             ax = plt.axes()
+            page_bbox = page.bbox
+            ax.imshow(PaperPage.image_store.get(page_n),
+                      extent=(page_bbox.left, page_bbox.right, page_bbox.bottom, page_bbox.top))
             for item in page.items:
                 bbox = item.bbox
                 if item.type == PaperItemType.TextBox:
@@ -834,7 +1187,7 @@ class Paper:
                 else:
                     ec_str = "#FF0000"
                 self._draw_rect(bbox, ax, ec_str)
-            for bbox in (page.header_bbox, page.left_bbox, page.right_bbox, page.footer_bbox):
+            for bbox in (page.header_bbox, *page.column_bboxes, page.footer_bbox):
                 self._draw_rect(bbox, ax, "#0000FF")
             # for address, my, x, item in page.sorted_items:
             #     bbox = item.bbox
@@ -1,5 +1,7 @@
 import math
 import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, islice
 from pdfminer.converter import PDFPageAggregator
 from pdfminer.layout import LTPage, LTChar, LTAnno, LAParams, LTTextBox, LTTextLine, LTFigure, LTLine, LTCurve, \
     LTTextBoxHorizontal, LTTextBoxVertical, LTImage
@@ -10,23 +12,97 @@ from pdfminer.pdfinterp import PDFResourceManager, PDFPageInterpreter
 from pdfminer.layout import LAParams
 from paper2html.paper import Paper, PaperItemType, PaperItem, PaperPage, BBox
 from paper2html.html_paper import HtmlPaper
+from paper2html.page_image_store import PageImageStore
+from paper2html.image_profile import ImageProfile
 
 
-def read_by_extended_pdfminer(pdf_filename, line_margin_rate=None, verbose=False):
-    paper = PaperReader().read(pdf_filename, line_margin_rate)
+def read_by_extended_pdfminer(pdf_filename, line_margin_rate=None, verbose=False, workers=None, wait_for_image=None,
+                              image_profile=None, inline=True, asset_url=None, lean=False, progress=None,
+                              text_index_filename=None):
+    PaperPage.image_profile = ImageProfile.get(image_profile)
+    # レイアウトの表示には認識前のitemが必要
+    paper = PaperReader().read(pdf_filename, line_margin_rate, workers, wait_for_image, lean and not verbose, progress)
     if verbose:
         paper.show_layouts()
 
     _, pdf_name = os.path.split(pdf_filename)
     pdf_name, _ = os.path.splitext(pdf_name)
-    urls = HtmlPaper(paper, pdf_name).export()
+    urls = HtmlPaper(paper, pdf_name).export(inline, image_profile, asset_url, progress, text_index_filename)
     return urls
 
 
+def stream_by_extended_pdfminer(pdf_filename, line_margin_rate=None, workers=None, wait_for_image=None,
+                                image_profile=None, inline=True, asset_url=None, lean=True, text_index_filename=None):
+    """
+    read_by_extended_pdfminerと同じ1つのhtmlを，ページを認識するたびに書き出しながら断片で返す．
+    """
+    PaperPage.image_profile = ImageProfile.get(image_profile)
+    reader = PaperReader()
+    pages = reader.iter_pages(pdf_filename, line_margin_rate, workers, wait_for_image, lean)
+    paper = Paper(reader.line_height, reader.line_margin)
+
+    _, pdf_name = os.path.split(pdf_filename)
+    pdf_name, _ = os.path.splitext(pdf_name)
+    return HtmlPaper(paper, pdf_name).export_stream(pages, inline, image_profile, asset_url, text_index_filename)
+
+
+class PageStreamRecorder(PDFPageAggregator):
+    """
+    レイアウト解析前の描画オブジェクト(LTChar, LTCurve, LTImageなど)をページごとに記録するデバイス．
+    記録したページは，pdfを再度解釈することなく，異なるLAParamsで何度でもレイアウトできる．
+    """
+    def __init__(self, rsrcmgr, pageno=1):
+        super().__init__(rsrcmgr, pageno=pageno, laparams=None)
+
+    @staticmethod
+    def layout(recorded_page, laparams):
+        """
+        記録されたページからレイアウト解析済みのLTPageを新しく作る．記録されたページ自体は変更しない．
+        """
+        ltpage = LTPage(recorded_page.pageid, recorded_page.bbox, recorded_page.rotate)
+        ltpage.extend(recorded_page)
+        ltpage.analyze(laparams)
+        return ltpage
+
+
+def _iter_chars(items):
+    for item in items:
+        if isinstance(item, LTChar):
+            yield item
+        elif isinstance(item, LTFigure):
+            yield from _iter_chars(item)
+
+
+def probe_pdf(pdf_filename, probe_page=0, max_undecoded_rate=0.1):
+    """
+    pdfを修復せずにpdfminerで読めるかを，1ページだけ解釈して調べる．
+    ページを解釈できないか，文字コードを文字に戻せない文字((cid:n)など)の割合がmax_undecoded_rateを超えると読めないとする．
+    @return: 読めない理由．読めればNone．
+    """
+    try:
+        with open(pdf_filename, 'rb') as fp:
+            doc = PDFDocument(PDFParser(fp))
+            pages = list(islice(PDFPage.create_pages(doc), probe_page + 1))
+            if not pages:
+                return "no page"
+            rsrcmgr = PDFResourceManager()
+            device = PageStreamRecorder(rsrcmgr)
+            PDFPageInterpreter(rsrcmgr, device).process_page(pages[-1])
+            texts = [char.get_text() for char in _iter_chars(device.get_result())]
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+    n_undecoded = sum(1 for text in texts if text.startswith('(cid:') or '\ufffd' in text)
+    if texts and n_undecoded > max_undecoded_rate * len(texts):
+        return f"{n_undecoded} of {len(texts)} characters are not decoded"
+    return None
+
+
 class PaperReader:
     """
     pdfminerを使用してpdfファイルからPaperオブジェクトを作成するクラス．
     """
+    zap_max = 2
+
     def __init__(self):
         self.laparams = LAParams()
 
@@ -39,43 +115,134 @@ class PaperReader:
             for page in PDFPage.create_pages(doc):
                 yield page
 
-    def _lt_pages(self, pdf_filename):
+    def _recorded_pages(self, pdf_filename):
+        """
+        各ページの内容を一度だけ解釈し，レイアウト解析前の状態で返す．
+        """
         rsrcmgr = PDFResourceManager()
-        device = PDFPageAggregator(rsrcmgr, laparams=self.laparams)
+        device = PageStreamRecorder(rsrcmgr)
         interpreter = PDFPageInterpreter(rsrcmgr, device)
 
         for page in self._pdf_pages(pdf_filename):
             interpreter.process_page(page)
             yield device.get_result()
 
-    def read(self, pdf_filename, line_margin_rate=None):
+    def read(self, pdf_filename, line_margin_rate=None, workers=None, wait_for_image=None, lean=False, progress=None):
+        """
+        pdfファイルを読み込んでPaperを作成する．progress以外の引数はiter_pagesと同じ．
+        @param progress:
+            ページを認識するたびに progress('recognize', 認識したページ数, 全ページ数) として呼ばれる関数．
+        """
+        pages = self.iter_pages(pdf_filename, line_margin_rate, workers, wait_for_image, lean)
+        n_pages = self.count_pages(pdf_filename) if progress else None
+        paper = Paper(self.line_height, self.line_margin)
+        for page in pages:
+            paper.add_recognized_page(page)
+            if progress:
+                progress('recognize', len(paper.pages), n_pages)
+        return paper
+
+    def count_pages(self, pdf_filename):
+        """
+        ページの内容は解釈せずに，ページ数だけを数える．
+        """
+        return sum(1 for _ in self._pdf_pages(pdf_filename))
+
+    def iter_pages(self, pdf_filename, line_margin_rate=None, workers=None, wait_for_image=None, lean=False):
+        """
+        pdfファイルを読み込み，認識したページを先頭から順に返すイテレータを作る．
+        行の高さと行間の推定(line_height, line_margin)はこのメソッドから戻る前に終わっている．
+        @param workers:
+            2以上を指定すると，ページの解釈から認識までをプロセスプールで並列に行う．
+        @param wait_for_image:
+            ページ番号を受け取り，そのページの画像が用意されるまで待つ関数．
+            画像の生成と並行して読み込む場合に，各ページの認識の直前に呼ばれる．
+        @param lean:
+            Trueなら，認識の終わったページからpdfminerのレイアウトツリーと段落にならないitemを破棄する．
+            メモリ上に残るレイアウトツリーは解析中の1ページ分になるが，show_layoutsは使えなくなる．
+        """
         # laparams.line_margin = 0.3
         self.laparams.boxes_flow = 1.0  # 1.0: vertical order, -1.0: horizontal order
         # self.laparams.detect_vertical = True
         # laparams.all_texts = True
-        self._zap(pdf_filename)
+        recorded_pages = self._recorded_pages(pdf_filename)
+        # 先頭ページの記録は_zapと本解析の両方で使い回す
+        zap_pages = list(islice(recorded_pages, self.zap_max + 1))
+        self._zap(zap_pages)
         if line_margin_rate:
             self.laparams.line_margin = line_margin_rate
 
-        paper = Paper(self.line_height, self.line_margin)
+        if workers and workers > 1:
+            recorded_pages.close()
+            return self._iter_pages_in_parallel(pdf_filename, zap_pages, workers, wait_for_image, lean)
+        return self._iter_pages(chain(self._drain(zap_pages), recorded_pages), wait_for_image, lean)
 
-        for page_number, ltpage in enumerate(self._lt_pages(pdf_filename)):
-            page = PaperPage(BBox(ltpage.bbox, orig='LB'), page_number)
-            for item in ltpage:
-                self._render_item(page, item, page_number)
-            paper.add_page(page)
-        return paper
+    def _iter_pages(self, recorded_pages, wait_for_image=None, lean=False):
+        for page_number, recorded_page in enumerate(recorded_pages):
+            page = self._make_page(recorded_page, page_number)
+            if wait_for_image:
+                wait_for_image(page_number)
+            page.recognize(self.line_height, self.line_margin)
+            if lean:
+                page.make_lean()
+            yield page
 
-    def _zap(self, pdf_filename):
+    @staticmethod
+    def _drain(pages):
+        """
+        リストの先頭から取り除きながら返す．返したページへの参照はリストに残らない．
         """
-        先頭2ページを調べ，行の高さと行間の最頻値からpdfminer.Lparams.line_margin = 行間/行の高さ を設定します．
+        while pages:
+            yield pages.pop(0)
+
+    def _iter_pages_in_parallel(self, pdf_filename, zap_pages, workers, wait_for_image=None, lean=False):
+        n_pages = self.count_pages(pdf_filename)
+        initargs = (pdf_filename, self.laparams, self.line_height, self.line_margin,
+                    PaperPage.image_store.image_dir, PaperPage.crop_dir, PaperPage.image_profile, lean)
+        with ProcessPoolExecutor(workers, initializer=_init_page_worker, initargs=initargs) as executor:
+            futures = []
+            try:
+                if not wait_for_image:
+                    futures = [executor.submit(_recognize_page_in_worker, page_number)
+                               for page_number in range(len(zap_pages), n_pages)]
+                # 記録済みの先頭ページはワーカーの処理と並行して手元で認識する
+                n_zap_pages = len(zap_pages)
+                for page_number, recorded_page in enumerate(self._drain(zap_pages)):
+                    page = self._make_page(recorded_page, page_number)
+                    if wait_for_image:
+                        wait_for_image(page_number)
+                    page.recognize(self.line_height, self.line_margin)
+                    if lean:
+                        page.make_lean()
+                    else:
+                        page.drop_layout_tree()
+                    yield page
+                # 画像の生成を待つ場合は，画像が用意できたページから順にワーカーへ渡す
+                for page_number in range(n_zap_pages + len(futures), n_pages):
+                    wait_for_image(page_number)
+                    futures.append(executor.submit(_recognize_page_in_worker, page_number))
+                for future in futures:
+                    yield future.result()
+            finally:
+                # 途中で読むのをやめた場合に，残りのページを認識しない
+                for future in futures:
+                    future.cancel()
+
+    def _make_page(self, recorded_page, page_number):
+        ltpage = PageStreamRecorder.layout(recorded_page, self.laparams)
+        page = PaperPage(BBox(ltpage.bbox, orig='LB'), page_number)
+        for item in ltpage:
+            self._render_item(page, item, page_number)
+        return page
+
+    def _zap(self, recorded_pages):
+        """
+        先頭のページを調べ，行の高さと行間の最頻値からpdfminer.Lparams.line_margin = 行間/行の高さ を設定します．
         """
         line_margin_counts = {}
         line_height_counts = {}
-        zap_max = 2
-        for page_number, ltpage in enumerate(self._lt_pages(pdf_filename)):
-            if page_number > zap_max:
-                break
+        for recorded_page in recorded_pages:
+            ltpage = PageStreamRecorder.layout(recorded_page, self.laparams)
             self._count_line_properties(ltpage, line_margin_counts, line_height_counts)
 
         self.line_height = 10
@@ -192,3 +359,45 @@ class PaperReader:
                     continue
                 self._render_item(page, child, page_number)
         page.add_item(PaperItem([item], page_number, BBox(item.bbox, orig='LB'), text, item_type, False))
+
+
+class _PageWorker:
+    """
+    プロセスプールの各ワーカーで，割り当てられたページの解釈から認識・切り抜きまでを行う．
+    """
+    instance = None
+
+    def __init__(self, pdf_filename, laparams, line_height, line_margin, lean=False):
+        self.reader = PaperReader()
+        self.reader.laparams = laparams
+        self.line_height = line_height
+        self.line_margin = line_margin
+        self.lean = lean
+        self.fp = open(pdf_filename, 'rb')
+        self.pdf_pages = list(PDFPage.create_pages(PDFDocument(PDFParser(self.fp))))
+        rsrcmgr = PDFResourceManager()
+        self.device = PageStreamRecorder(rsrcmgr)
+        self.interpreter = PDFPageInterpreter(rsrcmgr, self.device)
+
+    def recognize(self, page_number):
+        self.interpreter.process_page(self.pdf_pages[page_number])
+        page = self.reader._make_page(self.device.get_result(), page_number)
+        page.recognize(self.line_height, self.line_margin)
+        # 親プロセスへはレイアウトツリーを除いた認識結果だけを返す
+        if self.lean:
+            page.make_lean()
+        else:
+            page.drop_layout_tree()
+        return page
+
+
+def _init_page_worker(pdf_filename, laparams, line_height, line_margin, image_dir, crop_dir, image_profile,
+                      lean=False):
+    PaperPage.image_store = PageImageStore(image_dir)
+    PaperPage.crop_dir = crop_dir
+    PaperPage.image_profile = image_profile
+    _PageWorker.instance = _PageWorker(pdf_filename, laparams, line_height, line_margin, lean)
+
+
+def _recognize_page_in_worker(page_number):
+    return _PageWorker.instance.recognize(page_number)
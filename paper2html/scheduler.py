@@ -0,0 +1,198 @@
+import multiprocessing
+import queue
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+
+
+_END_OF_STREAM = None
+
+
+def _stream_to_queue(chunk_queue, generator_function, args, kwargs):
+    generator = generator_function(*args, **kwargs)
+    try:
+        while True:
+            try:
+                chunk = next(generator)
+            except StopIteration as stop:
+                return stop.value
+            chunk_queue.put(chunk)
+    finally:
+        chunk_queue.put(_END_OF_STREAM)
+
+
+class _QueueProgress:
+    """
+    Progress hook in a worker process, sending the reports to the process waiting for the work.
+    """
+    def __init__(self, report_queue):
+        self.report_queue = report_queue
+
+    def __call__(self, stage, done, total):
+        self.report_queue.put((stage, done, total))
+
+
+def _run_with_progress(report_queue, fn, args, kwargs):
+    try:
+        return fn(*args, progress=_QueueProgress(report_queue), **kwargs)
+    finally:
+        report_queue.put(_END_OF_STREAM)
+
+
+class ConversionScheduler:
+    """
+    Runs conversions in a fixed-size pool of worker processes.
+    Work beyond the pool size waits in the queue of the pool, and concurrent requests for the same key
+    wait on the future of the request in flight instead of repeating the work.
+    @param workers:
+        Number of worker processes. If 0, conversions run on the calling thread, still coalesced by key.
+    """
+    poll_interval = 1.0
+
+    def __init__(self, workers=2):
+        self.workers = workers
+        self._executor = ProcessPoolExecutor(workers) if workers else None
+        self._manager = None
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def lead(self, key):
+        """
+        Start a flight for the key unless one is in flight.
+        @return: (future, leading). If leading, the caller does the work and must set the result or the exception
+            of the future. Otherwise the future of the flight is returned to be waited on.
+        """
+        with self._lock:
+            future = self._flights.get(key)
+            if future is not None:
+                return future, False
+            future = Future()
+            future.set_running_or_notify_cancel()
+            self._flights[key] = future
+        future.add_done_callback(lambda f: self._land(key, f))
+        return future, True
+
+    def _land(self, key, future):
+        with self._lock:
+            if self._flights.get(key) is future:
+                del self._flights[key]
+
+    def run_once(self, key, fn, *args, **kwargs):
+        """
+        Call fn on this thread, or wait for the result of the call in flight with the same key.
+        """
+        future, leading = self.lead(key)
+        if not leading:
+            return future.result()
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        future.set_result(result)
+        return result
+
+    def stream_once(self, key, generator_function, *args, **kwargs):
+        """
+        Like run_once, for a generator function returning its result.
+        Only the caller leading the flight gets the items, the others just wait for the result.
+        If the leader closes this generator early, the generator is run to the end on a background thread
+        for the others, and the thread of the leader returns at once.
+        @return: (result, leading) as the value of yield from.
+        """
+        future, leading = self.lead(key)
+        if not leading:
+            return future.result(), False
+        generator = generator_function(*args, **kwargs)
+        try:
+            while True:
+                try:
+                    value = next(generator)
+                except StopIteration as stop:
+                    value = stop.value
+                    break
+                try:
+                    yield value
+                except GeneratorExit:
+                    threading.Thread(target=self._finish_flight, args=(future, generator), daemon=True).start()
+                    raise
+        except GeneratorExit:
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        future.set_result(value)
+        return value, True
+
+    @staticmethod
+    def _finish_flight(future, generator):
+        """
+        Run the generator of a flight to the end, and set its return value or its exception to the future.
+        """
+        try:
+            while True:
+                next(generator)
+        except StopIteration as stop:
+            future.set_result(stop.value)
+        except BaseException as e:
+            future.set_exception(e)
+
+    def run(self, fn, *args, progress=None, **kwargs):
+        """
+        Call fn in a worker process and wait for the result. fn and the arguments must be picklable.
+        @param progress:
+            Optional hook passed to fn as the keyword argument progress.
+            The calls in the worker process are relayed to it on this thread.
+        """
+        if self._executor is None:
+            if progress is not None:
+                kwargs['progress'] = progress
+            return fn(*args, **kwargs)
+        if progress is None:
+            return self._executor.submit(fn, *args, **kwargs).result()
+        report_queue = self._get_manager().Queue()
+        future = self._executor.submit(_run_with_progress, report_queue, fn, args, kwargs)
+        for report in self._relay(report_queue, future):
+            progress(*report)
+        return future.result()
+
+    def stream(self, generator_function, *args, **kwargs):
+        """
+        Iterate a generator in a worker process, yielding its items on this thread.
+        Closing this generator does not stop the work in the worker process.
+        @return: the value returned by the generator, as the value of yield from.
+        """
+        if self._executor is None:
+            return (yield from generator_function(*args, **kwargs))
+        chunk_queue = self._get_manager().Queue()
+        future = self._executor.submit(_stream_to_queue, chunk_queue, generator_function, args, kwargs)
+        yield from self._relay(chunk_queue, future)
+        # raises the exception of the generator, if any
+        return future.result()
+
+    def _relay(self, item_queue, future):
+        """
+        Yield the items put by the work of the future until it ends the queue.
+        """
+        while True:
+            try:
+                item = item_queue.get(timeout=self.poll_interval)
+            except queue.Empty:
+                if future.done() and future.exception() is not None:
+                    # e.g. the worker process died before ending the queue
+                    raise future.exception()
+                continue
+            if item is _END_OF_STREAM:
+                return
+            yield item
+
+    def _get_manager(self):
+        with self._lock:
+            if self._manager is None:
+                self._manager = multiprocessing.Manager()
+            return self._manager
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+        if self._manager is not None:
+            self._manager.shutdown()
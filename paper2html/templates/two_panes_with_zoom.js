@@ -17,7 +17,7 @@ fit_canvas();
 // 直接ファイルリストをスクリプトに埋め込む
 const img_pathes = ####;
 
-let paper_imgs = {};
+let paper_imgs = [];
 let loaded_img_count = 0;
 
 function on_img_loaded(){
@@ -38,6 +38,42 @@ for(i = 0; i < img_pathes.length; i++){
 //  }
 }
 
+// 埋め込まれていないページ画像は，そのページの段落が表示に近づいたときに前後のページと一緒に読み込む
+const PREFETCH_PAGES = 1;
+
+function is_page_loaded(page_idx){
+  const img = paper_imgs[page_idx];
+  return img && img.complete && img.naturalWidth > 0;
+}
+
+function request_page(page_idx){
+  const img = paper_imgs[page_idx];
+  if(!img || img.getAttribute('src') || !img.dataset.src){
+    return;
+  }
+  img.onload = function(){
+    onscrollR();
+  };
+  img.src = img.dataset.src;
+}
+
+function request_pages_near_view(){
+  const margin = split.clientHeight;
+  for(let i = 0; i < rightw.children.length; i++) {
+    const rect = rightw.children[i].getBoundingClientRect();
+    if (rect.bottom < -margin) {
+      continue;
+    }
+    if (rect.top > window.innerHeight + margin) {
+      break;
+    }
+    const page_idx = get_address(rightw.children[i])[0][0];
+    for(let j = page_idx - PREFETCH_PAGES; j <= page_idx + PREFETCH_PAGES; j++){
+      request_page(j);
+    }
+  }
+}
+
 function parse_address(str_addr) {
   return str_addr.split('|').map(each_addr => {
     const num_strs = each_addr.split(',');
@@ -105,14 +141,17 @@ function draw_paper(c, trsf, page_idx){
   c.save();
   c.scale(trsf[0], trsf[0]);
   // drawImage(, dx, dy);
-  c.drawImage(paper_img, paper_img.width, paper_img.height);
-  if(page_idx != 0){
+  // 縮小された画像も元のページの大きさで描く．読み込み中のページは読み込み後に描き直される
+  if(is_page_loaded(page_idx)){
+    c.drawImage(paper_img, paper_img.width, paper_img.height, paper_img.width, paper_img.height);
+  }
+  if(page_idx != 0 && is_page_loaded(page_idx-1)){
     const prev_page = paper_imgs[page_idx-1];
-    c.drawImage(prev_page, paper_img.width, paper_img.height - prev_page.height);
+    c.drawImage(prev_page, paper_img.width, paper_img.height - prev_page.height, prev_page.width, prev_page.height);
   }
-  if(page_idx != paper_imgs.length-1){
+  if(page_idx != paper_imgs.length-1 && is_page_loaded(page_idx+1)){
     const next_page = paper_imgs[page_idx+1];
-    c.drawImage(next_page, paper_img.width, paper_img.height + next_page.height);
+    c.drawImage(next_page, paper_img.width, paper_img.height + next_page.height, next_page.width, next_page.height);
   }
   c.restore();
 
@@ -130,6 +169,7 @@ function draw_paper(c, trsf, page_idx){
 
 function onscrollR() {
   fit_canvas();
+  request_pages_near_view();
   let c = canvas.getContext('2d');
   const top_ = split.scrollTop;
   const bottom_ = top_ + split.clientHeight;
@@ -0,0 +1,59 @@
+KEEP_HYPHEN_PREFIXES = frozenset([
+    'all', 'coarse', 'cross', 'data', 'end', 'few', 'fine', 'first', 'full', 'half', 'high', 'higher', 'ill',
+    'large', 'left', 'long', 'low', 'lower', 'model', 'non', 'one', 'pseudo', 'quasi', 'real', 'right',
+    'second', 'self', 'semi', 'short', 'small', 'so', 'state', 'task', 'third', 'three', 'time', 'top', 'two',
+    'well', 'zero',
+])
+
+
+class TextNormalizer:
+    """
+    Joins the lines of the text of a paragraph into one line, removing the hyphens that break words at the line ends.
+    A hyphen at a line end is kept when it is a part of the word:
+    the word is already hyphenated ("state-of-the-"), the hyphen follows a prefix in keep_hyphen_prefixes
+    ("self-"), it does not follow a letter ("1-"), or the next line does not start with a lower case letter ("-Net").
+    A line ending with a period keeps its line break, as the regular expressions this replaces did.
+    @param keep_hyphen_prefixes:
+        Lower case words which keep the hyphen following them at a line end.
+    """
+    def __init__(self, keep_hyphen_prefixes=KEEP_HYPHEN_PREFIXES):
+        self.keep_hyphen_prefixes = frozenset(keep_hyphen_prefixes)
+
+    def _keeps_hyphen(self, line, next_line):
+        """
+        @param line:
+            A line ending with a hyphen.
+        """
+        if not next_line[:1].islower():
+            return True
+        word_end = len(line) - 1
+        if word_end == 0 or not line[word_end - 1].isalpha():
+            return True
+        word_start = word_end
+        while word_start > 0 and line[word_start - 1].isalpha():
+            word_start -= 1
+        if word_start > 0 and line[word_start - 1] == '-':
+            return True
+        return line[word_start:word_end].lower() in self.keep_hyphen_prefixes
+
+    def normalize(self, texts):
+        """
+        @param texts:
+            Texts of the items of a paragraph, each line ending with a line break.
+        @return: the joined text, ending with a line break.
+        """
+        lines = [line.rstrip(' ') for line in "".join(texts).split('\n')]
+        # the texts end with a line break
+        if lines and lines[-1] == '':
+            lines.pop()
+        lines = [line for line in lines if line]
+        parts = []
+        for i, line in enumerate(lines):
+            next_line = lines[i + 1] if i + 1 < len(lines) else None
+            if next_line is not None and line.endswith('-'):
+                parts.append(line if self._keeps_hyphen(line, next_line) else line[:-1])
+            elif line.endswith('.'):
+                parts.append(line + '\n')
+            else:
+                parts.append(line + ' ')
+        return "".join(parts) + '\n'
@@ -0,0 +1,99 @@
+import logging
+import threading
+import time
+
+
+class DebouncedQueue:
+    """
+    Queue of paths handled by a pool of threads.
+    A path is handled once it has not been put again for `delay` seconds, so that the events of a file being written
+    are coalesced into one. A path put again while it is handled is handled once more afterwards.
+    @param handler:
+        Function called with a path on one of the threads.
+    @param workers:
+        Number of threads.
+    @param delay:
+        Seconds to wait for the events of a path to settle.
+    """
+    def __init__(self, handler, workers=2, delay=2.0):
+        self.handler = handler
+        self.workers = workers
+        self.delay = delay
+        self._due = {}
+        self._handling = set()
+        self._condition = threading.Condition()
+        self._threads = []
+        self._stopped = False
+
+    def __len__(self):
+        with self._condition:
+            return len(self._due) + len(self._handling)
+
+    def start(self):
+        self._stopped = False
+        self._threads = [threading.Thread(target=self._work, daemon=True) for _ in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def put(self, path, delay=None):
+        """
+        @param delay:
+            Seconds to wait before handling the path instead of the default.
+        """
+        with self._condition:
+            self._due[path] = time.monotonic() + (self.delay if delay is None else delay)
+            self._condition.notify_all()
+
+    def _take(self):
+        """
+        Wait for a path that is due and not being handled.
+        @return: the path, or None if the queue is stopped.
+        """
+        with self._condition:
+            while not self._stopped:
+                now = time.monotonic()
+                waiting = [(due, path) for path, due in self._due.items() if path not in self._handling]
+                if waiting:
+                    due, path = min(waiting)
+                    if due <= now:
+                        del self._due[path]
+                        self._handling.add(path)
+                        return path
+                    self._condition.wait(due - now)
+                else:
+                    self._condition.wait()
+            return None
+
+    def _work(self):
+        while True:
+            path = self._take()
+            if path is None:
+                return
+            try:
+                self.handler(path)
+            except Exception:
+                logging.exception('failed to handle %s.', path)
+            finally:
+                with self._condition:
+                    self._handling.discard(path)
+                    self._condition.notify_all()
+
+    def join(self, timeout=None):
+        """
+        Block until all the paths put are handled.
+        @return: False on timeout.
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._due and not self._handling, timeout)
+
+    def stop(self):
+        """
+        Stop the threads after the paths being handled. The paths waiting are discarded.
+        """
+        with self._condition:
+            self._stopped = True
+            self._due.clear()
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
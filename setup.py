@@ -38,6 +38,7 @@ setup(
     install_requires=[
         'pdf2image',
         'pdfminer.six >= 20200726',
+        'numpy',
         'fire',
         'pillow',
         'Flask',
@@ -0,0 +1,51 @@
+import os
+import time
+from os.path import join as pjoin
+import pytest
+from PIL import Image
+from paper2html import local_paper_directory
+from paper2html.page_image_store import PageImageStore
+from paper2html.paper import Paper, PaperPage
+from paper2html.paper_miner import PaperReader
+
+
+@pytest.fixture
+def conversions(monkeypatch):
+    converted = []
+
+    def fake_paper2one_html(src_path, cache_dir, debug, line_margin_rate=None, image_profile='png', progress=None):
+        # 変換の代わりに出力ディレクトリとhtmlだけを作る
+        name, _ = os.path.splitext(os.path.basename(src_path))
+        os.makedirs(pjoin(cache_dir, name))
+        result_html = pjoin(cache_dir, name, name + '_0.html')
+        with open(src_path, 'rb') as f, open(result_html, 'wb') as html:
+            html.write(f.read())
+        converted.append(src_path)
+        time.sleep(0.1)
+        return result_html, 'original'
+
+    monkeypatch.setattr(local_paper_directory, 'paper2one_html', fake_paper2one_html)
+    return converted
+
+
+@pytest.fixture
+def page_images(tmp_path, monkeypatch):
+    """
+    ページ画像，切り抜き，出力先をtmp_pathに向ける．
+    @return: pdfのページ画像の代わりに白紙の画像をtmp_path/imagesに書く関数
+    """
+    image_dir = tmp_path / 'images'
+    image_dir.mkdir()
+    (tmp_path / 'resources').mkdir()
+    monkeypatch.setattr(PaperPage, 'image_store', PageImageStore(str(image_dir)))
+    monkeypatch.setattr(PaperPage, 'crop_dir', str(tmp_path))
+    monkeypatch.setattr(Paper, 'output_dir', str(tmp_path))
+
+    def write(pdf_filename):
+        # ページ画像の内容は認識に使われないので，大きさだけ合わせる
+        for page_n, page in enumerate(PaperReader._pdf_pages(pdf_filename)):
+            x0, y0, x1, y1 = page.mediabox
+            Image.new('RGB', (int(x1 - x0), int(y1 - y0)), 'white') \
+                .save(pjoin(str(image_dir), 'pdf-%02d.png' % (page_n + 1)))
+        return str(image_dir)
+    return write
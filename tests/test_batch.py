@@ -0,0 +1,108 @@
+import json
+import os
+import shutil
+import time
+import pdf2image
+import pytest
+from paper2html import commands
+from paper2html.paper import Paper
+
+
+@pytest.fixture
+def fake_pipeline(tmp_path, monkeypatch):
+    log_path = str(tmp_path / 'converted.log')
+
+    def fake_read(pdf_filename, *args, **kwargs):
+        # 変換の代わりにpdfの名前を記録してhtmlを1つ書く
+        name, _ = os.path.splitext(os.path.basename(pdf_filename))
+        if name == 'broken':
+            raise ValueError('broken pdf')
+        with open(log_path, 'a') as f:
+            f.write(name + '\n')
+        html_path = os.path.join(Paper.output_dir, name + '_0.html')
+        with open(html_path, 'w') as f:
+            f.write('<html></html>')
+        return [html_path]
+
+    monkeypatch.setattr(commands, 'clean_pdf', lambda pdf, fixed_dir: shutil.copy(pdf, fixed_dir))
+    monkeypatch.setattr(pdf2image, 'convert_from_path', lambda *args, **kwargs: [])
+    monkeypatch.setattr(commands, 'read_by_extended_pdfminer', fake_read)
+
+    def converted():
+        if not os.path.exists(log_path):
+            return []
+        with open(log_path) as f:
+            return sorted(f.read().split())
+    return converted
+
+
+def _write_pdf(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(content)
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_batch_is_resumed(tmp_path, fake_pipeline, jobs):
+    papers = tmp_path / 'papers'
+    _write_pdf(str(papers / 'a.pdf'), b'%PDF a')
+    _write_pdf(str(papers / 'sub' / 'b.pdf'), b'%PDF b')
+    _write_pdf(str(papers / 'broken.pdf'), b'%PDF broken')
+
+    urls = commands.paper2html(str(papers), jobs=jobs)
+    assert sorted(os.path.basename(url) for url in urls) == ['a_0.html', 'b_0.html']
+    assert fake_pipeline() == ['a', 'b']
+    with open(str(papers / 'paper2html_manifest.jsonl')) as f:
+        records = {record['pdf']: record for record in map(json.loads, f)}
+    assert records['broken.pdf']['status'] == 'failed' and 'broken pdf' in records['broken.pdf']['error']
+    assert records['a.pdf']['status'] == 'done' and records['a.pdf']['outputs'] == [os.path.join('a', 'a_0.html')]
+    # the fake pdfs cannot be read by pdfminer
+    assert records['a.pdf']['repair'] == 'pdftocairo'
+    # nothing is left of the failed pdf
+    assert sorted(os.listdir(str(papers))) == ['a', 'a.pdf', 'broken.pdf', 'paper2html_manifest.jsonl', 'sub']
+
+    # the failed pdf is converted again, and the pdfs in the output directories are not taken as new pdfs
+    _write_pdf(str(papers / 'killed' / 'temp' / 'fixed_pdf' / 'killed.pdf'), b'%PDF killed')
+    os.mkdir(str(papers / 'killed' / 'resources'))
+    commands.paper2html(str(papers), jobs=jobs)
+    assert fake_pipeline() == ['a', 'b']
+    assert sorted(os.listdir(str(papers))) == ['a', 'a.pdf', 'broken.pdf', 'killed', 'paper2html_manifest.jsonl',
+                                               'sub']
+    with open(str(papers / 'paper2html_manifest.jsonl')) as f:
+        assert {record['pdf'] for record in map(json.loads, f)} == {'a.pdf', 'broken.pdf', os.path.join('sub', 'b.pdf')}
+
+    # only the failed and the modified pdfs are converted again, into the same directories
+    _write_pdf(str(papers / 'sub' / 'b.pdf'), b'%PDF b revised')
+    urls = commands.paper2html(str(papers), jobs=jobs)
+    assert fake_pipeline() == ['a', 'b', 'b']
+    assert os.path.join(str(papers), 'sub', 'b', 'b_0.html') in urls
+    assert sorted(os.listdir(str(papers / 'sub'))) == ['b', 'b.pdf']
+    assert not os.path.exists(str(papers / 'sub' / 'b-0'))
+
+
+def test_batch_survives_a_dying_worker(tmp_path, fake_pipeline, monkeypatch):
+    fake_read = commands.read_by_extended_pdfminer
+
+    def read_or_die(pdf_filename, *args, **kwargs):
+        if os.path.basename(pdf_filename) == 'crash.pdf':
+            os._exit(1)
+        # 他のpdfはワーカーが死ぬときにまだ変換している
+        time.sleep(0.5)
+        return fake_read(pdf_filename, *args, **kwargs)
+
+    monkeypatch.setattr(commands, 'read_by_extended_pdfminer', read_or_die)
+    papers = tmp_path / 'papers'
+    for name in ('a', 'b', 'crash'):
+        _write_pdf(str(papers / (name + '.pdf')), b'%PDF ' + name.encode())
+
+    # 3つのpdfを同時に変換する
+    urls = commands.paper2html(str(papers), jobs=3)
+    assert sorted(os.path.basename(url) for url in urls) == ['a_0.html', 'b_0.html']
+    assert set(fake_pipeline()) == {'a', 'b'}
+    with open(str(papers / 'paper2html_manifest.jsonl')) as f:
+        records = {record['pdf']: record for record in map(json.loads, f)}
+    assert records['crash.pdf']['status'] == 'failed' and 'died' in records['crash.pdf']['error']
+    assert records['a.pdf']['status'] == records['b.pdf']['status'] == 'done'
+    # the retries convert into the directories of the broken conversions, which are removed
+    assert sorted(os.listdir(str(papers))) == ['a', 'a.pdf', 'b', 'b.pdf', 'crash.pdf', 'paper2html_manifest.jsonl']
+    assert sorted(os.listdir(str(papers / 'a'))) == ['a_0.html', 'resources']
@@ -0,0 +1,30 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+from run_benchmarks import compare, run_benchmarks  # noqa: E402
+from synthetic_pdf import make_pdf  # noqa: E402
+from paper2html.paper_miner import PaperReader  # noqa: E402
+
+
+@pytest.mark.parametrize("columns", [1, 2, 3])
+def test_synthetic_pdf_is_deterministic(tmp_path, columns):
+    paths = [make_pdf(str(tmp_path / f'{i}.pdf'), columns=columns, pages=2, equation_rate=0.3, figures_per_page=1)
+             for i in range(2)]
+    with open(paths[0], 'rb') as f0, open(paths[1], 'rb') as f1:
+        assert f0.read() == f1.read()
+    assert PaperReader().count_pages(paths[0]) == 2
+
+
+def test_benchmarks_measure_stages(tmp_path):
+    results = run_benchmarks(str(tmp_path), repeat=1, documents=['two_columns'])
+    stages = results['documents']['two_columns']['stages']
+    for stage in ('zap', 'read', 'recognize', 'export'):
+        assert stages[stage]['seconds'] > 0 and stages[stage]['peak_bytes'] > 0
+    assert compare(results, results) == []
+
+    slower = {'settings': results['settings'], 'documents': {'two_columns': {'stages': dict(
+        stages, read={'seconds': stages['read']['seconds'] + 1, 'peak_bytes': stages['read']['peak_bytes'] * 2})}}}
+    assert len(compare(slower, results)) == 2
+    assert compare(slower, dict(results, settings={'scale': 2, 'repeat': 1}))
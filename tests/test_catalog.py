@@ -0,0 +1,94 @@
+import os
+from paper2html.catalog import PaperCatalog, pdf_summary
+from paper2html.conversion_cache import ConversionCache
+from paper2html.convert_service import create_app
+from paper2html.local_paper_directory import LocalPaperDirectory
+
+
+def _sample_pdf(name):
+    test_dir, _ = os.path.split(__file__)
+    return os.path.join(test_dir, 'sample_files', name)
+
+
+def test_catalog_pages_and_sorts(tmp_path):
+    catalog = PaperCatalog(str(tmp_path))
+    for i, filename in enumerate(['b.pdf', 'c.pdf', 'a.pdf']):
+        catalog.add(f'key{i}', 'params', f'sha{i}', filename, filename, _sample_pdf('one_column.pdf'),
+                    f'{filename}_0.html', converted_at=i)
+    catalog.add('other', 'other params', 'sha', 'd.pdf', 'd.pdf', _sample_pdf('one_column.pdf'), 'd_0.html')
+
+    assert catalog.count('params') == 3
+    assert [paper['filename'] for paper in catalog.list('params')] == ['a.pdf', 'c.pdf', 'b.pdf']
+    assert [paper['filename'] for paper in catalog.list('params', 'filename', False, 1, 2)] == ['b.pdf', 'c.pdf']
+    paper = catalog.list('params', limit=1)[0]
+    assert paper['n_pages'] == pdf_summary(_sample_pdf('one_column.pdf'))[1]
+    assert paper['size'] == os.path.getsize(_sample_pdf('one_column.pdf'))
+    catalog.close()
+
+
+def test_catalog_searches_paragraphs(tmp_path):
+    catalog = PaperCatalog(str(tmp_path))
+    for key, filename in [('key0', 'a.pdf'), ('key1', 'b.pdf')]:
+        catalog.add(key, 'params', 'sha', filename, filename, _sample_pdf('one_column.pdf'), f'{filename}_0.html')
+    catalog.add('other', 'other params', 'sha', 'c.pdf', 'c.pdf', _sample_pdf('one_column.pdf'), 'c_0.html')
+    catalog.add_paragraphs('key0', [
+        {'id': 0, 'page': 0, 'address': 0, 'text': 'Generative adversarial networks are trained as a game.'},
+        {'id': 3, 'page': 1, 'address': 1, 'text': 'We compare the networks.'},
+    ])
+    catalog.add_paragraphs('key1', [
+        {'id': 1, 'page': 2, 'address': 0, 'text': 'Adversarial network training is a game. A game of networks.'},
+    ])
+    catalog.add_paragraphs('other', [{'id': 0, 'page': 0, 'address': 0, 'text': 'adversarial networks'}])
+
+    hits = catalog.search('params', 'adversarial "network')
+    assert [(hit['filename'], hit['paragraph'], hit['page']) for hit in hits] == [('b.pdf', 1, 2), ('a.pdf', 0, 0)]
+    assert f'{PaperCatalog.match_start}Adversarial{PaperCatalog.match_end}' in hits[0]['snippet']
+    assert len(catalog.search('params', 'networks', limit=2)) == 2
+    assert catalog.search('params', '') == [] and catalog.search('params', 'NEAR( OR') == []
+
+    # indexing a paper again replaces its paragraphs
+    catalog.add_paragraphs('key1', [{'id': 0, 'page': 0, 'address': 0, 'text': 'Nothing here.'}])
+    assert [hit['filename'] for hit in catalog.search('params', 'adversarial')] == ['a.pdf']
+    catalog.close()
+
+
+def test_index_is_served_from_catalog(tmp_path, conversions, monkeypatch):
+    monkeypatch.setattr(LocalPaperDirectory, 'index_page_size', 2)
+    paper_dir = LocalPaperDirectory(str(tmp_path / 'papers'), False, workers=0)
+    for name in ['b', 'a', 'c']:
+        paper_dir.prepare_html(_copy_pdf(tmp_path, name))
+    client = create_app(paper_dir).test_client()
+
+    first = client.get('/paper2html/index.html?sort=filename&order=asc').get_data(as_text=True)
+    assert '3 documents' in first and 'page 1 / 2' in first
+    assert first.index('>a.pdf<') < first.index('>b.pdf<') and '>c.pdf<' not in first
+    second = client.get('/paper2html/index.html?sort=filename&order=asc&page=2').get_data(as_text=True)
+    assert '>c.pdf<' in second and '>a.pdf<' not in second
+    assert client.get('/paper2html/index.html?sort=unknown').status_code == 400
+
+    # the catalog is filled from the conversion cache when it is missing
+    paper_dir.shutdown()
+    os.remove(str(tmp_path / 'papers' / PaperCatalog.filename))
+    assert len(LocalPaperDirectory(str(tmp_path / 'papers'), False, workers=0).catalog) == 3
+
+
+def _copy_pdf(tmp_path, name):
+    path = str(tmp_path / 'pdfs' / f'{name}.pdf')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(_sample_pdf('one_column.pdf'), 'rb') as src, open(path, 'wb') as dst:
+        dst.write(src.read() + name.encode())
+    return 'file://' + path
+
+
+def test_search_links_to_paragraphs(tmp_path, conversions):
+    paper_dir = LocalPaperDirectory(str(tmp_path / 'papers'), False, workers=0)
+    paper_dir.prepare_html(_copy_pdf(tmp_path, 'a'))
+    paper, = paper_dir.catalog.list(ConversionCache.params_key(paper_dir.conversion_params))
+    paper_dir.catalog.add_paragraphs(paper['key'], [{'id': 4, 'page': 0, 'address': 0, 'text': 'a <b>bold</b> claim'}])
+    client = create_app(paper_dir).test_client()
+
+    found = client.get('/paper2html/search?q=bold').get_data(as_text=True)
+    assert f'/paper2html/browse/{paper["keyed_filename"]}#txt4"' in found
+    assert '&lt;b&gt;<mark>bold</mark>&lt;/b&gt;' in found
+    assert '#txt4' not in client.get('/paper2html/search?q=timid').get_data(as_text=True)
+    paper_dir.shutdown()
@@ -0,0 +1,84 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from os.path import join as pjoin
+from paper2html.conversion_cache import ConversionCache, file_sha256
+from paper2html.local_paper_directory import LocalPaperDirectory
+
+
+def _write_pdf(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(content)
+    return 'file://' + path
+
+
+def test_same_pdf_from_other_url_is_converted_once(tmp_path, conversions):
+    paper_dir = LocalPaperDirectory(str(tmp_path / 'papers'), False, workers=0)
+    url0 = _write_pdf(str(tmp_path / 'arxiv' / 'paper.pdf'), b'%PDF same')
+    url1 = _write_pdf(str(tmp_path / 'mirror' / 'renamed.pdf'), b'%PDF same')
+
+    html0 = paper_dir.prepare_html(url0)
+    assert paper_dir.is_converted(url0) and not paper_dir.is_converted(url1)
+    assert paper_dir.prepare_html(url1) == html0
+    assert paper_dir.prepare_html(url0) == html0
+    assert len(conversions) == 1
+    (_, result), = paper_dir.cache.results()
+    assert result['repair'] == 'original'
+
+    # the cache is kept in the directory
+    assert LocalPaperDirectory(paper_dir.paper_dir, False, workers=0).get_result_html_path(url1) == html0
+
+
+def test_different_pdfs_with_the_same_filename(tmp_path, conversions):
+    paper_dir = LocalPaperDirectory(str(tmp_path / 'papers'), False, workers=0)
+    url0 = _write_pdf(str(tmp_path / 'a' / 'paper.pdf'), b'%PDF a')
+    url1 = _write_pdf(str(tmp_path / 'b' / 'paper.pdf'), b'%PDF b')
+
+    html0 = paper_dir.prepare_html(url0)
+    html1 = paper_dir.prepare_html(url1)
+    assert html0 != html1
+    with open(html1, 'rb') as f:
+        assert f.read() == b'%PDF b'
+    assert len(conversions) == 2
+    # the pdf is kept beside its html
+    assert file_sha256(pjoin(os.path.dirname(html0), os.path.basename(html0)[:-len('_0.html')] + '.pdf')) == \
+           file_sha256(str(tmp_path / 'a' / 'paper.pdf'))
+
+
+def test_concurrent_requests_are_converted_once(tmp_path, conversions):
+    paper_dir = LocalPaperDirectory(str(tmp_path / 'papers'), False, workers=0)
+    urls = [_write_pdf(str(tmp_path / 'a' / 'paper.pdf'), b'%PDF same'),
+            _write_pdf(str(tmp_path / 'b' / 'copy.pdf'), b'%PDF same')]
+
+    with ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(paper_dir.prepare_html, urls * 4))
+    assert len(set(results)) == 1
+    assert len(conversions) == 1
+
+
+def test_result_key_depends_on_params():
+    key = ConversionCache.result_key('0' * 64, {'line_margin_rate': None, 'image_profile': 'png'})
+    assert key == ConversionCache.result_key('0' * 64, {'image_profile': 'png', 'line_margin_rate': None})
+    assert key != ConversionCache.result_key('0' * 64, {'line_margin_rate': None, 'image_profile': 'webp'})
+    assert key != ConversionCache.result_key('1' * 64, {'line_margin_rate': None, 'image_profile': 'png'})
+
+
+def test_tables_are_kept_in_the_database(tmp_path):
+    cache = ConversionCache(str(tmp_path))
+    html_path = str(tmp_path / 'paper' / 'paper_0.html')
+    _write_pdf(html_path, b'<html></html>')
+    cache.add_alias('http://example.com/paper.pdf', 'a' * 64)
+    cache.set_validators('http://example.com/paper.pdf', {'ETag': '"1"'})
+    cache.add_result('key', 'a' * 64, {'image_profile': 'png'}, html_path, 'paper.pdf')
+    cache.close()
+
+    cache = ConversionCache(str(tmp_path))
+    assert cache.pdf_sha256('http://example.com/paper.pdf') == 'a' * 64
+    assert cache.pdf_sha256('http://example.com/other.pdf') is None
+    assert cache.validators('http://example.com/paper.pdf') == {'ETag': '"1"'}
+    assert cache.validators('http://example.com/other.pdf') == {}
+    assert cache.result_html('key') == html_path
+    (key, result), = cache.results()
+    assert key == 'key' and result['params'] == {'image_profile': 'png'}
+    assert result['html'] == pjoin('paper', 'paper_0.html')
+
@@ -0,0 +1,93 @@
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from paper2html.downloader import DownloadError, PdfDownloader
+from paper2html.local_paper_directory import LocalPaperDirectory
+
+
+class PdfServer(ThreadingHTTPServer):
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), PdfRequestHandler)
+        self.pdf = b'%PDF-1.4 ' + b'x' * 100000
+        self.etag = '"v1"'
+        self.connections = 0
+        self.requests = []
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.server_address[1]}{path}"
+
+
+class PdfRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.get('If-None-Match')))
+        if self.path == '/moved.pdf':
+            self.send_response(301)
+            self.send_header('Location', '/paper.pdf')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        elif self.headers.get('If-None-Match') == self.server.etag:
+            self.send_response(304)
+            self.send_header('ETag', self.server.etag)
+            self.end_headers()
+        else:
+            self.send_response(200)
+            self.send_header('ETag', self.server.etag)
+            self.send_header('Content-Type', 'application/pdf')
+            self.send_header('Content-Length', str(len(self.server.pdf)))
+            self.end_headers()
+            self.wfile.write(self.server.pdf)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = PdfServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_download_reuses_connection(server, tmp_path):
+    downloader = PdfDownloader()
+    path = str(tmp_path / 'paper.pdf')
+    assert downloader.download(server.url('/paper.pdf'), path) == {'etag': '"v1"'}
+    with open(path, 'rb') as f:
+        assert f.read() == server.pdf
+    downloader.download(server.url('/moved.pdf'), path)
+    assert [path for path, _ in server.requests] == ['/paper.pdf', '/moved.pdf', '/paper.pdf']
+    assert server.connections == 1
+    downloader.close()
+
+
+def test_download_size_limit(server, tmp_path):
+    path = str(tmp_path / 'paper.pdf')
+    with pytest.raises(DownloadError):
+        PdfDownloader(max_bytes=1000).download(server.url('/paper.pdf'), path)
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_revalidate_with_conditional_get(server, tmp_path, conversions):
+    paper_dir = LocalPaperDirectory(str(tmp_path), False, workers=0)
+    url = server.url('/paper.pdf')
+
+    result_html = paper_dir.prepare_html(url)
+    assert paper_dir.prepare_html(url) == result_html
+    assert server.requests[-1] == ('/paper.pdf', '"v1"') and len(conversions) == 1
+
+    server.pdf = b'%PDF-1.4 revised'
+    server.etag = '"v2"'
+    assert paper_dir.revalidate(url) is None
+    assert paper_dir.prepare_html(url) != result_html
+    assert len(conversions) == 2
+    paper_dir.shutdown()
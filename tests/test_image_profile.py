@@ -0,0 +1,32 @@
+from io import BytesIO
+import pytest
+from PIL import Image, ImageDraw
+from paper2html.image_profile import ImageProfile
+
+
+def _text_page():
+    image = Image.new('RGB', (1700, 2200), 'white')
+    draw = ImageDraw.Draw(image)
+    for y in range(100, 2100, 40):
+        draw.text((100, y), 'The quick brown fox jumps over the lazy dog %d' % y, fill='black')
+    return image
+
+
+@pytest.mark.parametrize('name', ['palette', 'webp', 'jpeg'])
+def test_encoded_page_is_smaller_than_png(name):
+    image = _text_page()
+    buffered = BytesIO()
+    image.save(buffered, format='PNG')
+    profile = ImageProfile.get(name)
+    encoded = profile.encode(image, text_only=True)
+    assert len(encoded) < len(buffered.getvalue())
+    decoded = Image.open(BytesIO(encoded))
+    assert decoded.format == profile.fmt.upper()
+    assert decoded.width <= (profile.max_width or image.width)
+
+
+def test_default_profile_keeps_original():
+    assert ImageProfile.get(None).keeps_original
+    assert not ImageProfile.get('webp').keeps_original
+    with pytest.raises(ValueError):
+        ImageProfile.get('gif')
@@ -0,0 +1,37 @@
+import threading
+from paper2html.jobs import JobManager
+
+
+def _wait_until_finished(job):
+    version = None
+    while not job.finished:
+        version = job.wait(version, 5)
+
+
+def test_job_for_the_same_url_is_shared():
+    release = threading.Event()
+
+    def convert(url, progress):
+        progress('rasterize', 1, 2)
+        release.wait(5)
+        return url + '.html'
+
+    jobs = JobManager(convert)
+    job = jobs.submit('http://example.com/paper.pdf')
+    assert jobs.submit('http://example.com/paper.pdf') is job
+    release.set()
+    _wait_until_finished(job)
+    assert job.to_dict()['progress'] == {'rasterize': {'done': 1, 'total': 2}}
+    assert job.result_html == 'http://example.com/paper.pdf.html'
+    # a finished job is not shared
+    assert jobs.submit('http://example.com/paper.pdf') is not job
+    assert jobs.get(job.id) is job
+
+
+def test_failed_job():
+    def convert(url, progress):
+        raise ValueError('broken pdf')
+
+    job = JobManager(convert).submit('http://example.com/paper.pdf')
+    _wait_until_finished(job)
+    assert job.state == 'failed' and job.error == 'broken pdf'
@@ -0,0 +1,27 @@
+from os.path import join as pjoin
+from PIL import Image
+from paper2html.page_image_store import PageImageStore
+
+
+def _make_pages(image_dir, n):
+    for i in range(n):
+        Image.new('RGB', (10, 20), (i, i, i)).save(pjoin(image_dir, 'pdf-%02d.png' % (i + 1)))
+
+
+def test_page_image_store_index(tmp_path):
+    _make_pages(str(tmp_path), 2)
+    store = PageImageStore(str(tmp_path))
+    assert store.path(1).endswith('pdf-02.png')
+    # pages rasterized after the index was built are found
+    Image.new('RGB', (10, 20)).save(pjoin(str(tmp_path), 'pdf-03.png'))
+    assert store.path(2).endswith('pdf-03.png')
+    assert store.size(2) == (10, 20)
+
+
+def test_page_image_store_cache_is_bounded(tmp_path):
+    _make_pages(str(tmp_path), 4)
+    store = PageImageStore(str(tmp_path), max_cache_bytes=2 * 10 * 20 * 3)
+    for page_n in range(4):
+        assert store.get(page_n).getpixel((0, 0)) == (page_n, page_n, page_n)
+    assert list(store._cache) == [2, 3]
+    assert store.get(3) is store.get(3)
@@ -1,8 +1,113 @@
+import random
 import pytest
-from paper2html.paper import BBox
+from PIL import Image
+from paper2html.page_image_store import PageImageStore
+from paper2html.paper import BBox, ItemIndex, PageAddress, PaperItem, PaperItemType, PaperPage
+from paper2html.bbox_table import BBoxTable
 
 
 def _test_bbox_collided():
     bbox0 = BBox((1, 1, 2, 2))
     bbox1 = BBox((2, 2, 3, 3))
     assert not BBox.collided(bbox0, bbox1)
+
+
+def test_item_index_collided():
+    rnd = random.Random(0)
+    index = ItemIndex()
+    items = []
+    for rank in range(300):
+        x, y = rnd.uniform(-50, 600), rnd.uniform(-50, 850)
+        bbox = BBox((x, y, x + rnd.uniform(0, 80), y + rnd.uniform(0, 30)), orig='LB')
+        item = PaperItem([], 0, bbox, "", PaperItemType.TextBox)
+        index.add(item, rank)
+        items.append(item)
+    for item in items[:50]:
+        query = item.bbox.inflate(5)
+        assert index.collided(query) == [item_ for item_ in items if BBox.collided(item_.bbox, query)]
+        # 離れた帯のitemはbboxの判定の対象にならない
+        assert len(index.candidate_rows(query)) < len(items) // 2
+
+
+def _columns_page(n_columns):
+    page = PaperPage(BBox((0, 0, 612, 792), orig='LB'), 0)
+    # 段をまたぐタイトル
+    page.add_item(PaperItem([], 0, BBox((100, 720, 500, 740), orig='LB'), "Title\n", PaperItemType.TextBox))
+    width = 540 / n_columns
+    for k in range(n_columns):
+        left = 36 + k * width
+        for line in range(40):
+            bottom = 60 + line * 15
+            page.add_item(PaperItem([], 0, BBox((left, bottom, left + width - 12, bottom + 10), orig='LB'),
+                                    "line\n", PaperItemType.TextBox))
+    return page
+
+
+@pytest.mark.parametrize("n_columns", [1, 2, 3])
+def test_address_items_columns(n_columns):
+    page = _columns_page(n_columns)
+    page._address_items()
+    addresses = {item.address for item in page.items}
+    if n_columns == 1:
+        # 1段組みではすべてLeftになる
+        assert addresses == {PageAddress.Left}
+    else:
+        assert addresses == {PageAddress.Head, *PageAddress.columns(n_columns)}
+    assert len(page.column_bboxes) == max(n_columns, 2)
+
+
+def test_bbox_table_matches_bbox():
+    rnd = random.Random(1)
+    bboxes = [BBox((x, y, x + rnd.uniform(0, 50), y + rnd.uniform(0, 20)), orig='LB')
+              for x, y in ((rnd.uniform(0, 600), rnd.uniform(0, 800)) for _ in range(200))]
+    table = BBoxTable()
+    for bbox in bboxes:
+        table.append(bbox)
+    query = BBox((100, 100, 300, 400), orig='LB')
+    assert table.collided(query).tolist() == [BBox.collided(bbox, query) for bbox in bboxes]
+    assert table.center_dist(query).tolist() == [BBox.center_dist(bbox, query) for bbox in bboxes]
+    unified = BBox.unify_bboxes(bboxes)
+    assert (unified.left, unified.bottom, unified.right, unified.top) == \
+           (min(table.left), min(table.bottom), max(table.right), max(table.top))
+
+
+def _equation_page(image_dir, monkeypatch):
+    Image.new('RGB', (612, 792), 'white').save(image_dir + '/pdf-01.png')
+    monkeypatch.setattr(PaperPage, 'image_store', PageImageStore(image_dir))
+    monkeypatch.setattr(PaperPage, 'crop_dir', image_dir)
+    page = PaperPage(BBox((0, 0, 612, 792), orig='LB'), 0)
+    texts = ["A paragraph of the body text which is long enough\n", "x = y + z\n", "(1)\n", "a + b = c\n",
+             "Figure 1. A caption of the figure\n", "Another paragraph of the body text which is long enough\n"]
+    top = 700
+    for text in texts:
+        # 短い行は数式のように段の中央に置く
+        left, right = (250, 360) if len(text) < 12 else (36, 576)
+        page.add_item(PaperItem([], 0, BBox((left, top - 10, right, top), orig='LB'), text, PaperItemType.TextBox))
+        top -= 15
+    page._address_items()
+    page._sort_items()
+    return page
+
+
+def test_recognize_items_reads_feature_table(tmp_path, monkeypatch):
+    page = _equation_page(str(tmp_path), monkeypatch)
+    parsed = []
+    is_caption = PaperPage._is_caption
+
+    def counting_is_caption(self, text):
+        parsed.append(text)
+        return is_caption(self, text)
+    monkeypatch.setattr(PaperPage, '_is_caption', counting_is_caption)
+
+    page._recognize_items()
+    assert [(item.type, item.text) for *_, item in page.sorted_items] == [
+        (PaperItemType.Paragraph, "A paragraph of the body text which is long enough\n"),
+        (PaperItemType.Paragraph, "x = y + z(1)a + b = c\n"),
+        (PaperItemType.Part_of_Object, "x = y + z\n"),
+        (PaperItemType.Part_of_Object, "(1)\n"),
+        (PaperItemType.Part_of_Object, "a + b = c\n"),
+        (PaperItemType.Caption, "Figure 1. A caption of the figure\n"),
+        (PaperItemType.Paragraph, "Another paragraph of the body text which is long enough\n"),
+    ]
+    # 近傍の走査で何度判定しても，テキストの解析はitemごとに1回だけ
+    assert len(parsed) == len(set(parsed)) and set(parsed) <= {item.text for *_, item in page.sorted_items}
@@ -0,0 +1,157 @@
+import json
+import os
+import re
+from os.path import join as pjoin
+import pytest
+from pdfminer.converter import PDFPageAggregator
+from pdfminer.layout import LAParams
+from pdfminer.pdfinterp import PDFResourceManager, PDFPageInterpreter
+from paper2html.html_paper import HtmlPaper
+from paper2html.paper import Paper
+from paper2html.paper_miner import PaperReader, PageStreamRecorder, probe_pdf
+
+
+def _sample_pdf(name):
+    test_dir, _ = os.path.split(__file__)
+    return pjoin(test_dir, 'sample_files', name)
+
+
+def test_recorded_layout_matches_aggregator():
+    pdf_filename = _sample_pdf('two_columns.pdf')
+    laparams = LAParams(line_margin=0.3, boxes_flow=1.0)
+    rsrcmgr = PDFResourceManager()
+    device = PDFPageAggregator(rsrcmgr, laparams=laparams)
+    interpreter = PDFPageInterpreter(rsrcmgr, device)
+    expected = []
+    for page in PaperReader._pdf_pages(pdf_filename):
+        interpreter.process_page(page)
+        expected.append([(type(item), item.bbox) for item in device.get_result()])
+
+    recorded_pages = list(PaperReader()._recorded_pages(pdf_filename))
+    for _ in range(2):
+        # 同じ記録から何度レイアウトしても結果は変わらない
+        actual = [[(type(item), item.bbox) for item in PageStreamRecorder.layout(recorded, laparams)]
+                  for recorded in recorded_pages]
+        assert actual == expected
+
+
+def test_lean_read_keeps_paragraphs(page_images):
+    pdf_filename = _sample_pdf('two_columns.pdf')
+    page_images(pdf_filename)
+
+    paper = PaperReader().read(pdf_filename)
+    lean_paper = PaperReader().read(pdf_filename, lean=True)
+    assert [p.content for p in lean_paper.paragraphs] == [p.content for p in paper.paragraphs]
+    for page in lean_paper.pages:
+        assert page.items == [] and page.sorted_items == []
+    assert all(item.lt_items == [] for paragraph in lean_paper.paragraphs for item in paragraph)
+
+
+def _paragraph_records(paper):
+    return [(p.content, [(item.page_n, item.address) for item in p]) for p in paper.paragraphs]
+
+
+@pytest.mark.parametrize('lean', [False, True])
+def test_parallel_read_matches_serial_read(page_images, monkeypatch, lean):
+    pdf_filename = _sample_pdf('two_columns.pdf')
+    page_images(pdf_filename)
+    # 先頭ページだけを手元で認識し，残りのページをワーカーに渡す
+    monkeypatch.setattr(PaperReader, 'zap_max', 0)
+
+    paper = PaperReader().read(pdf_filename, lean=lean)
+    parallel_paper = PaperReader().read(pdf_filename, workers=2, lean=lean)
+    assert len(parallel_paper.pages) == len(paper.pages) == 2 and paper.paragraphs
+    assert _paragraph_records(parallel_paper) == _paragraph_records(paper)
+
+    waited = []
+    waiting_paper = PaperReader().read(pdf_filename, workers=2, wait_for_image=waited.append, lean=lean)
+    assert waited == [0, 1]
+    assert _paragraph_records(waiting_paper) == _paragraph_records(paper)
+
+
+def test_streamed_html_matches_export(page_images):
+    pdf_filename = _sample_pdf('two_columns.pdf')
+    page_images(pdf_filename)
+
+    reader = PaperReader()
+    paper = reader.read(pdf_filename)
+    exported_path, = HtmlPaper(paper, 'two_columns').export()
+    with open(exported_path, encoding='utf-8_sig') as f:
+        exported = f.read()
+    os.remove(exported_path)
+
+    reader = PaperReader()
+    pages = reader.iter_pages(pdf_filename)
+    streamed_paper = Paper(reader.line_height, reader.line_margin)
+    chunks = list(HtmlPaper(streamed_paper, 'two_columns').export_stream(pages))
+    assert len(chunks) > len(streamed_paper.pages)
+    assert "".join(chunks) == exported
+    with open(exported_path, encoding='utf-8_sig') as f:
+        assert f.read() == exported
+    assert [p.content for p in streamed_paper.paragraphs] == [p.content for p in paper.paragraphs]
+
+
+def test_export_writes_text_index(tmp_path, page_images):
+    pdf_filename = _sample_pdf('two_columns.pdf')
+    page_images(pdf_filename)
+
+    paper = PaperReader().read(pdf_filename)
+    HtmlPaper(paper, 'two_columns').export()
+    # 索引のファイル名を渡したときだけ書き出す
+    assert not (tmp_path / 'resources' / 'paragraphs.jsonl').exists()
+    exported_path, = HtmlPaper(paper, 'two_columns').export(text_index_filename='paragraphs.jsonl')
+    with open(exported_path, encoding='utf-8_sig') as f:
+        exported = f.read()
+    with open(pjoin(str(tmp_path), 'resources', 'paragraphs.jsonl'), encoding='utf-8') as f:
+        records = [json.loads(line) for line in f]
+    assert records and all(record['html'] == 'two_columns_0.html' for record in records)
+    for record in records:
+        # 索引の段落はhtmlの同じidの要素に書かれている
+        match = re.search(r'id="txt%d">(.*?)</' % record['id'], exported, re.S)
+        assert match and match.group(1) == record['text']
+        assert record['page'] == paper.paragraphs[record['id']][0].page_n
+
+
+def _one_page_pdf(font, text):
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 200 200] /Resources << /Font << /F1 4 0 R >> >> "
+        b"/Contents 5 0 R >>",
+        font,
+    ]
+    content = b"BT /F1 12 Tf 20 100 Td " + text + b" Tj ET"
+    objects.append(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+    # ToUnicodeのないCIDフォント
+    objects.append(b"<< /Type /Font /Subtype /CIDFontType2 /BaseFont /Dummy "
+                   b"/CIDSystemInfo << /Registry (Adobe) /Ordering (Identity) /Supplement 0 >> >>")
+    pdf = b"%PDF-1.4\n"
+    offsets = []
+    for i, obj in enumerate(objects):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n" % (i + 1) + obj + b"\nendobj\n"
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    pdf += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return pdf
+
+
+def test_probe_pdf(tmp_path):
+    assert probe_pdf(_sample_pdf('two_columns.pdf')) is None
+
+    readable = str(tmp_path / 'readable.pdf')
+    with open(readable, 'wb') as f:
+        f.write(_one_page_pdf(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>", b"(Hello world)"))
+    assert probe_pdf(readable) is None
+
+    undecoded = str(tmp_path / 'undecoded.pdf')
+    with open(undecoded, 'wb') as f:
+        f.write(_one_page_pdf(b"<< /Type /Font /Subtype /Type0 /BaseFont /Dummy /Encoding /Identity-H "
+                              b"/DescendantFonts [6 0 R] >>", b"<0001000200030004>"))
+    assert 'not decoded' in probe_pdf(undecoded)
+
+    broken = str(tmp_path / 'broken.pdf')
+    with open(broken, 'wb') as f:
+        f.write(b'%PDF-1.4 truncated')
+    assert probe_pdf(broken) is not None
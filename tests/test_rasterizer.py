@@ -0,0 +1,101 @@
+import os
+import shutil
+import threading
+import pdf2image
+import pytest
+from PIL import Image
+from paper2html import commands
+from paper2html.commands import BackgroundRasterizer
+from paper2html.page_image_store import PageImageStore
+
+N_PAGES = 5
+
+
+class _Runs(list):
+    def __init__(self):
+        super().__init__()
+        self.failures = {}
+
+
+@pytest.fixture
+def fake_pdf2image(monkeypatch):
+    """
+    @return: list of (first page, last page) of the runs of the fake pdftoppm.
+        A run raises the exception set to the page in `failures`.
+    """
+    runs = _Runs()
+
+    def convert_from_path(pdf_filename, output_folder=None, output_file='pdf', first_page=1, last_page=N_PAGES,
+                          **kwargs):
+        runs.append((first_page, last_page))
+        if first_page in runs.failures:
+            raise runs.failures[first_page]
+        paths = []
+        for page in range(first_page, last_page + 1):
+            # pdf2imageの連番とpdftoppmのページ番号を付けたファイル名
+            paths.append(os.path.join(output_folder, '%s0001-%d.png' % (output_file, page)))
+            Image.new('RGB', (10 * page, 10), 'white').save(paths[-1])
+        return paths
+
+    monkeypatch.setattr(pdf2image, 'pdfinfo_from_path', lambda pdf_filename: {'Pages': N_PAGES})
+    monkeypatch.setattr(pdf2image, 'convert_from_path', convert_from_path)
+    return runs
+
+
+def test_pages_are_rasterized_in_growing_runs(tmp_path, fake_pdf2image):
+    reported = []
+    rasterizer = BackgroundRasterizer('paper.pdf', str(tmp_path), lambda *args: reported.append(args))
+    rasterizer.start()
+    for page_n in range(N_PAGES):
+        rasterizer.wait_for_page(page_n)
+        assert len(os.listdir(str(tmp_path))) > page_n
+    rasterizer.stop()
+    assert fake_pdf2image == [(1, 1), (2, 3), (4, 5)]
+    assert reported == [('rasterize', 1, N_PAGES), ('rasterize', 3, N_PAGES), ('rasterize', 5, N_PAGES)]
+    # ページ画像は実行ごとのファイル名でもページ順に並ぶ
+    store = PageImageStore(str(tmp_path))
+    assert [store.size(page_n)[0] for page_n in range(N_PAGES)] == [10, 20, 30, 40, 50]
+
+
+def test_error_is_raised_by_the_waiting_page(tmp_path, fake_pdf2image):
+    fake_pdf2image.failures[2] = RuntimeError('pdftoppm failed')
+    rasterizer = BackgroundRasterizer('paper.pdf', str(tmp_path))
+    rasterizer.start()
+    rasterizer.wait_for_page(0)
+    with pytest.raises(RuntimeError, match='pdftoppm failed'):
+        rasterizer.wait_for_page(1)
+    rasterizer.stop()
+
+
+@pytest.fixture
+def fake_reader(monkeypatch):
+    waited = []
+
+    def fake_read(pdf_filename, line_margin_rate, verbose, workers, wait_for_image, *args):
+        # ページを先頭から順に，画像を待ってから認識する
+        for page_n in range(N_PAGES):
+            wait_for_image(page_n)
+            waited.append(page_n)
+        return ['paper_0.html']
+
+    monkeypatch.setattr(commands, 'clean_pdf', lambda pdf, fixed_dir: shutil.copy(pdf, fixed_dir))
+    monkeypatch.setattr(commands, 'read_by_extended_pdfminer', fake_read)
+    return waited
+
+
+def _rasterizer_threads():
+    return [thread for thread in threading.enumerate() if isinstance(thread, BackgroundRasterizer)]
+
+
+def test_pipelined_conversion(tmp_path, fake_pdf2image, fake_reader):
+    pdf_filename = str(tmp_path / 'paper.pdf')
+    with open(pdf_filename, 'wb') as f:
+        f.write(b'%PDF paper')
+    assert commands.paper2html(pdf_filename, pipelined=True) == ['paper_0.html']
+    assert fake_reader == list(range(N_PAGES))
+    assert not _rasterizer_threads()
+
+    fake_pdf2image.failures[4] = RuntimeError('pdftoppm failed')
+    with pytest.raises(RuntimeError, match='pdftoppm failed'):
+        commands.paper2html(pdf_filename, pipelined=True)
+    assert not _rasterizer_threads()
@@ -0,0 +1,107 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from paper2html.scheduler import ConversionScheduler
+
+
+def _count(n):
+    for i in range(n):
+        yield str(i)
+
+
+def _count_and_return(n):
+    yield from _count(n)
+    return 'result'
+
+
+def _fail():
+    yield 'a'
+    raise ValueError('broken pdf')
+
+
+def test_run_once_coalesces_concurrent_calls():
+    scheduler = ConversionScheduler(0)
+    calls = []
+
+    def work():
+        calls.append(threading.get_ident())
+        time.sleep(0.1)
+        return 'result'
+
+    with ThreadPoolExecutor(4) as executor:
+        results = list(executor.map(lambda _: scheduler.run_once('key', work), range(4)))
+    assert results == ['result'] * 4
+    assert len(calls) == 1
+    # the key can be run again once it has landed
+    assert scheduler.run_once('key', work) == 'result' and len(calls) == 2
+
+
+def test_run_once_raises_for_all_callers():
+    scheduler = ConversionScheduler(0)
+
+    def work():
+        time.sleep(0.1)
+        raise ValueError('broken pdf')
+
+    with ThreadPoolExecutor(3) as executor:
+        futures = [executor.submit(scheduler.run_once, 'key', work) for _ in range(3)]
+    for future in futures:
+        with pytest.raises(ValueError):
+            future.result()
+
+
+def test_stream_in_worker_process():
+    scheduler = ConversionScheduler(1)
+    try:
+        assert list(scheduler.stream(_count, 3)) == ['0', '1', '2']
+        chunks = []
+
+        def relay():
+            result = yield from scheduler.stream(_count_and_return, 2)
+            chunks.append(result)
+        assert list(relay()) == ['0', '1'] and chunks == ['result']
+        with pytest.raises(ValueError):
+            list(scheduler.stream(_fail))
+    finally:
+        scheduler.shutdown()
+
+
+def test_stream_once_finishes_when_closed_early():
+    scheduler = ConversionScheduler(0)
+    produced = []
+
+    def work():
+        for chunk in _count(3):
+            produced.append(chunk)
+            yield chunk
+            time.sleep(0.2)
+        return 'result'
+
+    stream = scheduler.stream_once('key', work)
+    assert next(stream) == '0'
+    start = time.perf_counter()
+    stream.close()
+    # the rest of the work is not done on the thread closing the stream
+    assert time.perf_counter() - start < 0.2
+    waiting = scheduler.stream_once('key', work)
+    with pytest.raises(StopIteration) as stop:
+        next(waiting)
+    assert stop.value.value == ('result', False)
+    assert produced == ['0', '1', '2']
+
+
+def _report_pages(n_pages, progress=None):
+    for page in range(n_pages):
+        progress('recognize', page + 1, n_pages)
+    return n_pages
+
+
+def test_progress_is_relayed_from_worker_process():
+    scheduler = ConversionScheduler(1)
+    reports = []
+    try:
+        assert scheduler.run(_report_pages, 2, progress=lambda *report: reports.append(report)) == 2
+    finally:
+        scheduler.shutdown()
+    assert reports == [('recognize', 1, 2), ('recognize', 2, 2)]
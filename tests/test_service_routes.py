@@ -0,0 +1,58 @@
+import json
+import os
+from os.path import join as pjoin
+import pytest
+from paper2html.local_paper_directory import LocalPaperDirectory
+from paper2html.convert_service import create_app
+
+
+@pytest.fixture
+def paper_dir(tmp_path):
+    return LocalPaperDirectory(str(tmp_path), False, workers=0)
+
+
+@pytest.fixture
+def client(paper_dir):
+    return create_app(paper_dir).test_client()
+
+
+def test_assets_are_cached(paper_dir, client):
+    os.makedirs(pjoin(paper_dir.paper_dir, 'paper', 'resources'))
+    with open(pjoin(paper_dir.paper_dir, 'paper', 'resources', 'page.png'), 'wb') as f:
+        f.write(b'png')
+    with open(pjoin(paper_dir.paper_dir, 'secret.txt'), 'w') as f:
+        f.write('secret')
+
+    response = client.get('/paper2html/assets/paper/resources/page.png')
+    assert response.status_code == 200
+    assert response.data == b'png'
+    assert response.cache_control.max_age > 0
+    revalidated = client.get('/paper2html/assets/paper/resources/page.png',
+                             headers={'If-None-Match': response.headers['ETag']})
+    assert revalidated.status_code == 304
+    assert client.get('/paper2html/assets/paper/..%2Fsecret.txt').status_code == 404
+
+
+def test_job_reports_progress(paper_dir, monkeypatch):
+    result_html = pjoin(paper_dir.paper_dir, 'paper_0.html')
+
+    def fake_prepare_html(url, progress=None):
+        for page in range(3):
+            progress('recognize', page + 1, 3)
+        with open(result_html, 'w') as f:
+            f.write('<html></html>')
+        return result_html
+    monkeypatch.setattr(paper_dir, 'prepare_html', fake_prepare_html)
+    client = create_app(paper_dir).test_client()
+
+    response = client.post('/paper2html/jobs', data={'url': 'http://example.com/paper.pdf'})
+    assert response.status_code == 202
+    events = client.get(response.json['events_url']).get_data(as_text=True)
+    statuses = [json.loads(line[len('data: '):]) for line in events.splitlines() if line.startswith('data: ')]
+    assert statuses[-1]['state'] == 'done'
+    assert statuses[-1]['progress'] == {'recognize': {'done': 3, 'total': 3}}
+
+    status = client.get(response.headers['Location']).json
+    assert status['state'] == 'done' and 'result_url' in status
+    assert client.get('/paper2html/jobs/unknown').status_code == 404
+    assert client.post('/paper2html/jobs', data={'url': 'http://example.com/paper.html'}).status_code == 400
@@ -0,0 +1,37 @@
+import pytest
+from paper2html.paper import BBox, Paragraph, PaperItem, PaperItemType
+from paper2html.text_normalizer import TextNormalizer
+
+
+@pytest.mark.parametrize('texts, expected', [
+    (['Generative adversar-\nial networks\n'], 'Generative adversarial networks \n'),
+    (['a trained gen-\n', 'erator.\n'], 'a trained generator.\n\n'),
+    (['a self-\nattention layer\n'], 'a self-attention layer \n'),
+    (['state-of-the-\nart results\n'], 'state-of-the-art results \n'),
+    (['the U-\nNet and GPT-\n4\n'], 'the U-Net and GPT-4 \n'),
+    (['pages 10-\n20\n'], 'pages 10-20 \n'),
+    (['a - b and x- y\n'], 'a - b and x- y \n'),
+    (['first line.  \nsecond line  \n\nthird\n'], 'first line.\nsecond line third \n'),
+    (['no line break'], 'no line break \n'),
+    ([], '\n'),
+])
+def test_normalize(texts, expected):
+    assert TextNormalizer().normalize(texts) == expected
+
+
+def test_keep_hyphen_prefixes():
+    assert TextNormalizer(['multi']).normalize(['multi-\ntask\n']) == 'multi-task \n'
+    assert TextNormalizer([]).normalize(['multi-\ntask\n']) == 'multitask \n'
+
+
+def _item(text):
+    return PaperItem([], 0, BBox((0, 0, 1, 1), orig='LB'), text, PaperItemType.Paragraph)
+
+
+def test_paragraph_content_is_cached_until_changed():
+    paragraph = Paragraph([_item('adversar-\n')])
+    assert paragraph.content is paragraph.content
+    paragraph.append(_item('ial\n'))
+    assert paragraph.content == 'adversarial \n'
+    paragraph.extend(Paragraph([_item('networks.\n')]))
+    assert paragraph.content == 'adversarial networks.\n\n'
@@ -0,0 +1,57 @@
+import os
+import threading
+import time
+from paper2html.local_paper_directory import LocalPaperDirectory
+from paper2html.watch_queue import DebouncedQueue
+
+
+def test_events_of_a_path_are_coalesced():
+    handled = []
+    queue = DebouncedQueue(handled.append, workers=2, delay=0.1)
+    queue.start()
+    for _ in range(5):
+        queue.put('a.pdf')
+        queue.put('b.pdf')
+        time.sleep(0.02)
+    assert queue.join(5)
+    queue.stop()
+    assert sorted(handled) == ['a.pdf', 'b.pdf']
+
+
+def test_path_put_while_handled_is_handled_again():
+    started = threading.Event()
+    release = threading.Event()
+    handled = []
+
+    def handler(path):
+        handled.append(path)
+        started.set()
+        release.wait(5)
+
+    queue = DebouncedQueue(handler, workers=2, delay=0)
+    queue.start()
+    queue.put('a.pdf')
+    assert started.wait(5)
+    queue.put('a.pdf')
+    # the other thread must not handle the same path concurrently
+    time.sleep(0.1)
+    assert handled == ['a.pdf']
+    release.set()
+    assert queue.join(5)
+    queue.stop()
+    assert handled == ['a.pdf', 'a.pdf']
+
+
+def test_pdfs_placed_before_watching_are_converted(tmp_path, monkeypatch, conversions):
+    monkeypatch.setattr(LocalPaperDirectory, 'watch_delay', 0.1)
+    for i in range(3):
+        with open(str(tmp_path / f'paper{i}.pdf'), 'wb') as f:
+            f.write(b'%PDF ' + bytes([i]))
+
+    paper_dir = LocalPaperDirectory(str(tmp_path), True, workers=0)
+    try:
+        assert paper_dir.watch_queue.join(5)
+        assert len(conversions) == 3
+        assert not any(name.endswith('.pdf') for name in os.listdir(str(tmp_path)))
+    finally:
+        paper_dir.shutdown()